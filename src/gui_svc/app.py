@@ -11,7 +11,8 @@ import uvicorn
 import base64
 
 from collections import OrderedDict
-from flask import Flask, render_template, request, jsonify, session
+from datetime import datetime, timezone
+from flask import Flask, render_template, request, jsonify, session, stream_with_context
 from flask_wtf import FlaskForm
 from azure.monitor.opentelemetry import configure_azure_monitor
 from opentelemetry.instrumentation.flask import FlaskInstrumentor
@@ -146,8 +147,27 @@ def poster_generate():
     logger.info("* movie_id: %s", movie_id)
     logger.info("* desc: %s", desc)
     
-    generated_poster = movie_poster_client.generate_poster(movie_id, desc)
-    return render_template('poster.html', url=generated_poster['url'], error=generated_poster['error'])
+    try:
+        job = movie_poster_client.submit_poster_job(movie_id, desc)
+    except Exception as e:
+        logger.exception("Error in submit_poster_job")
+        return render_template('poster.html', error=f"Error in generate_poster: {e}")
+    if job['status'] in ('succeeded', 'failed'):
+        return render_template('poster.html', url=job['url'], error=job['error'])
+    return render_template('poster_job.html', job=job)
+
+@app.route('/poster/jobs/<job_id>', methods=['GET'])
+def poster_job(job_id: str):
+    """Function to poll a movie poster generation job."""
+    logger.info("poster_job %s", job_id)
+    try:
+        job = movie_poster_client.get_poster_job(job_id)
+    except Exception as e:
+        logger.exception("Error in get_poster_job")
+        return render_template('poster.html', error=f"Error in generate_poster: {e}")
+    if job['status'] in ('succeeded', 'failed'):
+        return render_template('poster.html', url=job['url'], error=job['error'])
+    return render_template('poster_job.html', job=job)
 
 @app.route('/poster/<movie_id>.png', methods=['GET'])
 def poster(movie_id:str):
@@ -155,15 +175,21 @@ def poster(movie_id:str):
     logger.info("poster %s", movie_id)
     url = movie_poster_client.redirect_poster_url(movie_id)
     logger.info("url: %s", url)
+    # forward the browser validators so the poster service can answer 304 Not Modified,
+    # and the accepted formats and the rendition parameters (?w=300&fmt=webp) so it can send a smaller image
+    conditional_headers = {name: request.headers[name] for name in ('If-None-Match', 'If-Modified-Since', 'Accept') if name in request.headers}
     #stream the content of the url
-    response = requests.get(url, stream=True, timeout=100)
+    response = requests.get(url, params=request.args, headers=conditional_headers, stream=True, timeout=100)
     logger.info("response: %s", response)
+    cache_headers = {name: response.headers[name] for name in ('ETag', 'Last-Modified', 'Cache-Control', 'Vary', 'Content-Disposition') if name in response.headers}
+    if response.status_code == 304:
+        return app.response_class(status=304, headers=cache_headers)
     if response.status_code != 200:
         return f"Failed to retrieve the image. /poster/{movie_id}.png", response.status_code
     def generate():
         for chunk in response.iter_content(chunk_size=8192):
             yield chunk
-    return app.response_class(generate(), content_type=response.headers['Content-Type'])
+    return app.response_class(generate(), content_type=response.headers['Content-Type'], headers=cache_headers)
 
 ui_design = os.getenv("UI_DESIGN", "xxx")
 @ app.route('/movie/generate', methods=['POST'])
@@ -200,6 +226,8 @@ def movie_generate():
             "language": language
         }
         logger.info("movie generate data: %s", json.dumps(data, indent=2))
+        if 'text/event-stream' in request.headers.get('Accept', '') or request.form.get('stream'):
+            return movie_generate_stream(endpoint, data, genre, movie1_id, movie2_id)
         try:
             response = requests.post(
                 f"{endpoint}/generate",
@@ -208,21 +236,7 @@ def movie_generate():
             )
             response.raise_for_status()
             generated_movie = response.json()
-            genre_index = genre_list.index(genre) if genre in genre_list else -1
-            #generate the generated movie id
-            if 'id' not in generated_movie:
-                logger.error("!!!! No id in generated movie, generating one")
-                generated_movie['id'] = f"{genre_index}_{movie1_id}_{movie2_id}_{random.randint(10000, 99999)}"
-
-            logger.info("Generated movie: %s", json.dumps(generated_movie, indent=2))
-            with DaprClient() as d:
-                logger.info(f"Invoke movie gallery service to save the generated movie {generated_movie['id']}")
-                d.invoke_method(
-                    app_id="movie-gallery-svc",
-                    method_name="movies",
-                    data=json.dumps(generated_movie),
-                    http_verb='POST'
-                )
+            save_generated_movie(generated_movie, genre, movie1_id, movie2_id)
         except Exception as e:
             logger.exception("Exception in calling movie_generate service", exc_info=e)
             generated_movie = {
@@ -232,20 +246,90 @@ def movie_generate():
             }
         return render_template('generated_movie.html', generated_movie=generated_movie)
 
+def save_generated_movie(generated_movie: dict, genre: str, movie1_id: str, movie2_id: str):
+    """Save the generated movie in the movie gallery."""
+    genre_index = genre_list.index(genre) if genre in genre_list else -1
+    #generate the generated movie id
+    if 'id' not in generated_movie:
+        logger.error("!!!! No id in generated movie, generating one")
+        generated_movie['id'] = f"{genre_index}_{movie1_id}_{movie2_id}_{random.randint(10000, 99999)}"
+    # the creation time of the new movie, in the fixed-width UTC format of the gallery
+    if not generated_movie.get('created_at'):
+        generated_movie['created_at'] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    logger.info("Generated movie: %s", json.dumps(generated_movie, indent=2))
+    with DaprClient() as d:
+        logger.info(f"Invoke movie gallery service to save the generated movie {generated_movie['id']}")
+        d.invoke_method(
+            app_id="movie-gallery-svc",
+            method_name="movies",
+            data=json.dumps(generated_movie),
+            http_verb='POST'
+        )
+
+def movie_generate_stream(endpoint: str, data: dict, genre: str, movie1_id: str, movie2_id: str):
+    """Relay the Server-Sent Events of the movie generator service.
+    The status and token events are forwarded as they arrive; on the terminal movie event the movie is saved
+    in the gallery and forwarded, followed by an html event with the rendered generated movie."""
+    logger.info("Calling movie_generate stream service at %s", endpoint)
+
+    def sse(event: str, payload) -> str:
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    def relay():
+        try:
+            with requests.post(f"{endpoint}/generate/stream", json=data, stream=True, timeout=1000,
+                               headers={'Accept': 'text/event-stream'}) as response:
+                response.raise_for_status()
+                event, lines = "message", []
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        lines.append(line[len("data:"):].strip())
+                    elif not line and lines:
+                        payload = json.loads("\n".join(lines))
+                        if event == "movie":
+                            save_generated_movie(payload, genre, movie1_id, movie2_id)
+                            yield sse(event, payload)
+                            yield sse("html", render_template('generated_movie.html', generated_movie=payload))
+                        else:
+                            yield sse(event, payload)
+                        event, lines = "message", []
+        except Exception as e:
+            logger.exception("Exception in calling movie_generate stream service", exc_info=e)
+            yield sse("error", {"detail": f"Error in calling movie_generate service: {e}"})
+
+    return app.response_class(stream_with_context(relay()), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def response_header(resp, name: str):
+    """Header of a Dapr service invocation response, whose names may come lowercased and values as lists"""
+    for key, value in (resp.headers or {}).items():
+        if key.lower() == name.lower():
+            return value[0] if isinstance(value, (list, tuple)) else value
+    return None
+
 @app.route('/gallery', methods=['GET'])
 def movie_gallery():
-    """Display all movies from the movie gallery service."""
+    """Display one page of movies from the movie gallery service."""
     logger.info("Accessing movie gallery")
     movies = []
+    next_page_token = None
     try:
         with DaprClient() as d:
-            logger.info("Invoking movie gallery service to get all movies")
+            logger.info("Invoking movie gallery service to get a page of movies")
+            query = {"sort": "created_at", "order": "desc", "limit": os.getenv("GALLERY_PAGE_SIZE", "100")}
+            if request.args.get('page_token'):
+                query['page_token'] = request.args['page_token']
             resp = d.invoke_method(
                 app_id="movie-gallery-svc",
                 method_name="movies",
-                http_verb='GET'
+                http_verb='GET',
+                http_querystring=query
             )
             logging.info(f"Response from movie gallery service: {resp}")
+            next_page_token = response_header(resp, 'X-Next-Page-Token')
             # Properly access data from Dapr InvokeMethodResponse object
             if resp.data:
                 movies = json.loads(resp.data.decode('utf-8'))
@@ -267,7 +351,7 @@ def movie_gallery():
     except Exception as e:
         logger.exception("Error retrieving movies from gallery service", exc_info=e)
         
-    return render_template('gallery.html', movies=movies, github=GitHubContext())
+    return render_template('gallery.html', movies=movies, next_page_token=next_page_token, github=GitHubContext())
 
 @app.route('/delete_movie/<movie_id>', methods=['DELETE'])
 def delete_movie(movie_id):
@@ -64,6 +64,39 @@ class MoviePosterClient:
             logger.error("Failed to retrieve data: %s %s", response.status_code, response.text)
             raise Exception(f"Failed to retrieve the poster: {response.status_code} {response.text}")
         
+    def submit_poster_job(self, movie_id: str, desc: str) -> dict:
+        """queue the generation of the image, return the job without waiting for the image.
+        A poster service without a shared job store generates the image at once: the job is then already done"""
+        logger.info("submit_poster_job of %s based on %s", movie_id, desc)
+        endpoint = f"{self._endpoint}/generate?background=true"
+        poster = {
+            "id": movie_id,
+            "description": desc,
+            "title":"movieposter"
+        }
+        response = requests.post(endpoint, json=poster, headers=self._headers, timeout=1000)
+        logger.info("Response: %s", response)
+        if response.status_code == 202:
+            return response.json()
+        elif response.status_code == 200:
+            json_response = response.json()
+            return {"id": None, "movie_id": movie_id, "status": "failed" if json_response.get("error") else "succeeded",
+                    "url": json_response.get("url"), "error": json_response.get("error")}
+        else:
+            logger.error("Failed to submit the poster job: %s %s", response.status_code, response.text)
+            raise Exception(f"Failed to submit the poster job: {response.status_code} {response.text}")
+
+    def get_poster_job(self, job_id: str, wait: int = 20) -> dict:
+        """get the poster generation job, waiting up to `wait` seconds for its completion"""
+        endpoint = f"{self._endpoint}/jobs/{job_id}?wait={wait}"
+        logger.info("Calling endpoint %s", endpoint)
+        response = requests.get(endpoint, headers=self._headers, timeout=wait + 30)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.error("Failed to retrieve the poster job: %s %s", response.status_code, response.text)
+            raise Exception(f"Failed to retrieve the poster job: {response.status_code} {response.text}")
+
     def redirect_poster_url(self, movie_id: str) -> str:
         """redirect to the image"""
         endpoint = f"{self._endpoint}/poster/{movie_id}.png"
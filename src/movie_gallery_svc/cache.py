@@ -0,0 +1,106 @@
+"""In-process read cache of the movies and of the GET /movies pages."""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+logging.basicConfig(level=logging.INFO)
+
+
+@dataclass
+class CachedPage:
+    """A GET /movies response: its JSON body, its headers and the ETag of the body"""
+    content: bytes
+    headers: dict = field(default_factory=dict)
+    etag: str = ""
+
+    def __post_init__(self):
+        if not self.etag:
+            self.etag = f'"{hashlib.sha256(self.content).hexdigest()[:32]}"'
+
+
+class LRU:
+    """LRU map whose entries expire `ttl` seconds after they were stored"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class MovieCache:
+    """Movies by ID (with their store ETag) and GET /movies pages, kept `ttl` seconds.
+
+    Every write of this replica invalidates the movie and all the pages, as does an invalidation published by another replica.
+    `generation` changes on each invalidation: a value read from the store before an invalidation is not cached,
+    it may already be stale. The TTL bounds the staleness of what the invalidations do not reach."""
+
+    def __init__(self, ttl: float = 30.0, max_movies: int = 10000, max_pages: int = 256):
+        self.enabled = ttl > 0
+        self.generation = 0
+        self._movies = LRU(max_movies, ttl)
+        self._pages = LRU(max_pages, ttl)
+        self._lock = threading.Lock()
+
+    def get_movie(self, movie_id: str) -> Optional[tuple[Any, Optional[str]]]:
+        """(movie, etag) of a cached movie, None on a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            return self._movies.get(movie_id)
+
+    def put_movie(self, movie_id: str, movie: Any, etag: Optional[str], generation: int) -> None:
+        with self._lock:
+            if self.enabled and generation == self.generation:
+                self._movies.put(movie_id, (movie, etag))
+
+    def get_page(self, key: str) -> Optional[CachedPage]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            return self._pages.get(key)
+
+    def put_page(self, key: str, page: CachedPage, generation: int) -> None:
+        with self._lock:
+            if self.enabled and generation == self.generation:
+                self._pages.put(key, page)
+
+    def invalidate(self, movie_ids: Optional[list[str]] = None) -> None:
+        """Forget the movies (all of them when None) and every page, which may list them"""
+        with self._lock:
+            self.generation += 1
+            if movie_ids is None:
+                self._movies.clear()
+            else:
+                for movie_id in movie_ids:
+                    self._movies.pop(movie_id)
+            self._pages.clear()
+        logging.info("Movie cache invalidated: %s, generation %d", movie_ids if movie_ids is not None else "all", self.generation)
@@ -7,6 +7,10 @@ class MovieRequest(BaseModel):
     title: str
     description: str
 
+class MovieIdsRequest(BaseModel):
+    """Request model for the batch operations on movies."""
+    ids: list[str]
+
 class Movie(BaseModel):
     """Enhanced Movie model with all required fields"""
     id: str
@@ -44,6 +48,8 @@ class GeneratedMovie(Movie):
     """Model for generated movie data extending the base Movie class"""
     prompt: str
     payload: MoviePayload
+    # UTC creation time set by the writer of a new movie (format_created_at), None for the movies stored before it was recorded
+    created_at: Optional[str] = None
 
     class Config:
         """Pydantic model configuration"""
@@ -3,11 +3,18 @@ import logging
 import uvicorn
 import traceback
 import base64
+import os
+import socket
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Literal, Optional
 
-from entities import GeneratedMovie
-from store import MovieStore
+from entities import GeneratedMovie, MovieIdsRequest
+from store import ConcurrencyError, MovieFilter, MoviePage, MovieStore, parse_fields, stamp_created_at
+from cache import CachedPage, MovieCache
+from health import dapr_sidecar_probe, health_checker_from_env
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from fastapi import FastAPI, Response, status, Request
+from fastapi import FastAPI, Header, Query, Response, status, Request
 from fastapi.responses import HTMLResponse
 from dapr.clients import DaprClient
 from dapr.ext.fastapi import DaprApp
@@ -16,16 +23,79 @@ from cloudevents.http import from_http
 
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI()
+# readiness: the Dapr sidecar (state store, pub/sub, bindings) checked in the background every HEALTH_CHECK_INTERVAL seconds
+health = health_checker_from_env()
+health.add("dapr", dapr_sidecar_probe(health.timeout))
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Check the dependencies in the background."""
+    health.start()
+    yield
+    await health.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 dapr_app = DaprApp(app)
 dapr_client = DaprClient()
 store=MovieStore(dapr_client)
+# movies and GET /movies pages cached MOVIES_CACHE_TTL_SECONDS (0 disables the cache),
+# invalidated by every write and delete of any replica through the movie-cache-invalidations topic
+movie_cache = MovieCache(ttl=float(os.getenv("MOVIES_CACHE_TTL_SECONDS", "30")),
+                         max_movies=int(os.getenv("MOVIES_CACHE_MAX_MOVIES", "10000")),
+                         max_pages=int(os.getenv("MOVIES_CACHE_MAX_PAGES", "256")))
+MOVIE_CACHE_PUBSUB = os.getenv("MOVIES_CACHE_PUBSUB", "moviecachepubsub")
+MOVIE_CACHE_TOPIC = "movie-cache-invalidations"
+# each replica has its own subscription (Service Bus subscription names are at most 50 characters),
+# so every replica receives every invalidation instead of one replica per app-id
+MOVIE_CACHE_CONSUMER_ID = os.getenv("MOVIES_CACHE_CONSUMER_ID") or \
+    os.getenv("CONTAINER_APP_REPLICA_NAME", socket.gethostname())[-50:]
 
 FastAPIInstrumentor.instrument_app(app, excluded_urls="liveness,readiness")
 
 # Define the storage queue binding name
 STORAGE_QUEUE_BINDING = "movieposters-events-queue"
 
+# GET /movies returns every movie unless a page is asked: `limit` movies (at most MOVIES_MAX_PAGE_SIZE),
+# MOVIES_PAGE_SIZE with a page_token alone; MOVIES_PAGE_SIZE is also the page size of the unpaged listing
+MOVIES_PAGE_SIZE = int(os.getenv("MOVIES_PAGE_SIZE", "100"))
+MOVIES_MAX_PAGE_SIZE = int(os.getenv("MOVIES_MAX_PAGE_SIZE", "1000"))
+NEXT_PAGE_TOKEN_HEADER = "X-Next-Page-Token"
+# POST /movies/bulk, /movies:batchGet and /movies:batchDelete handle at most MOVIES_BULK_MAX_SIZE movies per request,
+# the movies of a batch are read (or deleted, when the store cannot run transactions) MOVIES_BATCH_PARALLELISM at a time
+MOVIES_BULK_MAX_SIZE = int(os.getenv("MOVIES_BULK_MAX_SIZE", "500"))
+MOVIES_BATCH_PARALLELISM = int(os.getenv("MOVIES_BATCH_PARALLELISM", "10"))
+
+
+def too_many_movies(count: int) -> Optional[Response]:
+    """413 response of a batch over MOVIES_BULK_MAX_SIZE movies"""
+    if count <= MOVIES_BULK_MAX_SIZE:
+        return None
+    return Response(content=json.dumps({'error': f"at most {MOVIES_BULK_MAX_SIZE} movies per request"}),
+                    media_type="application/json", status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+def invalidate_movies(movie_ids: list[str]) -> None:
+    """Forget the cached copies of the movies here, and on the other replicas through the movie-cache-invalidations topic"""
+    movie_cache.invalidate(movie_ids)
+    try:
+        dapr_client.publish_event(pubsub_name=MOVIE_CACHE_PUBSUB, topic_name=MOVIE_CACHE_TOPIC,
+                                  data=json.dumps({"ids": movie_ids, "replica": MOVIE_CACHE_CONSUMER_ID}),
+                                  data_content_type="application/json")
+    except Exception as e:
+        # the other replicas serve their copies until MOVIES_CACHE_TTL_SECONDS
+        logging.error("Error publishing the invalidation of movies %s: %s", movie_ids, e)
+
+def quote_etag(etag: str) -> str:
+    """ETag header of the ETag of a stored movie: a quoted string"""
+    return f'"{etag}"'
+
+def unquote_etags(header: Optional[str]) -> list[str]:
+    """ETags of the stored movies named by an If-Match / If-None-Match header, quoted or not, weak or not ("*" kept)"""
+    if not header:
+        return []
+    return [tag.strip().removeprefix("W/").strip('"') for tag in header.split(",") if tag.strip()]
+
 @app.get('/', response_class = HTMLResponse)
 def root():
     """
@@ -96,6 +166,14 @@ async def movieposters_events_handler(request: Request):
             if len(parts) >= 6 and parts[3] == 'containers' and parts[5] == 'blobs':
                 container_name = parts[4]
                 blob_name = '/'.join(parts[6:])  # Join in case the blob name contains slashes
+                if blob_name.startswith('renditions/'):
+                    # resized copies written by the movie poster service, not a new poster
+                    logging.info("Ignoring poster rendition %s", blob_name)
+                    return Response(
+                        content=json.dumps({"success": True, "ignored": blob_name}),
+                        media_type="application/json",
+                        status_code=status.HTTP_200_OK
+                    )
                 
                 # Extract movie_id from blob name - assuming format like "525_346698_Romance_10630.png"
                 # where 525_346698_Romance_10630 is the movie_id
@@ -133,12 +211,13 @@ async def movieposters_events_handler(request: Request):
                     
                     logging.info("Blob URL: %s", blob_url)
                     
-                    # Get the movie and update it with the poster URL
-                    movie = store.try_find_by_id(movie_id)
-                    if movie:
+                    # Get the movie and update it with the poster URL, unless it changed in between
+                    def set_poster(movie: GeneratedMovie) -> None:
                         movie.internal_poster_url = blob_url
                         movie.poster_url = f"/poster/{movie_id}.png"
-                        store.upsert(movie)
+                    movie = store.update(movie_id, set_poster)
+                    if movie:
+                        invalidate_movies([movie_id])
                         logging.info("Updated movie %s with poster URL %s", movie_id, blob_url)
                         logging.info("Publishing movie update event for movie ID %s", movie_id)
                         # Publish an event to notify other services of the update
@@ -169,24 +248,106 @@ async def movieposters_events_handler(request: Request):
         )
 
 @app.post("/movies", status_code = status.HTTP_201_CREATED)
-def add_movie(movie: GeneratedMovie) -> GeneratedMovie:
-    """Endpoint to add a new movie."""
+def add_movie(movie: GeneratedMovie, if_match: Optional[str] = Header(None)) -> GeneratedMovie:
+    """Endpoint to add a new movie.
+    With the If-Match header (the ETag of GET /movies/{movie_id}), the movie is only replaced if it did not change since."""
     try:
         logging.info("Adding new movie %s", movie)
-        inserted_generated_movie=store.upsert(movie)
+        etags = unquote_etags(if_match)
+        # If-Match: * (any version) adds no condition to the write
+        etag = etags[0] if etags and etags[0] != "*" else None
+        if etag is None:
+            # a replace with If-Match keeps the created_at the movie was read with
+            stamp_created_at([movie])
+        inserted_generated_movie=store.upsert(movie, etag=etag)
+        invalidate_movies([movie.id])
         return inserted_generated_movie
+    except ConcurrencyError as e:
+        logging.warning('Add_Movie Conflict: %s', e)
+        return Response(content=json.dumps({'method': 'add_movie', 'error': str(e)}), media_type="application/json",
+                        status_code=status.HTTP_412_PRECONDITION_FAILED)
     except Exception as e:
         logging.error('Add_Movie Error: %s', e)
         logging.error('Call stack: %s', traceback.format_exc())
         return Response(content = json.dumps({'method':'add_movie','error':e}), media_type = "application/json")
 
+@app.post("/movies/bulk", status_code=status.HTTP_201_CREATED)
+def add_movies(movies: list[GeneratedMovie]) -> list[GeneratedMovie]:
+    """Endpoint to add or replace many movies in one write to the store."""
+    logging.info("Adding %d movies", len(movies))
+    if (too_many := too_many_movies(len(movies))) is not None:
+        return too_many
+    try:
+        stamp_created_at(movies)
+        inserted_movies = store.upsert_bulk(movies)
+        invalidate_movies([movie.id for movie in movies])
+        return inserted_movies
+    except Exception as e:
+        logging.error('Add_Movies Error: %s', e)
+        logging.error('Call stack: %s', traceback.format_exc())
+        return Response(content=json.dumps({'method': 'add_movies', 'error': str(e)}), media_type="application/json",
+                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@app.post("/movies:batchGet")
+def batch_get_movies(request: MovieIdsRequest, fields: Optional[str] = None):
+    """Endpoint to get many movies by ID in one call: {"movies": [...], "missing": [ids not found]}.
+    `fields` (e.g. id,title,poster_url) returns only these fields of each movie."""
+    logging.info("Getting %d movies", len(request.ids))
+    if (too_many := too_many_movies(len(request.ids))) is not None:
+        return too_many
+    try:
+        projection = parse_fields(fields) if fields else None
+    except ValueError as e:
+        return Response(content=json.dumps({"error": str(e)}), media_type="application/json", status_code=status.HTTP_400_BAD_REQUEST)
+    try:
+        movies, missing = store.find_many(list(dict.fromkeys(request.ids)), MOVIES_BATCH_PARALLELISM, projection)
+        if not projection:
+            movies = [movie.model_dump(mode="json") for movie in movies]
+        return {"movies": movies, "missing": missing}
+    except Exception as e:
+        logging.error('Batch_Get_Movies Error: %s', e)
+        logging.error('Call stack: %s', traceback.format_exc())
+        return Response(content=json.dumps({'method': 'batch_get_movies', 'error': str(e)}), media_type="application/json",
+                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@app.post("/movies:batchDelete")
+def batch_delete_movies(request: MovieIdsRequest):
+    """Endpoint to delete many movies by ID in one call; deleting a movie that does not exist is not an error."""
+    logging.info("Deleting %d movies", len(request.ids))
+    if (too_many := too_many_movies(len(request.ids))) is not None:
+        return too_many
+    try:
+        movie_ids = list(dict.fromkeys(request.ids))
+        try:
+            store.delete_many(movie_ids, MOVIES_BATCH_PARALLELISM)
+        finally:
+            invalidate_movies(movie_ids)
+        return {"deleted": movie_ids}
+    except Exception as e:
+        logging.error('Batch_Delete_Movies Error: %s', e)
+        logging.error('Call stack: %s', traceback.format_exc())
+        return Response(content=json.dumps({'method': 'batch_delete_movies', 'error': str(e)}), media_type="application/json",
+                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @app.get("/movies/{movie_id}", response_model=GeneratedMovie)
-def get_movie(movie_id: str) -> GeneratedMovie:
-    """Endpoint to get a movie by ID."""
+def get_movie(movie_id: str, response: Response, if_none_match: Optional[str] = Header(None)) -> GeneratedMovie:
+    """Endpoint to get a movie by ID, with the ETag of its stored version; 304 when it matches If-None-Match."""
     logging.info("Getting movie with ID: %s", movie_id)
     try:
-        movie = store.try_find_by_id(movie_id)
+        cached = movie_cache.get_movie(movie_id)
+        if cached is None:
+            generation = movie_cache.generation
+            movie, etag = store.try_find_with_etag(movie_id)
+            if movie:
+                movie_cache.put_movie(movie_id, movie, etag, generation)
+        else:
+            movie, etag = cached
         if movie:
+            if etag:
+                if_none_match = unquote_etags(if_none_match)
+                if etag in if_none_match or "*" in if_none_match:
+                    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": quote_etag(etag)})
+                response.headers["ETag"] = quote_etag(etag)
             return movie
         else:
             return Response(content=json.dumps({}), media_type="application/json", status_code=status.HTTP_404_NOT_FOUND)
@@ -197,23 +358,51 @@ def get_movie(movie_id: str) -> GeneratedMovie:
     
 
 @app.get("/movies", response_model=list[GeneratedMovie])
-def list_movies() -> list[GeneratedMovie]:
-    """Endpoint to list all movies."""
-    logging.info("Listing all movies")
+def list_movies(request: Request,
+                limit: Optional[int] = Query(None, ge=1, le=MOVIES_MAX_PAGE_SIZE),
+                page_token: Optional[str] = None,
+                genre: Optional[str] = None,
+                has_poster: Optional[bool] = None,
+                created_after: Optional[datetime] = None,
+                created_before: Optional[datetime] = None,
+                sort: Optional[Literal["created_at", "title"]] = None,
+                order: Literal["asc", "desc"] = "desc",
+                fields: Optional[str] = None,
+                if_none_match: Optional[str] = Header(None)) -> list[GeneratedMovie]:
+    """Endpoint to list the movies, every one of them, or one page at a time with `limit` or `page_token`.
+    The X-Next-Page-Token response header holds the page_token of the next page, it is missing on the last page.
+    The ETag response header identifies the page content: with it in If-None-Match, an unchanged page answers 304.
+    `fields` (e.g. id,title,poster_url) returns only these fields of each movie."""
+    logging.info("Listing movies, limit: %s, page token: %s, fields: %s", limit, page_token, fields)
+    try:
+        projection = parse_fields(fields) if fields else None
+    except ValueError as e:
+        return Response(content=json.dumps({"error": str(e)}), media_type="application/json", status_code=status.HTTP_400_BAD_REQUEST)
     try:
-        logging.info('initializing Dapr client')
-        movies = store.find_all()
-        # remove prompt from the movie
-        for movie in movies:
-            if isinstance(movie, GeneratedMovie):
-                movie.prompt = None
-                #movie.payload = None
-        # convert to JSON
-        d_movies = [movie.to_json() for movie in movies]
-        logging.info('Movies JSON: %s', d_movies)
-        # return as JSON
-        logging.info('Returning movies as JSON')
-        return movies
+        cache_key = str(sorted(request.query_params.multi_items()))
+        cached = movie_cache.get_page(cache_key)
+        if cached is None:
+            generation = movie_cache.generation
+            movie_filter = MovieFilter(genre=genre, has_poster=has_poster, created_after=created_after,
+                                       created_before=created_before, sort=sort, order=order)
+            if limit is None and page_token is None:
+                # no paging asked: the whole gallery, read page by page from the store
+                page = MoviePage(store.find_all(movie_filter, MOVIES_PAGE_SIZE, projection))
+            else:
+                page = store.find_page(movie_filter, limit or MOVIES_PAGE_SIZE, page_token, projection)
+            if not projection:
+                # remove prompt from the movie
+                for movie in page.movies:
+                    movie.prompt = None
+                page.movies = [movie.model_dump(mode="json") for movie in page.movies]
+            # serialized once here, without the GeneratedMovie response model, then served from the cache
+            cached = CachedPage(json.dumps(page.movies, separators=(",", ":")).encode(), {NEXT_PAGE_TOKEN_HEADER: page.token} if page.token else {})
+            movie_cache.put_page(cache_key, cached, generation)
+        headers = {**cached.headers, "ETag": cached.etag}
+        if cached.etag.strip('"') in unquote_etags(if_none_match):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        logging.info('Returning %d bytes of movies as JSON', len(cached.content))
+        return Response(content=cached.content, media_type="application/json", headers=headers)
     except Exception as e:
         logging.error('RuntimeError: %s', e)
         return Response(content=json.dumps([]), media_type="application/json", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -234,6 +423,7 @@ def delete_movie(movie_id: str):
         
         # Delete the movie
         success = store.delete(movie_id)
+        invalidate_movies([movie_id])
         if success:
             logging.info("Movie %s successfully deleted", movie_id)
             return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -252,6 +442,25 @@ def delete_movie(movie_id: str):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
     
+@dapr_app.subscribe(pubsub=MOVIE_CACHE_PUBSUB, topic=MOVIE_CACHE_TOPIC, route="/movie-cache-invalidations",
+                   metadata={"consumerID": MOVIE_CACHE_CONSUMER_ID})
+async def movie_cache_invalidations_subscription(request: Request):
+    """Forget the cached copies of the movies written or deleted by another replica (and the pages which may list them)."""
+    try:
+        event = await request.json()
+        data = event.get("data", event)
+        while isinstance(data, str):
+            data = json.loads(data)
+        if data.get("replica") == MOVIE_CACHE_CONSUMER_ID:
+            # invalidated already, when written
+            return {"success": True}
+        logging.info("Movie cache invalidation received for movies %s", data.get("ids"))
+        movie_cache.invalidate(data.get("ids"))
+    except Exception as e:
+        logging.error("Error handling a movie cache invalidation, forgetting every cached movie: %s", e)
+        movie_cache.invalidate()
+    return {"success": True}
+
 @app.get("/liveness")
 def liveness():
     """
@@ -263,10 +472,13 @@ def liveness():
 @app.get("/readiness")
 def readiness():
     """
-    Readiness probe endpoint.
+    Readiness probe endpoint: ready when the last background check of the Dapr sidecar passed.
     """
     #logging.info("Readiness probe")
-    return Response(content=json.dumps({"status": "ready"}), media_type="application/json")
+    if not health.ready():
+        return Response(content=json.dumps({"status": "unavailable", "checks": health.status()}), media_type="application/json",
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response(content=json.dumps({"status": "ready", "checks": health.status()}), media_type="application/json")
 
 if __name__ == "__main__":
     import os
@@ -2,11 +2,103 @@
 import logging
 import json
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Optional
+import grpc
 from entities import GeneratedMovie, Movie
 from dapr.clients import DaprClient
+from dapr.clients.grpc._state import Concurrency, StateItem, StateOptions
+from dapr.clients.grpc._request import TransactionalStateOperation, TransactionOperationType
 
 logging.basicConfig(level=logging.INFO)
 
+# keys of the movies the listing can be sorted on
+SORT_KEYS = {"created_at": "created_at", "title": "title"}
+# Cosmos DB transactional batches hold at most 100 operations
+TRANSACTION_MAX_SIZE = 100
+# fields of the movies the listing can be projected on
+MOVIE_FIELDS = list(GeneratedMovie.model_fields)
+
+
+def parse_fields(value: str) -> list[str]:
+    """Fields of a projection, e.g. "id,title,poster_url"; ValueError on an unknown field"""
+    fields = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in fields if name not in MOVIE_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields {unknown}, expected some of {MOVIE_FIELDS}")
+    return list(dict.fromkeys(fields))
+
+
+def project(value: str, fields: list[str]) -> dict:
+    """The projected fields of a stored movie, without building the GeneratedMovie"""
+    data = json.loads(value)
+    return {name: data.get(name) for name in fields}
+
+
+def format_created_at(value: datetime) -> str:
+    """Creation time as a fixed-width UTC string, so comparing and sorting the strings in the store follows the time"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def stamp_created_at(movies: list[GeneratedMovie]) -> None:
+    """Set the missing created_at of the movies to now. The writer of a new movie stamps it, without reading the store:
+    a movie replaced with If-Match keeps the created_at it was read with, one posted again without it is new again."""
+    now = format_created_at(datetime.now(timezone.utc))
+    for movie in movies:
+        if not movie.created_at:
+            movie.created_at = now
+
+
+class ConcurrencyError(Exception):
+    """The movie changed in the store since it was read: its ETag no longer matches"""
+
+
+def state_options(etag: Optional[str]) -> StateOptions:
+    """With the ETag of the stored movie only the first write of that version succeeds, without one the last write wins"""
+    return StateOptions(concurrency=Concurrency.first_write if etag else Concurrency.last_write)
+
+
+@dataclass
+class MovieFilter:
+    """Filters and sort order of the movie listing"""
+    genre: Optional[str] = None
+    has_poster: Optional[bool] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+    sort: Optional[str] = None
+    order: str = "DESC"
+
+    def query(self, limit: int, token: Optional[str] = None) -> dict:
+        """Dapr state query of one page of the matching movies"""
+        conditions = []
+        if self.genre:
+            conditions.append({"EQ": {"payload.genre": self.genre}})
+        if self.has_poster is not None:
+            conditions.append({"NEQ" if self.has_poster else "EQ": {"poster_url": None}})
+        if self.created_after:
+            conditions.append({"GTE": {"created_at": format_created_at(self.created_after)}})
+        if self.created_before:
+            conditions.append({"LT": {"created_at": format_created_at(self.created_before)}})
+        query = {"filter": conditions[0] if len(conditions) == 1 else {"AND": conditions} if conditions else {}}
+        if self.sort:
+            query["sort"] = [{"key": SORT_KEYS[self.sort], "order": self.order.upper()}]
+        query["page"] = {"limit": limit}
+        if token:
+            query["page"]["token"] = token
+        return query
+
+
+@dataclass
+class MoviePage:
+    """One page of the movie listing; `token` reads the next one, None on the last page.
+    The movies are dicts of the projected fields when the listing asked for some."""
+    movies: list[GeneratedMovie] | list[dict] = field(default_factory=list)
+    token: Optional[str] = None
+
 
 class MovieStore:
   
@@ -15,22 +107,54 @@ class MovieStore:
         self.dapr_client = dapr_client
         self.state_store_name = 'movie-gallery-svc-statetore'
         
-    def upsert(self, movie: GeneratedMovie) -> GeneratedMovie:
-        """Add a movie to the store."""
+    def upsert(self, movie: GeneratedMovie, etag: Optional[str] = None, read_back: bool = False) -> GeneratedMovie:
+        """Add or replace a movie in the store and return it as written, or as read back from the store with `read_back`.
+        With the `etag` of the stored movie the write fails with ConcurrencyError if the movie changed since it was read."""
         logging.info("Adding movie: %s", movie)
-        logging.info("JSON %s", movie.to_json())
         movie_id = movie.id
-        logging.info("Saving movie to store %s using this key %s", self.state_store_name, movie_id)
-        self.dapr_client.save_state(
+        logging.info("Saving movie to store %s using this key %s, etag %s", self.state_store_name, movie_id, etag)
+        try:
+            self.dapr_client.save_state(
+                store_name=self.state_store_name,
+                key=movie_id,
+                value=movie.to_json(),
+                etag=etag,
+                options=state_options(etag)
+            )
+        except grpc.RpcError as e:
+            if etag and e.code() in (grpc.StatusCode.ABORTED, grpc.StatusCode.FAILED_PRECONDITION):
+                raise ConcurrencyError(f"movie {movie_id} changed since version {etag}") from e
+            raise
+        logging.info("Movie %s added to store", movie_id)
+        return self.try_find_by_id(movie_id) if read_back else movie
+
+    def upsert_bulk(self, movies: list[GeneratedMovie]) -> list[GeneratedMovie]:
+        """Add or replace many movies in one call to the store, the last write wins."""
+        logging.info("Saving %d movies to store %s", len(movies), self.state_store_name)
+        self.dapr_client.save_bulk_state(
             store_name=self.state_store_name,
-            key=movie_id,
-            value=movie.to_json()
+            states=[StateItem(key=movie.id, value=movie.to_json(), options=state_options(None)) for movie in movies]
         )
-        logging.info("Movie %s added to store", movie_id)
-        return self.try_find_by_id(movie_id)
-       
-    def try_find_by_id(self, movie_id : str) -> Movie:
-        """Find a movie by its ID."""
+        logging.info("%d movies added to store", len(movies))
+        return movies
+
+    def update(self, movie_id: str, change: Callable[[GeneratedMovie], None], attempts: int = 3) -> Optional[GeneratedMovie]:
+        """Read, change and write back a movie, again from the read when another write came in between.
+        Returns the written movie, None if it is not in the store."""
+        for attempt in range(1, attempts + 1):
+            movie, etag = self.try_find_with_etag(movie_id)
+            if movie is None:
+                return None
+            change(movie)
+            try:
+                return self.upsert(movie, etag)
+            except ConcurrencyError as e:
+                if attempt == attempts:
+                    raise
+                logging.warning("Updating movie %s again: %s", movie_id, e)
+
+    def try_find_with_etag(self, movie_id: str) -> tuple[Optional[GeneratedMovie], Optional[str]]:
+        """Find a movie by its ID, with the ETag of its stored version."""
         logging.info("Finding movie by ID: %s", movie_id)
         try:
             response = self.dapr_client.get_state(
@@ -41,39 +165,52 @@ class MovieStore:
                 logging.info("Movie found in store data: %s", response.data)
                 movie = GeneratedMovie.from_json(response.data)
                 logging.info("Movie found: %s", movie)
-                return movie
+                return movie, response.etag or None
             else:
                 logging.info("Movie not found")
-                return None
+                return None, None
         except Exception as e:
             logging.error("Error finding movie by ID: %s", e)
             raise e
+
+    def try_find_by_id(self, movie_id : str) -> Movie:
+        """Find a movie by its ID."""
+        return self.try_find_with_etag(movie_id)[0]
    
-    def find_all(self) -> list[Movie]:
-        """Find all movies in the store."""
+    def find_page(self, movie_filter: MovieFilter, limit: int, token: Optional[str] = None,
+                  fields: Optional[list[str]] = None) -> MoviePage:
+        """Find one page of the movies matching the filter, starting at the page token of the previous page.
+        With `fields`, only these fields of each movie are decoded and returned."""
+        query = json.dumps(movie_filter.query(limit, token))
+        states_metadata = {"contentType": "application/json"}
+        logging.info("Query: %s", query)
+        logging.info("Store name: %s", self.state_store_name)
+        response = self.dapr_client.query_state(
+                store_name=self.state_store_name,
+                query=query,
+                states_metadata=states_metadata
+            )
+        # the Dapr query API has no projection: the store returns whole documents, only the fields are kept
+        if fields:
+            movies = [project(item.value, fields) for item in response.results]
+        else:
+            movies = [GeneratedMovie.from_json(item.value) for item in response.results]
+        logging.info("GeneratedMovies found: %d", len(movies))
+        # the store may return a token after the last page too, an empty page ends the listing
+        return MoviePage(movies, response.token if response.token and movies else None)
+
+    def find_all(self, movie_filter: Optional[MovieFilter] = None, page_size: int = 100,
+                 fields: Optional[list[str]] = None) -> list[Movie] | list[dict]:
+        """Find all movies in the store, page by page (only the `fields` of each movie when given)."""
         logging.info("Finding all movies")
         try:
-            query_all_with_limit = '''
-            {
-                "page": {
-                    "limit": 100
-                }
-            }
-            '''
-            query_all = "{}"
-            query = query_all
-            states_metadata = {"contentType": "application/json"}
-            logging.info("Query: %s", query)
-            logging.info("States metadata: %s", states_metadata)
-            logging.info("Store name: %s", self.state_store_name)
-            logging.info("Querying state store")
-            response = self.dapr_client.query_state(
-                    store_name=self.state_store_name,
-                    query=query,
-                    states_metadata=states_metadata
-                )
-            movies = [GeneratedMovie.from_json(item.value) for item in response.results]
-            logging.info("GeneratedMovies found: %d", len(movies))
+            movie_filter = movie_filter or MovieFilter()
+            movies = []
+            page = self.find_page(movie_filter, page_size, fields=fields)
+            movies.extend(page.movies)
+            while page.token:
+                page = self.find_page(movie_filter, page_size, page.token, fields)
+                movies.extend(page.movies)
             return movies
         except Exception as e:
             logging.error("Error finding all movies: %s", e)
@@ -93,4 +230,43 @@ class MovieStore:
             return True
         except Exception as e:
             logging.error("Error deleting movie by ID: %s", e)
-            return False
\ No newline at end of file
+            return False
+
+    def find_many(self, movie_ids: list[str], parallelism: int = 10,
+                  fields: Optional[list[str]] = None) -> tuple[list[GeneratedMovie] | list[dict], list[str]]:
+        """Find many movies in one call to the store, read `parallelism` at a time by the sidecar.
+        Returns the movies found, in the order of the IDs (only the `fields` when given), and the IDs not found."""
+        logging.info("Finding %d movies, parallelism %d", len(movie_ids), parallelism)
+        response = self.dapr_client.get_bulk_state(
+            store_name=self.state_store_name,
+            keys=movie_ids,
+            parallelism=parallelism
+        )
+        errors = {item.key: item.error for item in response.items if item.error}
+        if errors:
+            raise RuntimeError(f"error reading movies {errors}")
+        found = {item.key: item.data for item in response.items if item.data}
+        movies = [project(found[movie_id], fields) if fields else GeneratedMovie.from_json(found[movie_id])
+                  for movie_id in movie_ids if movie_id in found]
+        missing = [movie_id for movie_id in movie_ids if movie_id not in found]
+        logging.info("GeneratedMovies found: %d, missing: %d", len(movies), len(missing))
+        return movies, missing
+
+    def delete_many(self, movie_ids: list[str], parallelism: int = 10) -> None:
+        """Delete many movies, in transactions of at most TRANSACTION_MAX_SIZE deletes.
+        A store that cannot run the transaction (e.g. Cosmos DB, whose transactions stay within one partition
+        and whose movies are partitioned by ID) gets the deletes one by one, `parallelism` at a time."""
+        logging.info("Deleting %d movies", len(movie_ids))
+        for start in range(0, len(movie_ids), TRANSACTION_MAX_SIZE):
+            chunk = movie_ids[start:start + TRANSACTION_MAX_SIZE]
+            try:
+                self.dapr_client.execute_state_transaction(
+                    store_name=self.state_store_name,
+                    operations=[TransactionalStateOperation(key=movie_id, operation_type=TransactionOperationType.delete)
+                                for movie_id in chunk]
+                )
+            except grpc.RpcError as e:
+                logging.warning("Transaction of %d deletes failed, deleting them one by one: %s", len(chunk), e)
+                with ThreadPoolExecutor(max_workers=parallelism) as executor:
+                    list(executor.map(lambda movie_id: self.dapr_client.delete_state(store_name=self.state_store_name, key=movie_id), chunk))
+        logging.info("%d movies deleted from store", len(movie_ids))
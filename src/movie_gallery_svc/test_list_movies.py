@@ -0,0 +1,147 @@
+"""Benchmark of GET /movies on a 5k-movie gallery: full movies vs. the ?fields= projection, and the movie cache.
+
+Run with -s to print the payload sizes and CPU times:
+    python -m pytest -s test_list_movies.py
+"""
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from cache import MovieCache
+
+GALLERY_SIZE = 5000
+PAGE_SIZE = 1000
+
+
+def stored_movie(i: int) -> str:
+    """A generated movie the size of the real ones: long prompt, plots and poster descriptions of both source movies"""
+    source = {"plot": "A plot of a source movie. " * 20, "poster_description": "A poster description. " * 30}
+    return json.dumps({
+        "id": f"{i}_{i + 1}_Comedy_{10000 + i}",
+        "title": f"Movie {i}",
+        "plot": "The plot of the generated movie. " * 15,
+        "poster_url": f"/poster/{i}.png",
+        "internal_poster_url": f"https://account.blob.core.windows.net/movieposters/{i}.png",
+        "poster_description": "The poster of the generated movie. " * 10,
+        "prompt": "The prompt given to the model. " * 60,
+        "payload": {"movie1": {"id": str(i), "title": f"Source {i}", **source},
+                    "movie2": {"id": str(i + 1), "title": f"Source {i + 1}", **source},
+                    "genre": "Comedy"},
+        "created_at": f"2025-01-01T00:00:{i % 60:02d}.000000Z",
+    })
+
+
+class GalleryStateStore:
+    """Stand-in for the Dapr client: query_state pages through the stored movies"""
+    def __init__(self, size: int):
+        self.values = [stored_movie(i) for i in range(size)]
+
+    def query_state(self, store_name, query, states_metadata=None):
+        page = json.loads(query)["page"]
+        start = int(page.get("token", "0"))
+        end = start + page["limit"]
+        results = [SimpleNamespace(key=str(i), value=value) for i, value in enumerate(self.values[start:end], start)]
+        return SimpleNamespace(results=results, token=str(end) if end < len(self.values) else "")
+
+    def save_state(self, store_name, key, value, etag=None, options=None):
+        self.values = [stored for stored in self.values if json.loads(stored)["id"] != key] + [value]
+
+    def save_bulk_state(self, store_name, states):
+        for state in states:
+            self.save_state(store_name, state.key, state.value)
+
+
+@pytest.fixture
+def gallery(monkeypatch):
+    monkeypatch.setattr(main.store, "dapr_client", GalleryStateStore(GALLERY_SIZE))
+    monkeypatch.setattr(main, "movie_cache", MovieCache(ttl=0))
+    return TestClient(main.app)
+
+
+def list_gallery(client: TestClient, **params) -> tuple[int, int, float]:
+    """Read every page of the gallery: number of movies, payload bytes and CPU seconds"""
+    count, size, token = 0, 0, None
+    start = time.process_time()
+    while True:
+        response = client.get("/movies", params={"limit": PAGE_SIZE, **params, **({"page_token": token} if token else {})})
+        assert response.status_code == 200
+        count += len(response.json())
+        size += len(response.content)
+        token = response.headers.get("X-Next-Page-Token")
+        if not token:
+            return count, size, time.process_time() - start
+
+
+def test_projection_cuts_payload_and_cpu(gallery):
+    """?fields=id,title,poster_url ships a fraction of the bytes, in less CPU time, than the full movies"""
+    full_count, full_size, full_cpu = list_gallery(gallery)
+    count, size, cpu = list_gallery(gallery, fields="id,title,poster_url")
+
+    print(f"\n{'GET /movies':<36}{'movies':>8}{'bytes':>12}{'CPU s':>8}")
+    print(f"{'full':<36}{full_count:>8}{full_size:>12}{full_cpu:>8.2f}")
+    print(f"{'fields=id,title,poster_url':<36}{count:>8}{size:>12}{cpu:>8.2f}")
+    assert count == full_count == GALLERY_SIZE
+    assert size * 10 < full_size
+    assert cpu < full_cpu
+
+
+def test_unknown_field_is_rejected(gallery):
+    response = gallery.get("/movies", params={"fields": "id,secret"})
+    assert response.status_code == 400
+
+
+def test_cached_pages_answer_conditional_requests(gallery, monkeypatch):
+    """A cached page is served without querying the store, 304 when its ETag matches, until another replica writes a movie"""
+    monkeypatch.setattr(main, "movie_cache", MovieCache(ttl=60))
+    queries = []
+    query_state = main.store.dapr_client.query_state
+    monkeypatch.setattr(main.store.dapr_client, "query_state", lambda *args, **kwargs: queries.append(1) or query_state(*args, **kwargs))
+
+    first = gallery.get("/movies", params={"limit": 10, "fields": "id,title"})
+    etag = first.headers["ETag"]
+    again = gallery.get("/movies", params={"fields": "id,title", "limit": 10}, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert len(queries) == 1
+
+    invalidation = {"data": {"ids": ["0_1_Comedy_10000"], "replica": "another-replica"}}
+    assert gallery.post("/movie-cache-invalidations", json=invalidation).status_code == 200
+    assert gallery.get("/movies", params={"limit": 10, "fields": "id,title"}, headers={"If-None-Match": etag}).status_code == 304
+    assert len(queries) == 2, "the page is read again after the invalidation, unchanged so still 304"
+
+
+def test_without_paging_every_movie_is_listed(gallery):
+    """Without limit nor page_token GET /movies returns the whole gallery"""
+    response = gallery.get("/movies", params={"fields": "id"})
+    assert response.status_code == 200
+    assert len(response.json()) == GALLERY_SIZE
+    assert "X-Next-Page-Token" not in response.headers
+
+
+def test_creation_time_is_set_without_reading_the_store(gallery, monkeypatch):
+    """A new movie is stamped by its writer, a movie replaced with If-Match keeps the created_at it was read with"""
+    def no_read(*args, **kwargs):
+        raise AssertionError("the store is read before the write")
+    monkeypatch.setattr(main.store.dapr_client, "get_bulk_state", no_read, raising=False)
+    monkeypatch.setattr(main.store.dapr_client, "get_state", no_read, raising=False)
+    movie = json.loads(stored_movie(0))
+    assert gallery.post("/movies", json={**movie, "id": "new", "created_at": None}).json()["created_at"]
+    replaced = gallery.post("/movies", json=movie, headers={"If-Match": '"1"'}).json()
+    assert replaced["created_at"] == movie["created_at"]
+    bulk = gallery.post("/movies/bulk", json=[{**movie, "id": "bulk", "created_at": None}]).json()
+    assert bulk[0]["created_at"]
+
+
+def test_writes_invalidate_the_other_replicas(gallery, monkeypatch):
+    """A write publishes the IDs of the written movies to the other replicas"""
+    published = []
+    monkeypatch.setattr(main.dapr_client, "publish_event", lambda **kwargs: published.append(kwargs))
+    movie = json.loads(stored_movie(1))
+
+    assert gallery.post("/movies", json=movie).status_code == 201
+
+    assert [event["topic_name"] for event in published] == ["movie-cache-invalidations"]
+    assert json.loads(published[0]["data"]) == {"ids": [movie["id"]], "replica": main.MOVIE_CACHE_CONSUMER_ID}
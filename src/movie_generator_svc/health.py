@@ -0,0 +1,137 @@
+"""Readiness probes: the dependencies of a service checked in the background, the results cached.
+
+A HealthChecker runs every check at the same time every `interval` seconds (Dapr sidecar, Redis PING,
+Blob container properties, ...), each within `timeout` seconds, and keeps the last result of each one,
+so /readiness answers in O(1) without calling any dependency.
+
+The same module is used by movie_poster_svc, movie_generator_svc, movie_gallery_svc and movie_poster_agent_svc.
+"""
+import asyncio
+import inspect
+import logging
+import os
+import time
+import urllib.request
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+UNKNOWN = "unknown"
+OK = "ok"
+FAILING = "failing"
+
+
+class Check:
+    """ A dependency check: `probe` raises (or returns False) when the dependency is broken """
+
+    def __init__(self, name: str, probe: Callable[[], Any], required: bool = True):
+        self.name = name
+        self.probe = probe
+        self.required = required
+        self.state = UNKNOWN
+        self.error: str | None = None
+        self.duration: float | None = None
+        self.checked_at: float | None = None
+
+    def record(self, error: str | None, duration: float) -> None:
+        state = OK if error is None else FAILING
+        if state != self.state:
+            if error is None:
+                logger.info("%s check ok", self.name)
+            else:
+                logger.warning("%s check failing: %s", self.name, error)
+        self.state = state
+        self.error = error
+        self.duration = duration
+        self.checked_at = time.time()
+
+    def status(self) -> dict:
+        return {"state": self.state, "required": self.required, "error": self.error,
+                "duration": round(self.duration, 3) if self.duration is not None else None,
+                "checked_at": self.checked_at}
+
+
+class HealthChecker:
+    """ The dependency checks of a service, run in the background by `start` """
+
+    def __init__(self, interval: float = 10.0, timeout: float = 2.0):
+        self.interval = interval
+        self.timeout = timeout
+        self._checks: dict[str, Check] = {}
+        self._task: asyncio.Task | None = None
+        self._last_run: float | None = None
+
+    def add(self, name: str, probe: Callable[[], Any], required: bool = True) -> Check:
+        """Add a check; a coroutine function runs on the event loop, any other function in a worker thread"""
+        check = Check(name, probe, required)
+        self._checks[name] = check
+        return check
+
+    def __getitem__(self, name: str) -> Check:
+        return self._checks[name]
+
+    async def _run(self, check: Check) -> None:
+        start = time.perf_counter()
+        error = None
+        try:
+            if inspect.iscoroutinefunction(check.probe):
+                result = await asyncio.wait_for(check.probe(), self.timeout)
+            else:
+                result = await asyncio.wait_for(asyncio.to_thread(check.probe), self.timeout)
+            if result is False:
+                error = "check failed"
+        except asyncio.TimeoutError:
+            error = f"no answer within {self.timeout}s"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        check.record(error, time.perf_counter() - start)
+
+    async def check_all(self) -> None:
+        """Run every check at the same time"""
+        await asyncio.gather(*[self._run(check) for check in self._checks.values()])
+        self._last_run = time.monotonic()
+
+    async def run(self) -> None:
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Check the dependencies in the background"""
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Stop the checks"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def ready(self) -> bool:
+        """True when every required check passed in the last run, and the last run is recent"""
+        if self._last_run is None or time.monotonic() - self._last_run > 3 * self.interval + self.timeout:
+            return False
+        return all(check.state == OK for check in self._checks.values() if check.required)
+
+    def status(self) -> dict[str, dict]:
+        return {name: check.status() for name, check in self._checks.items()}
+
+
+def health_checker_from_env() -> HealthChecker:
+    """HealthChecker configured by HEALTH_CHECK_INTERVAL and HEALTH_CHECK_TIMEOUT (seconds)"""
+    return HealthChecker(interval=float(os.getenv("HEALTH_CHECK_INTERVAL", "10")),
+                         timeout=float(os.getenv("HEALTH_CHECK_TIMEOUT", "2")))
+
+
+def dapr_sidecar_probe(timeout: float = 2.0) -> Callable[[], None]:
+    """Probe of the Dapr sidecar: GET /v1.0/healthz answers 204 once its components are initialized"""
+    url = f"http://{os.getenv('DAPR_HOST', 'localhost')}:{os.getenv('DAPR_HTTP_PORT', '3500')}/v1.0/healthz"
+
+    def probe() -> None:
+        # urlopen raises HTTPError on a 500 (sidecar not healthy)
+        with urllib.request.urlopen(url, timeout=timeout):
+            pass
+    return probe
@@ -3,33 +3,43 @@ import os
 import sys
 import logging
 import json
+import asyncio
 
 import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
 
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import Iterator, Literal, Optional, get_args
 from collections import OrderedDict
 import openai
 import uvicorn
 import requests
+from requests.adapters import HTTPAdapter
 
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
 from fastapi.openapi.utils import get_openapi
 from fastapi.templating import Jinja2Templates
 from fastapi_logger.logger import log_request
 
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.instrumentation.openai import OpenAIInstrumentor
-from azure.ai.inference.tracing import AIInferenceInstrumentor 
-from azure.monitor.opentelemetry import configure_azure_monitor
 
 from dotenv import load_dotenv
 from pydantic import BaseModel
 
 from openai import AzureOpenAI
 
+from retry_policy import retry_policy_from_env
+from prompts import PromptError, PromptRegistry, PromptTemplate, parse_variants
+from redis_client import RedisClient
+from result_cache import ResultCache, result_key
+from dependencies import Dependencies
+from health import health_checker_from_env
+
 openai.log = "debug"
-OpenAIInstrumentor().instrument()
-AIInferenceInstrumentor().instrument()
 
 load_dotenv()
 
@@ -58,12 +68,36 @@ handler.setFormatter(formatter)
 root.addHandler(handler)
 logger_uvicorn = logging.getLogger('uvicorn.error')
 
-if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
-    logger_uvicorn.info("configure_azure_monitor")
-    configure_azure_monitor()
 
 
-app = FastAPI()
+def configure_telemetry() -> None:
+    """Instrument the OpenAI and AI Inference clients and export to Azure Monitor.
+    Slow to import and to run, so it runs in the background at startup with the other dependencies."""
+    from opentelemetry.instrumentation.openai import OpenAIInstrumentor
+    from azure.ai.inference.tracing import AIInferenceInstrumentor
+    from azure.monitor.opentelemetry import configure_azure_monitor
+
+    OpenAIInstrumentor().instrument()
+    AIInferenceInstrumentor().instrument()
+    if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
+        logger_uvicorn.info("configure_azure_monitor")
+        configure_azure_monitor()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Build the clients in the background, stop the prompt reloading on shutdown."""
+    service.dependencies.start()
+    service.health.start()
+    yield
+    await service.health.stop()
+    await service.dependencies.stop()
+    prompts = service.dependencies["prompts"].peek()
+    if prompts is not None:
+        prompts.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 FastAPIInstrumentor.instrument_app(app, excluded_urls="liveness,readiness")
 templates = Jinja2Templates(directory="templates")
 
@@ -77,20 +111,119 @@ class Movie(BaseModel):
     poster_url: str
     poster_description: Optional[str] = None
 
+# generation modes: gpt-5-mini writes the movie then gpt-4o formats it as GenAIMovie,
+# or gpt-5-mini writes it directly with structured outputs (falling back to the two steps on failure)
+TWO_STEP = "two_step"
+SINGLE_PASS = "single_pass"
+GenerationMode = Literal["two_step", "single_pass"]
+
 class MoviePayload(BaseModel):
     """ Data class for MoviePayload """
     movie1: Movie
     movie2: Movie
     genre: str
     language: Optional[str] = None
+    prompt_version: Optional[str] = None
+    generation_mode: Optional[GenerationMode] = None
+    force_fresh: bool = False
 
 class GenAIMovie(Movie):
     """ Data class for GenAIMovie """
     prompt: str = None
+    prompt_version: Optional[str] = None
+    generation_mode: Optional[GenerationMode] = None
     payload: MoviePayload = None
+
+class MovieDraft(BaseModel):
+    """ Data class for the part of the movie written by the model in the single-pass mode """
+    title: str
+    plot: str
+    poster_description: str
+
     
 
 
+# static instructions sent around the movie prompt, built once
+# https://cookbook.openai.com/examples/o1/using_chained_calls_for_o1_structured_outputs
+INSTRUCTION_MESSAGES = (
+    {
+        "role": "user",
+        "content": "You are a bot expert with a huge knowledge about movies and the cinema."
+    },
+    {
+        "role": "user",
+        "content": """
+                    Two movie titles and plots will be provided, along with a target genre.
+                    Using the titles, plots and genre as inspiration, generate the following:
+                    * Step 1: Generate a new movie title that combines elements of the provided titles and fits the target genre. The title should be catchy and humorous.
+                    * Step 2: Generate a 4-6 sentence movie plot synopsis for the new title, incorporating themes, characters, or plot points from the provided movies. Adapt them to fit the target genre.
+                    * Step 3: Based on the generated movie plot and the key elements of the 2 movie posters, generate the movie poster description without using the movie's titles.
+                    * Step 4: Ensure the new movie title and plot are original and do not contain any violent or inappropriate content.
+                                """
+    },
+)
+GUARDRAIL_MESSAGE = {
+    "role":"user",
+    "content": """
+                Use the details below to generate the new movie title and plot.
+                Use the description of the two posters to generate the new posterDescription without any title.
+                Take care of not generating any violence.
+                Take care of not generating any copyrighted content.
+                Remove all mentions about copyrighted content and replace them with the generic words.
+                """
+}
+
+
+class PosterDescription:
+    """ The description of a batch poster, whose deadline starts when the description starts running,
+    not when the batch queued it behind the other posters """
+
+    def __init__(self, executor: ThreadPoolExecutor, describe, title: str, poster_url: str, timeout: float):
+        self._timeout = timeout
+        self._deadline = None
+        self._started = threading.Event()
+        self.future = executor.submit(self._describe, describe, title, poster_url)
+        # a description cancelled before it started ends the wait too
+        self.future.add_done_callback(lambda _: self._started.set())
+
+    def _describe(self, describe, title: str, poster_url: str) -> str:
+        self._deadline = time.monotonic() + self._timeout
+        self._started.set()
+        return describe(title, poster_url)
+
+    def result(self) -> str:
+        """ The description; TimeoutError if it runs past its deadline, CancelledError if the batch was cancelled """
+        self._started.wait()
+        if self.future.done():
+            return self.future.result()
+        return self.future.result(timeout=max(0.0, self._deadline - time.monotonic()))
+
+
+class MovieBatch:
+    """ The generations of a batch, iterated as (index, movie or error) in completion order.
+    `cancel`, called by any thread, drops the generations and the poster descriptions not started yet. """
+
+    def __init__(self, executor: ThreadPoolExecutor, futures: dict[Future, int], describe_executor: ThreadPoolExecutor):
+        self._executor = executor
+        self._futures = futures
+        self._describe_executor = describe_executor
+
+    def __iter__(self) -> Iterator[tuple[int, GenAIMovie | Exception]]:
+        try:
+            for future in as_completed(self._futures):
+                try:
+                    yield self._futures[future], future.result()
+                except Exception as e:
+                    logger.error("batch movie %d not generated: %s", self._futures[future], e)
+                    yield self._futures[future], e
+        finally:
+            self.cancel()
+
+    def cancel(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._describe_executor.shutdown(wait=False, cancel_futures=True)
+
+
 class GenAiMovieService:
     """ Class to manage the access to OpenAI API to generate a new movie """
 
@@ -103,12 +236,107 @@ class GenAiMovieService:
         self._headers= {    }
         self._language = "english"
 
-        self.client = AzureOpenAI(
+        # POST /generate/batch: at most GENERATE_BATCH_MAX_SIZE movies, GENERATE_BATCH_CONCURRENCY generated at the same time,
+        # their posters described GENERATE_BATCH_DESCRIBE_WORKERS at a time by a pool of the batch, not the one of /generate
+        self.batch_max_size = int(os.getenv("GENERATE_BATCH_MAX_SIZE", "500"))
+        self.batch_concurrency = int(os.getenv("GENERATE_BATCH_CONCURRENCY", "4"))
+        self.batch_describe_workers = int(os.getenv("GENERATE_BATCH_DESCRIBE_WORKERS", "4"))
+
+        # poster descriptions are requested at the same time, through one keep-alive session,
+        # each within DESCRIBE_POSTER_TIMEOUT seconds
+        describe_workers = int(os.getenv("DESCRIBE_POSTER_WORKERS", "8"))
+        self._describe_timeout = float(os.getenv("DESCRIBE_POSTER_TIMEOUT", "60"))
+        self._session = requests.Session()
+        pool_size = describe_workers + self.batch_describe_workers
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self._describe_executor = ThreadPoolExecutor(max_workers=describe_workers, thread_name_prefix="describe-poster")
+
+        self.retry_policy = retry_policy_from_env()
+
+        self.generation_mode = os.getenv("GENERATION_MODE", TWO_STEP)
+        if self.generation_mode not in get_args(GenerationMode):
+            raise ValueError(f"GENERATION_MODE must be one of {', '.join(get_args(GenerationMode))}, not {self.generation_mode!r}")
+        logger.info("Generation mode: %s", self.generation_mode)
+
+        # the telemetry, OpenAI client, prompt templates and movie cache are built in the background at startup (lifespan)
+        # or on first use, so /liveness answers at once and /readiness reports their state
+        self.dependencies = Dependencies(retry_interval=float(os.getenv("DEPENDENCY_RETRY_INTERVAL", "10")))
+        self.dependencies.add("telemetry", configure_telemetry, required=False)
+        self.dependencies.add("openai", self._create_openai_client)
+        self.dependencies.add("prompts", self._create_prompts)
+        self.dependencies.add("result_cache", self._create_result_cache, required=False)
+
+        # readiness: Redis checked in the background every HEALTH_CHECK_INTERVAL seconds when the movie cache is on;
+        # the movies are generated without the cache, so a failing Redis is reported but does not make the service unready
+        self.health = health_checker_from_env()
+        if os.getenv("USE_MOVIE_CACHE", "false").lower() == "true":
+            self.health.add("redis", self.check_redis, required=False)
+
+    def _create_openai_client(self) -> AzureOpenAI:
+        return AzureOpenAI(
             api_key=os.getenv("AZURE_OPENAI_API_KEY"),
             api_version=os.getenv("OPENAI_API_VERSION"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            # retried by self.retry_policy
+            max_retries=0
         )
 
+    def _create_prompts(self) -> PromptRegistry:
+        # prompt templates loaded once from prompts/ and reloaded in the background when a file changes;
+        # PROMPT_VARIANTS (e.g. "structured_new_movie_short:90,structured_new_movie:10") splits the requests between versions
+        prompts = PromptRegistry(
+            os.getenv("PROMPTS_DIR", "prompts"),
+            default=os.getenv("PROMPT_VERSION", "structured_new_movie_short"),
+            variants=parse_variants(os.getenv("PROMPT_VARIANTS", ""))
+        )
+        prompts.watch(float(os.getenv("PROMPT_RELOAD_INTERVAL", "5")))
+        return prompts
+
+    def _create_result_cache(self) -> Optional[ResultCache]:
+        # opt-in cache of the generated movies in Redis: the same movies, genre, language and prompt
+        # are served without calling the models for MOVIE_CACHE_EXPIRE_SECONDS, unless the request asks force_fresh
+        if os.getenv("USE_MOVIE_CACHE", "false").lower() != "true":
+            logger.info("Movie cache: False")
+            return None
+        result_cache = ResultCache(RedisClient(), int(os.getenv("MOVIE_CACHE_EXPIRE_SECONDS", "86400")))
+        logger.info("Movie cache: True")
+        return result_cache
+
+    def check_redis(self) -> None:
+        """Readiness check: PING Redis"""
+        result_cache = self.result_cache
+        if result_cache is None:
+            raise RuntimeError("Redis client not initialized")
+        result_cache.redis_client.ping()
+
+    @property
+    def client(self) -> AzureOpenAI:
+        """The OpenAI client, built on first use if the startup did not build it yet"""
+        return self.dependencies["openai"].get()
+
+    @client.setter
+    def client(self, value) -> None:
+        self.dependencies["openai"].set(value)
+
+    @property
+    def prompts(self) -> PromptRegistry:
+        """The prompt templates, loaded on first use if the startup did not load them yet"""
+        return self.dependencies["prompts"].get()
+
+    @prompts.setter
+    def prompts(self, value) -> None:
+        self.dependencies["prompts"].set(value)
+
+    @property
+    def result_cache(self) -> Optional[ResultCache]:
+        """The movie cache, None while Redis is unreachable: the movies are generated without it"""
+        return self.dependencies["result_cache"].peek()
+
+    @result_cache.setter
+    def result_cache(self, value) -> None:
+        self.dependencies["result_cache"].set(value)
+
     def describe_poster(self, name: str, poster_url: str) -> str:
         """ Describe the poster based on the URL """
         # Call the movie-poster-svc describe poster service
@@ -117,7 +345,7 @@ class GenAiMovieService:
         endpoint = f"{self._endpoint}/describe/{name}?url={poster_url}"
 
         logger.info("Calling endpoint %s", endpoint)
-        response = requests.get(endpoint, headers=self._headers, timeout=300)
+        response = self._session.get(endpoint, headers=self._headers, timeout=self._describe_timeout)
         if response.status_code == 200:
             logger.info("Response: %s", response.content)
             return response.content.decode('UTF-8')
@@ -125,93 +353,222 @@ class GenAiMovieService:
             logger.error("Failed to retrieve data: %s %s", response.status_code, response.text)
             raise Exception(f"Failed to retrieve the poster description: {response.status_code} {response.text}")
 
-    def generate_movie(self, movie1: Movie, movie2: Movie, genre: str, language: str = "english") -> GenAIMovie:
+    def _generate_two_step(self, messages: list[dict], language: str) -> GenAIMovie:
+        """ gpt-5-mini writes the movie, gpt-4o formats its answer as a GenAIMovie """
+        o1_response = self.retry_policy.call("gpt-5-mini", self.client.chat.completions.create, model="gpt-5-mini", messages=messages)
+        logger.info("gpt-5-mini usage: %s", o1_response.usage)
+       
+        o1_response_content = o1_response.choices[0].message.content
+        logger.info("Response: %s", o1_response_content)
+        return self._format(o1_response_content, language)
+
+    def _format(self, o1_response_content: str, language: str) -> GenAIMovie:
+        """ gpt-4o formats the movie written by gpt-5-mini as a GenAIMovie """
+        completion = self.retry_policy.call(
+            "gpt-4o",
+            self.client.beta.chat.completions.parse,
+            model="gpt-4o",
+            response_format=GenAIMovie,
+            messages=[
+            {
+                "role": "user", 
+                "content": f"""Given the following data, format it with the given response format using the {language} language: {o1_response_content}"""
+            }
+            ])
+        logger.info("gpt-4o usage: %s", completion.usage)
+        message = completion.choices[0].message
+        logger.info("Message: %s", json.dumps(json.loads(message.content), indent=2))
+        return GenAIMovie.model_validate(json.loads(message.content))
+
+    def _generate_single_pass(self, messages: list[dict], language: str) -> GenAIMovie:
+        """ gpt-5-mini writes the movie directly in the MovieDraft format (structured outputs) """
+        completion = self.retry_policy.call(
+            "gpt-5-mini",
+            self.client.beta.chat.completions.parse,
+            model="gpt-5-mini",
+            response_format=MovieDraft,
+            messages=[*messages, {"role": "user", "content": f"Write the title, the plot and the poster description using the {language} language."}]
+        )
+        logger.info("gpt-5-mini usage: %s", completion.usage)
+        message = completion.choices[0].message
+        if getattr(message, "refusal", None):
+            raise ValueError(f"gpt-5-mini refused: {message.refusal}")
+        logger.info("Message: %s", message.content)
+        draft = MovieDraft.model_validate_json(message.content)
+        return GenAIMovie(id="", title=draft.title, plot=draft.plot, poster_url="", poster_description=draft.poster_description)
+
+    def describe_posters(self, movies: list[Movie]) -> None:
+        """ Fill the missing poster descriptions, describing the posters at the same time.
+        A poster that cannot be described within the deadline is left without description. """
+        pending = {
+            self._describe_executor.submit(self.describe_poster, movie.title, movie.poster_url): movie
+            for movie in movies if not movie.poster_description
+        }
+        if not pending:
+            return
+        done, not_done = wait(pending, timeout=self._describe_timeout)
+        for future in done:
+            movie = pending[future]
+            try:
+                movie.poster_description = future.result()
+                logger.info("%s Poster Description: %s", movie.title, movie.poster_description)
+            except Exception as e:
+                logger.warning("%s poster not described, generating without its description: %s", movie.title, e)
+        for future in not_done:
+            future.cancel()
+            logger.warning("%s poster not described within %ss, generating without its description", pending[future].title, self._describe_timeout)
+
+    def generate_movies(self, payloads: list[MoviePayload]) -> MovieBatch:
+        """ Generate the movies of a batch, `batch_concurrency` at the same time, iterated as (index, movie or error)
+        as each one completes. A poster shared by several payloads is described once for the whole batch. """
+        describe_executor = ThreadPoolExecutor(max_workers=self.batch_describe_workers, thread_name_prefix="describe-batch")
+        descriptions = self._describe_batch([movie for payload in payloads for movie in (payload.movie1, payload.movie2)],
+                                            describe_executor)
+
+        def generate(payload: MoviePayload) -> GenAIMovie:
+            for movie in (payload.movie1, payload.movie2):
+                self._wait_description(movie, descriptions)
+            return self.generate_movie(payload.movie1, payload.movie2, payload.genre, payload.language, payload.prompt_version,
+                                       payload.generation_mode, payload.force_fresh, describe=False)
+
+        executor = ThreadPoolExecutor(max_workers=self.batch_concurrency, thread_name_prefix="generate-batch")
+        futures = {executor.submit(generate, payload): index for index, payload in enumerate(payloads)}
+        return MovieBatch(executor, futures, describe_executor)
+
+    def _describe_batch(self, movies: list[Movie], executor: ThreadPoolExecutor) -> dict[tuple[str, str], PosterDescription]:
+        """ Queue the descriptions of the posters of a batch, once per distinct poster, in the order of the movies """
+        descriptions = {}
+        for movie in movies:
+            key = (movie.title, movie.poster_url)
+            if not movie.poster_description and key not in descriptions:
+                descriptions[key] = PosterDescription(executor, self.describe_poster, movie.title, movie.poster_url,
+                                                      self._describe_timeout)
+        logger.info("batch: %d distinct posters to describe for %d movies", len(descriptions), len(movies))
+        return descriptions
+
+    def _wait_description(self, movie: Movie, descriptions: dict[tuple[str, str], PosterDescription]) -> None:
+        """ Set the description of the poster of a batch movie, left without description on error, timeout or cancel """
+        description = descriptions.get((movie.title, movie.poster_url))
+        if description is None or movie.poster_description:
+            return
+        try:
+            movie.poster_description = description.result()
+        except Exception as e:
+            logger.warning("%s poster not described, generating without its description: %r", movie.title, e)
+
+    def generate_movie(self, movie1: Movie, movie2: Movie, genre: str, language: str = "english",
+                       prompt_version: str | None = None, generation_mode: GenerationMode | None = None,
+                       force_fresh: bool = False, describe: bool = True) -> GenAIMovie:
         """ Generate a new movie based on the two movies with specified language """ 
         logger.info(
             "generate_movie called based on two movies %s and %s, genre: %s, language: %s", movie1.title, movie2.title, genre, language)
+        prompt_template = self.prompts.select(prompt_version, key=f"{movie1.id}_{movie2.id}_{genre}")
+        cache_key, cached_movie = self._cached_movie(prompt_template, movie1, movie2, genre, language, force_fresh)
+        if cached_movie is not None:
+            return cached_movie
+        prompt, messages = self._prepare(prompt_template, movie1, movie2, genre, language, describe)
+        mode = generation_mode or self.generation_mode
+        generated_movie = None
+        if mode == SINGLE_PASS:
+            try:
+                generated_movie = self._generate_single_pass(messages, language)
+            except Exception as e:
+                logger.warning("single-pass generation failed, falling back to the two-step generation: %s", e)
+        if generated_movie is None:
+            mode = TWO_STEP
+            generated_movie = self._generate_two_step(messages, language)
+        generated_movie.generation_mode = mode
+        return self._complete(generated_movie, prompt_template, prompt, movie1, movie2, genre, language, cache_key)
+
+    def generate_movie_stream(self, movie1: Movie, movie2: Movie, genre: str, language: str = "english",
+                              prompt_version: str | None = None, force_fresh: bool = False) -> Iterator[tuple[str, dict]]:
+        """ Generate a new movie like generate_movie (two steps), yielding (event, data) as it goes:
+        `status` at each stage, `token` for each piece of the gpt-5-mini answer, then `movie` with the GenAIMovie """
+        logger.info("generate_movie_stream called based on two movies %s and %s, genre: %s, language: %s", movie1.title, movie2.title, genre, language)
+        prompt_template = self.prompts.select(prompt_version, key=f"{movie1.id}_{movie2.id}_{genre}")
+        cache_key, cached_movie = self._cached_movie(prompt_template, movie1, movie2, genre, language, force_fresh)
+        if cached_movie is not None:
+            yield "status", {"stage": "cached", "prompt_version": prompt_template.version}
+            yield "movie", cached_movie.model_dump()
+            return
+        yield "status", {"stage": "describing posters"}
+        prompt, messages = self._prepare(prompt_template, movie1, movie2, genre, language)
+        yield "status", {"stage": "writing", "prompt_version": prompt_template.version}
+        stream = self.retry_policy.call("gpt-5-mini", self.client.chat.completions.create, model="gpt-5-mini", messages=messages, stream=True)
+        parts = []
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield "token", {"text": chunk.choices[0].delta.content}
+        yield "status", {"stage": "formatting"}
+        generated_movie = self._format("".join(parts), language)
+        generated_movie.generation_mode = TWO_STEP
+        yield "movie", self._complete(generated_movie, prompt_template, prompt, movie1, movie2, genre, language, cache_key).model_dump()
+
+    def _cached_movie(self, prompt_template: PromptTemplate, movie1: Movie, movie2: Movie, genre: str, language: str,
+                      force_fresh: bool) -> tuple[str | None, GenAIMovie | None]:
+        """ Return the cache key of the request (None without cache) and the movie already generated for it """
+        if self.result_cache is None:
+            return None, None
+        cache_key = result_key(movie1.id, movie2.id, genre, language, prompt_template.version, prompt_template.text)
+        if force_fresh:
+            self.result_cache.bypass(cache_key, prompt_template.version)
+            return cache_key, None
+        cached = self.result_cache.get(cache_key, prompt_template.version)
+        if cached is None:
+            return cache_key, None
+        # stored like the generated movies, without poster
+        movie = GenAIMovie.model_validate({**cached, "poster_url": ""})
+        movie.poster_url = None
+        # a new id, so the gallery stores and illustrates it as a new movie
+        movie.id = self._movie_id(movie1, movie2, genre)
+        movie.payload = MoviePayload(movie1=movie1, movie2=movie2, genre=genre, language=language)
+        return cache_key, movie
+
+    def _movie_id(self, movie1: Movie, movie2: Movie, genre: str) -> str:
+        return f"{movie1.id}_{movie2.id}_{genre}_{random.randint(10000, 99999)}"
+
+    def _prepare(self, prompt_template: PromptTemplate, movie1: Movie, movie2: Movie, genre: str, language: str,
+                 describe: bool = True) -> tuple[str, list[dict]]:
+        """ Describe the posters (unless already done) and build the messages """
         self._language = language
         logger.info("Movie 1: %s", movie1)
         logger.info("Movie 2: %s", movie2)
 
-        if movie1.poster_description is None or movie1.poster_description == "":
-            movie1.poster_description = self.describe_poster(movie1.title, movie1.poster_url)
-            logger.info("Movie 1 Poster Description: %s", movie1.poster_description)
-        if movie2.poster_description is None  or movie2.poster_description == "":
-            movie2.poster_description = self.describe_poster(movie2.title, movie2.poster_url)
-            logger.info("Movie 2 Poster Description: %s", movie2.poster_description)
-
-        with open("prompts/structured_new_movie_short.txt", "r", encoding="utf-8") as file:
-            prompt_template = file.read()
+        logger.info("Prompt version: %s", prompt_template.version)
+        if describe:
+            self.describe_posters([movie1, movie2])
 
-        prompt = prompt_template.format(
+        prompt = prompt_template.render(
             movie1_title=movie1.title,
             movie1_plot=movie1.plot,
-            movie1_description=movie1.poster_description,
+            movie1_description=movie1.poster_description or "",
             movie2_title=movie2.title,
             movie2_plot=movie2.plot,
-            movie2_description=movie2.poster_description,
+            movie2_description=movie2.poster_description or "",
             genre=genre,
             language=language,
         )
 
 
         logger.info("Prompt: %s", prompt)
-        # https://cookbook.openai.com/examples/o1/using_chained_calls_for_o1_structured_outputs
-        messages=[
-                {
-                    "role": "user",
-                    "content": "You are a bot expert with a huge knowledge about movies and the cinema."
-                },
-                {
-                    "role": "user",
-                    "content": """
-                    Two movie titles and plots will be provided, along with a target genre.
-                    Using the titles, plots and genre as inspiration, generate the following:
-                    * Step 1: Generate a new movie title that combines elements of the provided titles and fits the target genre. The title should be catchy and humorous.
-                    * Step 2: Generate a 4-6 sentence movie plot synopsis for the new title, incorporating themes, characters, or plot points from the provided movies. Adapt them to fit the target genre.
-                    * Step 3: Based on the generated movie plot and the key elements of the 2 movie posters, generate the movie poster description without using the movie's titles.
-                    * Step 4: Ensure the new movie title and plot are original and do not contain any violent or inappropriate content.
-                                """
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                },
-                {
-                    "role":"user",
-                    "content": """
-                Use the details below to generate the new movie title and plot.
-                Use the description of the two posters to generate the new posterDescription without any title.
-                Take care of not generating any violence.
-                Take care of not generating any copyrighted content.
-                Remove all mentions about copyrighted content and replace them with the generic words.
-                """
-                }
-            ]
+        messages = [*INSTRUCTION_MESSAGES, {"role": "user", "content": prompt}, GUARDRAIL_MESSAGE]
         
         logger.info("Messages: %s", json.dumps(messages, indent=2))
-        o1_response = self.client.chat.completions.create(model="gpt-5-mini", messages=messages)
-       
-        o1_response_content = o1_response.choices[0].message.content
-        logger.info("Response: %s", o1_response_content)
-        completion = self.client.beta.chat.completions.parse(
-            model="gpt-4o",
-            response_format=GenAIMovie,
-            messages=[
-            {
-                "role": "user", 
-                "content": f"""Given the following data, format it with the given response format using the {language} language: {o1_response_content}"""
-            }
-            ])
-        message = completion.choices[0].message
-        logger.info("Message: %s", json.dumps(json.loads(message.content), indent=2))
-        generated_movie = GenAIMovie.model_validate(json.loads(message.content))
+        return prompt, messages
+
+    def _complete(self, generated_movie: GenAIMovie, prompt_template: PromptTemplate, prompt: str,
+                  movie1: Movie, movie2: Movie, genre: str, language: str, cache_key: str | None = None) -> GenAIMovie:
+        """ Add the request details and the id to the movie written by the model """
         generated_movie.prompt= prompt
+        generated_movie.prompt_version = prompt_template.version
         generated_movie.poster_url = None
         generated_movie.payload = MoviePayload(movie1=movie1, movie2=movie2, genre=genre, language=language)
-        generated_movie.id = f"{movie1.id}_{movie2.id}_{genre}_{random.randint(10000, 99999)}"
+        generated_movie.id = self._movie_id(movie1, movie2, genre)
        
         logger.info("Generated movie: %s", generated_movie)
+        if cache_key is not None:
+            self.result_cache.set(cache_key, prompt_template.version, generated_movie.model_dump())
         return generated_movie
 
 def custom_openapi():
@@ -254,11 +611,64 @@ async def env(request: Request):
 async def movie_generate(request: Request,payload:MoviePayload) -> GenAIMovie:
     """Function to generate a new movie with specified language."""
     logger_uvicorn.info("movie_generate")
-    movie =  service.generate_movie(payload.movie1, payload.movie2, payload.genre, payload.language)
+    try:
+        # the generation blocks on the OpenAI and poster service calls: keep it off the event loop
+        movie = await asyncio.to_thread(service.generate_movie, payload.movie1, payload.movie2, payload.genre, payload.language, payload.prompt_version, payload.generation_mode, payload.force_fresh)
+    except PromptError as e:
+        return JSONResponse({"detail": str(e)}, status_code=400)
     return movie
 
 
 
+@app.post('/generate/stream')
+@log_request
+async def movie_generate_stream(request: Request, payload: MoviePayload):
+    """Function to generate a new movie, streamed as Server-Sent Events:
+    `status` events, `token` events with the text written by the model, then a `movie` event with the GenAIMovie (or an `error` event)."""
+    logger_uvicorn.info("movie_generate_stream")
+    try:
+        # the prompt registry is built on first use, and selecting a template may read it: off the event loop
+        await asyncio.to_thread(service.prompts.select, payload.prompt_version)
+    except PromptError as e:
+        return JSONResponse({"detail": str(e)}, status_code=400)
+
+    def events():
+        try:
+            for event, data in service.generate_movie_stream(payload.movie1, payload.movie2, payload.genre, payload.language, payload.prompt_version, payload.force_fresh):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            logger.error("movie_generate_stream error: %s", e)
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+    # a sync iterator: Starlette runs it in a worker thread, off the event loop
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post('/generate/batch')
+@log_request
+async def movie_generate_batch(request: Request, payloads: list[MoviePayload]):
+    """Function to generate several movies, streamed as NDJSON in completion order:
+    one line per movie, `{"index": i, "movie": {...}}` or `{"index": i, "error": "..."}`, `i` being its position in the request."""
+    logger_uvicorn.info("movie_generate_batch %d movies", len(payloads))
+    if len(payloads) > service.batch_max_size:
+        return JSONResponse({"detail": f"at most {service.batch_max_size} movies per batch"}, status_code=413)
+
+    batch = service.generate_movies(payloads)
+
+    async def lines():
+        try:
+            # the batch blocks on the model calls: each movie is waited for in a worker thread, off the event loop
+            async for index, result in iterate_in_threadpool(batch):
+                if isinstance(result, Exception):
+                    yield json.dumps({"index": index, "error": str(result)}) + "\n"
+                else:
+                    yield json.dumps({"index": index, "movie": result.model_dump()}) + "\n"
+                if await request.is_disconnected():
+                    logger.info("movie_generate_batch: client disconnected")
+                    break
+        finally:
+            # the client went away or the response was cancelled: stop the pending generations and descriptions
+            batch.cancel()
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.get('/liveness')
 @log_request
 async def liveness(request: Request):
@@ -268,8 +678,14 @@ async def liveness(request: Request):
 @app.get('/readiness')
 @log_request
 async def readiness(request: Request):
-    """Function to check the readiness of the service."""
-    return  "readiness"
+    """Function to check the readiness of the service: ready once its clients are initialized
+    and the last background checks passed."""
+    content = {"dependencies": service.dependencies.status(), "checks": service.health.status()}
+    if not service.dependencies.ready():
+        return JSONResponse({"status": "initializing", **content}, status_code=503)
+    if not service.health.ready():
+        return JSONResponse({"status": "unavailable", **content}, status_code=503)
+    return {"status": "ready", **content}
 
 if __name__ == '__main__':
     uvicorn.run('main:app', host='0.0.0.0', port=8001)
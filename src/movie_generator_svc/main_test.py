@@ -1,5 +1,25 @@
+"""Generation of a movie with the live models, and benchmark of the generation modes on recorded responses.
 
-from main import GenAiMovieService, GenAIMovie, Movie, MoviePayload
+python main_test.py                 generate a movie with the live models
+python main_test.py --record        record the model responses of each generation mode in recordings/
+pytest -s main_test.py              replay the recordings and compare latency, token cost and schema validity
+
+No recording is shipped: the benchmark is skipped until `--record` ran against the deployments.
+"""
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+from pydantic import ValidationError
+
+from main import SINGLE_PASS, TWO_STEP, GenAiMovieService, GenAIMovie, Movie, MoviePayload
+
+RECORDINGS = os.path.join(os.path.dirname(__file__), "recordings", "generation_modes.json")
+# USD per million (input, output) tokens
+PRICES = {"gpt-5-mini": (0.25, 2.00), "gpt-4o": (2.50, 10.00)}
 
 movie1 = Movie(id="525",
                title="The Blues Brothers", 
@@ -14,8 +34,118 @@ movie2 = Movie(id="268153",
               poster_url="https://image.tmdb.org/t/p/original//mud7GBjqqLxVjOcGEftc84BAFfU.jpg",
               poster_description="The poster for La naissance des Barbapapa features a joyful and colorful design. In the center, there is a large, smiling pink character with a rounded shape and simple facial features, representative of the Barbapapa character. Surrounding this central figure are other characters from the Barbapapa family, each in different colors such as blue, orange, black, red, yellow, green, and purple. These characters have unique expressions and postures, adding to the whimsical and lively feel of the poster. \\n\\nThe background is a bright pink with a subtle gradient, featuring white line illustrations that resemble abstract, leafy shapes.")
 
-gen  = GenAiMovieService().generate_movie(movie1, movie2, "Animation")
-print("--------------------")
-print("TITLE",gen.title)
-print("PLOT", gen.plot)
-print("DESCRIPTION", gen.poster_description)
+
+def completion(call: dict) -> SimpleNamespace:
+    """A chat completion rebuilt from a recorded call"""
+    message = SimpleNamespace(content=call["content"], refusal=call.get("refusal"))
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=SimpleNamespace(**call["usage"]))
+
+
+class ModelClient:
+    """Stand-in for AzureOpenAI exposing chat.completions.create and beta.chat.completions.parse.
+
+    Replays recorded calls in order, or forwards them to a live client and records them."""
+    def __init__(self, calls: list[dict] | None = None, live=None):
+        self.calls = list(calls or [])
+        self.live = live
+        self.made: list[dict] = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._call("create")))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self._call("parse"))))
+
+    def _call(self, kind: str):
+        def call(**kwargs):
+            if self.live is None:
+                recorded = self.calls.pop(0)
+                assert recorded["model"] == kwargs["model"], f"expected a {recorded['model']} call, got {kwargs['model']}"
+                self.made.append(recorded)
+                return completion(recorded)
+            function = self.live.chat.completions.create if kind == "create" else self.live.beta.chat.completions.parse
+            start = time.perf_counter()
+            response = function(**kwargs)
+            message = response.choices[0].message
+            self.made.append({"model": kwargs["model"], "latency": round(time.perf_counter() - start, 3),
+                              "usage": {"prompt_tokens": response.usage.prompt_tokens, "completion_tokens": response.usage.completion_tokens},
+                              "content": message.content, "refusal": getattr(message, "refusal", None)})
+            return response
+        return call
+
+
+def cost(call: dict) -> float:
+    input_price, output_price = PRICES[call["model"]]
+    return (call["usage"]["prompt_tokens"] * input_price + call["usage"]["completion_tokens"] * output_price) / 1_000_000
+
+
+def replay(mode: str, runs: list[dict]) -> dict:
+    """Generate a movie per recorded run and aggregate latency, token cost and schema validity"""
+    service = GenAiMovieService()
+    latencies, costs, tokens, first_valid = [], [], [], 0
+    for run in runs:
+        service.client = ModelClient(run["calls"])
+        movie = service.generate_movie(movie1.model_copy(), movie2.model_copy(), "Comedy", "english", generation_mode=mode)
+        assert isinstance(movie, GenAIMovie) and movie.title
+        assert not service.client.calls, "recorded calls left unused"
+        made = service.client.made
+        latencies.append(sum(call["latency"] for call in made))
+        costs.append(sum(cost(call) for call in made))
+        tokens.append(sum(call["usage"]["prompt_tokens"] + call["usage"]["completion_tokens"] for call in made))
+        # valid at first attempt: no fallback, the structured answer was parsed as is
+        first_valid += movie.generation_mode == mode
+    return {
+        "runs": len(runs),
+        "latency": sum(latencies) / len(runs),
+        "tokens": sum(tokens) / len(runs),
+        "cost": sum(costs) / len(runs),
+        "validity": first_valid / len(runs),
+    }
+
+
+def test_generation_modes_benchmark():
+    """Compare the two-step and the single-pass generations on the recorded responses"""
+    if not os.path.exists(RECORDINGS):
+        pytest.skip("no recordings, run python main_test.py --record first")
+    with open(RECORDINGS, "r", encoding="utf-8") as file:
+        recordings = json.load(file)
+    results = {mode: replay(mode, recordings[mode]) for mode in (TWO_STEP, SINGLE_PASS)}
+
+    print(f"\n{'mode':<12} {'runs':>4} {'latency (s)':>12} {'tokens':>8} {'cost ($)':>10} {'schema valid':>13}")
+    for mode, result in results.items():
+        print(f"{mode:<12} {result['runs']:>4} {result['latency']:>12.2f} {result['tokens']:>8.0f} {result['cost']:>10.5f} {result['validity']:>13.0%}")
+
+    assert all(result["runs"] > 0 for result in results.values())
+    assert results[TWO_STEP]["validity"] == 1
+
+
+def test_unknown_generation_mode_is_rejected(monkeypatch):
+    """A payload or a GENERATION_MODE naming no generation mode is rejected instead of falling back silently"""
+    with pytest.raises(ValidationError):
+        MoviePayload(movie1=movie1, movie2=movie2, genre="Comedy", generation_mode="one_pass")
+    monkeypatch.setenv("GENERATION_MODE", "one_pass")
+    with pytest.raises(ValueError):
+        GenAiMovieService()
+
+
+def record(runs: int) -> None:
+    """Run each generation mode against the live models and save the calls"""
+    service = GenAiMovieService()
+    live = service.client
+    recordings = {"_comment": f"Recorded on {time.strftime('%Y-%m-%d')} with python main_test.py --record"}
+    for mode in (TWO_STEP, SINGLE_PASS):
+        recordings[mode] = []
+        for _ in range(runs):
+            service.client = ModelClient(live=live)
+            service.generate_movie(movie1.model_copy(), movie2.model_copy(), "Comedy", "english", generation_mode=mode)
+            recordings[mode].append({"calls": service.client.made})
+    os.makedirs(os.path.dirname(RECORDINGS), exist_ok=True)
+    with open(RECORDINGS, "w", encoding="utf-8") as file:
+        json.dump(recordings, file, indent=2)
+
+
+if __name__ == "__main__":
+    if "--record" in sys.argv:
+        record(int(os.getenv("RECORD_RUNS", "5")))
+    else:
+        gen  = GenAiMovieService().generate_movie(movie1, movie2, "Animation")
+        print("--------------------")
+        print("TITLE",gen.title)
+        print("PLOT", gen.plot)
+        print("DESCRIPTION", gen.poster_description)
@@ -0,0 +1,164 @@
+"""Registry of the prompt templates of the prompts/ directory: loaded and validated once, reloaded when a file changes."""
+import hashlib
+import logging
+import os
+import string
+import threading
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# placeholders a movie prompt template may use
+MOVIE_PROMPT_FIELDS = {
+    "movie1_title", "movie1_plot", "movie1_description",
+    "movie2_title", "movie2_plot", "movie2_description",
+    "genre", "language",
+}
+
+
+class PromptError(Exception):
+    """ Raised when a template is invalid or a prompt version is unknown """
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """ A template parsed once into its literal parts and its placeholders """
+    version: str
+    text: str
+    parts: tuple[tuple[str, str | None], ...]
+    fields: frozenset[str]
+    mtime: float
+
+    @classmethod
+    def parse(cls, version: str, text: str, mtime: float, allowed_fields: set[str]) -> "PromptTemplate":
+        """Parse a str.format template, rejecting the unknown, positional or formatted placeholders"""
+        parts = []
+        try:
+            for literal, field, format_spec, conversion in string.Formatter().parse(text):
+                if field is not None and (field not in allowed_fields or format_spec or conversion):
+                    raise PromptError(f"{version}: unsupported placeholder {{{field}}}")
+                parts.append((literal, field))
+        except ValueError as e:
+            raise PromptError(f"{version}: {e}") from e
+        return cls(version=version, text=text, parts=tuple(parts),
+                   fields=frozenset(field for _, field in parts if field is not None), mtime=mtime)
+
+    def render(self, **values: str) -> str:
+        """Fill the placeholders, without parsing the template again"""
+        return "".join(literal + (str(values[field]) if field is not None else "") for literal, field in self.parts)
+
+
+class PromptRegistry:
+    """ All the `*.txt` templates of a directory, by version (the file name without extension).
+
+    The templates are read at startup and a background thread reloads the ones whose file changed,
+    so rendering a prompt never touches the disk. An invalid template fails the startup; on reload
+    the previous version is kept and the error is logged.
+
+    `select` picks the version of a request: the requested one, else a weighted choice among the
+    `variants` (A/B test) that is stable for a given key, else the default version.
+    """
+
+    def __init__(self, directory: str, default: str, variants: dict[str, int] | None = None,
+                 allowed_fields: set[str] | None = None):
+        self.directory = directory
+        self.default = default
+        self.variants = variants or {}
+        self.allowed_fields = allowed_fields or MOVIE_PROMPT_FIELDS
+        self._templates: dict[str, PromptTemplate] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        for version, (path, mtime) in self._files().items():
+            self._templates[version] = self._load(version, path, mtime)
+        for version in [default, *self.variants]:
+            if version not in self._templates:
+                raise PromptError(f"unknown prompt version {version} in {directory}")
+        logger.info("Prompt registry %s: %s, default %s, variants %s", directory, sorted(self._templates), default, self.variants)
+
+    def _files(self) -> dict[str, tuple[str, float]]:
+        files = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".txt"):
+                path = os.path.join(self.directory, name)
+                files[name.removesuffix(".txt")] = (path, os.path.getmtime(path))
+        return files
+
+    def _load(self, version: str, path: str, mtime: float) -> PromptTemplate:
+        with open(path, "r", encoding="utf-8") as file:
+            return PromptTemplate.parse(version, file.read(), mtime, self.allowed_fields)
+
+    def versions(self) -> list[str]:
+        """The loaded versions"""
+        return sorted(self._templates)
+
+    def get(self, version: str) -> PromptTemplate:
+        """Return a loaded template"""
+        template = self._templates.get(version)
+        if template is None:
+            raise PromptError(f"unknown prompt version {version}, use one of {', '.join(self.versions())}")
+        return template
+
+    def select(self, version: str | None = None, key: str = "") -> PromptTemplate:
+        """Return the template to use for a request"""
+        if version:
+            return self.get(version)
+        total = sum(self.variants.values())
+        if total <= 0:
+            return self.get(self.default)
+        # the same key (e.g. the same two movies and genre) always gets the same variant
+        point = int(hashlib.sha256(key.encode("utf-8")).hexdigest(), 16) % total
+        for variant, weight in self.variants.items():
+            if point < weight:
+                return self.get(variant)
+            point -= weight
+        return self.get(self.default)
+
+    def reload(self) -> None:
+        """Load the new and modified templates, drop the deleted ones"""
+        files = self._files()
+        templates = {}
+        for version, (path, mtime) in files.items():
+            current = self._templates.get(version)
+            if current is not None and current.mtime == mtime:
+                templates[version] = current
+                continue
+            try:
+                templates[version] = self._load(version, path, mtime)
+                logger.info("prompt %s (re)loaded", version)
+            except (OSError, PromptError) as e:
+                logger.error("prompt %s not reloaded: %s", version, e)
+                if current is not None:
+                    templates[version] = current
+        for version in [self.default, *self.variants]:
+            if version not in templates and version in self._templates:
+                logger.error("prompt %s removed, keeping the loaded one", version)
+                templates[version] = self._templates[version]
+        with self._lock:
+            self._templates = templates
+
+    def watch(self, interval: float) -> threading.Thread:
+        """Reload the templates every `interval` seconds in a background thread"""
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error("prompt reload error: %s", e)
+        thread = threading.Thread(target=run, name="prompt-registry", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        """Stop the background reload"""
+        self._stop.set()
+
+
+def parse_variants(value: str) -> dict[str, int]:
+    """Parse `version:weight,version:weight` (e.g. `structured_new_movie_short:90,structured_new_movie:10`)"""
+    variants = {}
+    for item in value.split(","):
+        if item.strip():
+            version, _, weight = item.partition(":")
+            variants[version.strip()] = int(weight or "1")
+    return variants
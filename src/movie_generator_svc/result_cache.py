@@ -0,0 +1,81 @@
+"""Cache of the generated movies: an identical mashup (same movies, genre, language and prompt) is served without calling the models."""
+import hashlib
+import json
+import logging
+
+from opentelemetry import metrics
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def result_key(movie1_id: str, movie2_id: str, genre: str, language: str | None,
+               prompt_version: str, prompt_text: str) -> str:
+    """Key of a generated movie: the prompt version and a hash of the normalized request and of the template text,
+    so editing a template (reloaded by the prompt registry) does not serve the movies of the previous text"""
+    normalized = {
+        "movie1": str(movie1_id).strip(),
+        "movie2": str(movie2_id).strip(),
+        "genre": genre.strip().lower(),
+        "language": (language or "english").strip().lower(),
+        "prompt": hashlib.sha256(prompt_text.encode("utf-8")).hexdigest(),
+    }
+    digest = hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"generated_movie:{prompt_version}:{digest}"
+
+
+class ResultCache:
+    """ Generated movies stored as JSON in Redis (redis_client.RedisClient) for `expire` seconds.
+
+    An error of Redis is logged and handled as a miss: the movie is generated as without cache.
+    Hits, misses, bypasses (force fresh) and errors are exported as OpenTelemetry metrics
+    tagged by prompt version, the hit rate is hits / (hits + misses).
+    """
+
+    def __init__(self, redis_client, expire: int, meter: metrics.Meter | None = None):
+        self.redis_client = redis_client
+        self.expire = expire
+
+        meter = meter or metrics.get_meter(__name__)
+        self._hits = meter.create_counter(
+            "generated_movie.cache.hits", unit="{hit}",
+            description="Generated movies served from the result cache")
+        self._misses = meter.create_counter(
+            "generated_movie.cache.misses", unit="{miss}",
+            description="Generated movies not found in the result cache")
+        self._bypasses = meter.create_counter(
+            "generated_movie.cache.bypasses", unit="{request}",
+            description="Requests generating a fresh movie without reading the result cache")
+        self._errors = meter.create_counter(
+            "generated_movie.cache.errors", unit="{error}",
+            description="Errors of the result cache, handled as misses")
+
+    def get(self, key: str, prompt_version: str) -> dict | None:
+        """Return the cached movie or None"""
+        try:
+            raw = self.redis_client.get(key)
+            movie = json.loads(raw) if raw is not None else None
+        except Exception as e:
+            logger.error("result cache get error for %s: %s", key, e)
+            self._errors.add(1, {"prompt_version": prompt_version, "operation": "get"})
+            movie = None
+        if movie is None:
+            logger.info("result cache miss %s", key)
+            self._misses.add(1, {"prompt_version": prompt_version})
+            return None
+        logger.info("result cache hit %s", key)
+        self._hits.add(1, {"prompt_version": prompt_version})
+        return movie
+
+    def bypass(self, key: str, prompt_version: str) -> None:
+        """Record a request skipping the cache (force fresh), its result still replaces the cached one"""
+        logger.info("result cache bypassed %s", key)
+        self._bypasses.add(1, {"prompt_version": prompt_version})
+
+    def set(self, key: str, prompt_version: str, movie: dict) -> None:
+        """Store a generated movie"""
+        try:
+            self.redis_client.set(key, json.dumps(movie), expire=self.expire)
+        except Exception as e:
+            logger.error("result cache set error for %s: %s", key, e)
+            self._errors.add(1, {"prompt_version": prompt_version, "operation": "set"})
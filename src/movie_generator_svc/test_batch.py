@@ -0,0 +1,113 @@
+"""Tests of the batch generation (POST /generate/batch)."""
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from dependencies import Dependencies
+from main import Movie, MoviePayload
+
+MOVIES = [Movie(id=str(i), title=f"Movie {i}", plot=f"Plot {i}", poster_url=f"https://example.com/{i}.jpg") for i in range(3)]
+
+
+class Models:
+    """Stand-in for AzureOpenAI counting the concurrent gpt-5-mini calls"""
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self.parse)))
+
+    @staticmethod
+    def completion(content: str) -> SimpleNamespace:
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content, refusal=None))], usage=None)
+
+    def create(self, **kwargs):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.latency)
+        with self._lock:
+            self.running -= 1
+        return self.completion("A mashup")
+
+    def parse(self, **kwargs):
+        return self.completion(json.dumps({"id": "x", "title": "Mashup", "plot": "A mashup", "poster_url": ""}))
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """The stand-in set as the OpenAI client, without building the real one (no AZURE_OPENAI_* needed)"""
+    models = Models()
+    described = []
+    dependencies = Dependencies()
+    for name, value in (("openai", models), ("prompts", main.service.prompts), ("result_cache", None)):
+        dependencies.add(name, lambda: None).set(value)
+    monkeypatch.setattr(main.service, "dependencies", dependencies)
+    monkeypatch.setattr(main.service, "batch_concurrency", 2)
+    monkeypatch.setattr(main.service, "describe_poster", lambda title, url: described.append(url) or f"poster of {title}")
+    models.described = described
+    return models
+
+
+def test_batch_streams_every_movie_with_shared_descriptions(models):
+    """Each poster is described once, at most `batch_concurrency` generations run together, one line per movie"""
+    pairs = [(0, 1), (0, 2), (1, 2), (1, 0), (2, 0)]
+    payloads = [{"movie1": MOVIES[a].model_dump(), "movie2": MOVIES[b].model_dump(), "genre": "comedy"} for a, b in pairs]
+    payloads.append({**payloads[0], "prompt_version": "unknown"})
+
+    response = TestClient(main.app).post("/generate/batch", json=payloads)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["index"] for line in lines) == list(range(6))
+    movies = {line["index"]: line["movie"] for line in lines if "movie" in line}
+    assert len(movies) == 5
+    assert movies[1]["payload"]["movie2"]["poster_description"] == "poster of Movie 2"
+    assert "unknown prompt version" in next(line["error"] for line in lines if line["index"] == 5)
+    assert sorted(models.described) == sorted(movie.poster_url for movie in MOVIES)
+    assert models.max_running == 2
+
+
+def test_batch_size_is_limited(models, monkeypatch):
+    """A batch over GENERATE_BATCH_MAX_SIZE is rejected"""
+    monkeypatch.setattr(main.service, "batch_max_size", 1)
+    payload = {"movie1": MOVIES[0].model_dump(), "movie2": MOVIES[1].model_dump(), "genre": "comedy"}
+
+    response = TestClient(main.app).post("/generate/batch", json=[payload, payload])
+
+    assert response.status_code == 413
+
+
+def test_cancelled_batch_stops_describing_the_posters(models, monkeypatch):
+    """Cancelling a batch (the client went away) drops the poster descriptions not started yet"""
+    monkeypatch.setattr(main.service, "batch_describe_workers", 1)
+    monkeypatch.setattr(main.service, "describe_poster", lambda title, url: time.sleep(0.05) or models.described.append(url))
+    payloads = [MoviePayload(movie1=MOVIES[a].model_copy(), movie2=MOVIES[b].model_copy(), genre="comedy") for a, b in [(0, 1), (1, 2)]]
+
+    batch = main.service.generate_movies(payloads)
+    batch.cancel()
+    time.sleep(0.2)
+
+    assert len(models.described) == 1
+
+
+def test_description_deadline_starts_when_the_description_runs(models, monkeypatch):
+    """Posters queued behind the others of the batch get the whole DESCRIBE_POSTER_TIMEOUT once they run,
+    and the batch leaves the description pool of /generate alone"""
+    monkeypatch.setattr(main.service, "_describe_executor", None)
+    monkeypatch.setattr(main.service, "batch_describe_workers", 1)
+    monkeypatch.setattr(main.service, "_describe_timeout", 0.15)
+    monkeypatch.setattr(main.service, "describe_poster", lambda title, url: time.sleep(0.1) or f"poster of {title}")
+    payloads = [MoviePayload(movie1=MOVIES[a].model_copy(), movie2=MOVIES[b].model_copy(), genre="comedy") for a, b in [(0, 1), (1, 2)]]
+
+    results = dict(main.service.generate_movies(payloads))
+
+    assert results[1].payload.movie2.poster_description == "poster of Movie 2"
@@ -0,0 +1,63 @@
+"""Tests of the prompt registry."""
+import os
+import time
+
+import pytest
+
+from prompts import PromptError, PromptRegistry, parse_variants
+
+VALUES = dict(movie1_title="t1", movie1_plot="p1", movie1_description="d1",
+              movie2_title="t2", movie2_plot="p2", movie2_description="d2", genre="Comedy", language="french")
+
+
+def write(directory, name: str, text: str) -> None:
+    path = os.path.join(directory, f"{name}.txt")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(text)
+    # make the change visible even within the mtime resolution of the file system
+    os.utime(path, (time.time() + 10, time.time() + 10))
+
+
+def test_shipped_templates_are_valid():
+    """Every template of prompts/ loads and renders the same as str.format"""
+    registry = PromptRegistry(os.path.join(os.path.dirname(__file__), "prompts"), default="structured_new_movie_short")
+    for version in registry.versions():
+        template = registry.get(version)
+        assert template.render(**VALUES) == template.text.format(**VALUES)
+
+
+def test_invalid_template_is_rejected(tmp_path):
+    """An unknown placeholder fails the startup"""
+    write(tmp_path, "v1", "Title: {movie1_title} {unknown}")
+    with pytest.raises(PromptError):
+        PromptRegistry(str(tmp_path), default="v1")
+
+
+def test_versions_are_selected_per_request(tmp_path):
+    """The requested version wins, else the variants split the requests deterministically"""
+    write(tmp_path, "v1", "one {genre}")
+    write(tmp_path, "v2", "two {genre}")
+    registry = PromptRegistry(str(tmp_path), default="v1", variants=parse_variants("v1:50,v2:50"))
+
+    assert registry.select("v2").render(**VALUES) == "two Comedy"
+    chosen = {registry.select(key=f"movie_{i}").version for i in range(50)}
+    assert chosen == {"v1", "v2"}
+    assert registry.select(key="same").version == registry.select(key="same").version
+    with pytest.raises(PromptError):
+        registry.select("v3")
+
+
+def test_changed_file_is_reloaded_and_invalid_change_is_ignored(tmp_path):
+    """A modified template is reloaded, a broken one keeps the previous version"""
+    write(tmp_path, "v1", "one {genre}")
+    registry = PromptRegistry(str(tmp_path), default="v1")
+
+    write(tmp_path, "v1", "updated {genre}")
+    registry.reload()
+    assert registry.get("v1").render(**VALUES) == "updated Comedy"
+
+    with open(os.path.join(tmp_path, "v1.txt"), "w", encoding="utf-8") as file:
+        file.write("broken {genre")
+    os.utime(os.path.join(tmp_path, "v1.txt"), (time.time() + 20, time.time() + 20))
+    registry.reload()
+    assert registry.get("v1").render(**VALUES) == "updated Comedy"
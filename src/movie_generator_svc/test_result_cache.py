@@ -0,0 +1,69 @@
+"""Tests of the cache of the generated movies."""
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+
+from result_cache import ResultCache, result_key
+
+
+class Redis:
+    """Stand-in for redis_client.RedisClient"""
+    def __init__(self, down: bool = False):
+        self.values = {}
+        self.down = down
+
+    def get(self, key):
+        if self.down:
+            raise ConnectionError("redis is down")
+        return self.values.get(key)
+
+    def set(self, key, value, expire=None):
+        if self.down:
+            raise ConnectionError("redis is down")
+        self.values[key] = value
+        return value
+
+
+def counters(reader: InMemoryMetricReader) -> dict[str, int]:
+    values = {}
+    for resource_metrics in reader.get_metrics_data().resource_metrics:
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                values[metric.name] = sum(point.value for point in metric.data.data_points)
+    return values
+
+
+def test_key_is_normalized_and_follows_the_prompt():
+    """Case and blanks do not matter, the movies, the prompt version and the template text do"""
+    key = result_key("11", "12", "Comedy", "French", "short", "text")
+    assert key.startswith("generated_movie:short:")
+    assert result_key(" 11", "12", " comedy ", "french", "short", "text") == key
+    assert result_key("11", "12", "Comedy", None, "short", "text") == result_key("11", "12", "comedy", "english", "short", "text")
+    assert result_key("12", "11", "Comedy", "French", "short", "text") != key
+    assert result_key("11", "12", "Comedy", "French", "long", "text") != key
+    assert result_key("11", "12", "Comedy", "French", "short", "edited text") != key
+
+
+def test_hits_misses_and_bypasses_are_counted():
+    """A stored movie is returned, the hit rate can be computed from the metrics"""
+    reader = InMemoryMetricReader()
+    cache = ResultCache(Redis(), expire=60, meter=MeterProvider(metric_readers=[reader]).get_meter("test"))
+
+    assert cache.get("k", "short") is None
+    cache.set("k", "short", {"title": "Barb-a-Bambi"})
+    assert cache.get("k", "short") == {"title": "Barb-a-Bambi"}
+    cache.bypass("k", "short")
+
+    values = counters(reader)
+    assert values["generated_movie.cache.hits"] == 1
+    assert values["generated_movie.cache.misses"] == 1
+    assert values["generated_movie.cache.bypasses"] == 1
+
+
+def test_redis_errors_are_misses():
+    """The movie is generated as without cache when Redis is down"""
+    reader = InMemoryMetricReader()
+    cache = ResultCache(Redis(down=True), expire=60, meter=MeterProvider(metric_readers=[reader]).get_meter("test"))
+
+    cache.set("k", "short", {"title": "Barb-a-Bambi"})
+    assert cache.get("k", "short") is None
+    assert counters(reader)["generated_movie.cache.errors"] == 2
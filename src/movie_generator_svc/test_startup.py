@@ -0,0 +1,60 @@
+"""Startup benchmark: time to import the service and to answer /liveness and /readiness.
+
+Run with -s to print the timings:
+    python -m pytest -s test_startup.py
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from dependencies import Dependencies
+
+# prints the import time and the state of the dependencies right after the import, as the last line
+IMPORT_TIME = ("import json, time; start = time.perf_counter(); import main; seconds = time.perf_counter() - start; "
+               "print(json.dumps({'seconds': seconds, 'states': {name: dependency['state'] "
+               "for name, dependency in main.service.dependencies.status().items()}}))")
+# generous for a slow CI runner, far below an import that waits for a client to connect
+MAX_IMPORT_SECONDS = 10
+
+
+def test_import_time():
+    """Importing the service builds no client and makes no network call"""
+    result = subprocess.run([sys.executable, "-c", IMPORT_TIME], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)})
+    imported = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"\nimport main: {imported['seconds']:.3f}s")
+    assert imported["seconds"] < MAX_IMPORT_SECONDS
+    assert imported["states"] and set(imported["states"].values()) == {"pending"}
+
+
+def test_liveness_does_not_wait_for_the_dependencies(monkeypatch):
+    """/liveness answers while the OpenAI client is initializing, /readiness once it is built;
+    an unreachable Redis only disables the movie cache"""
+    released = threading.Event()
+    dependencies = Dependencies(retry_interval=0.05)
+    dependencies.add("openai", lambda: released.wait(5) and object())
+    dependencies.add("prompts", lambda: None)
+    dependencies.add("result_cache", lambda: (_ for _ in ()).throw(ConnectionError("unreachable")), required=False)
+    monkeypatch.setattr(main.service, "dependencies", dependencies)
+
+    start = time.perf_counter()
+    with TestClient(main.app) as client:
+        assert client.get("/liveness").status_code == 200
+        liveness = time.perf_counter() - start
+        response = client.get("/readiness")
+        assert response.status_code == 503
+        assert response.json()["dependencies"]["openai"]["state"] == "pending"
+
+        released.set()
+        while client.get("/readiness").status_code != 200:
+            time.sleep(0.01)
+        readiness = time.perf_counter() - start
+        assert main.service.result_cache is None
+    print(f"\n/liveness: {liveness:.3f}s, /readiness: {readiness:.3f}s")
+    assert liveness < 1
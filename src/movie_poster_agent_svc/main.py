@@ -8,6 +8,7 @@ import json
 from typing import Dict, Any, Optional, List
 from datetime import datetime, UTC
 from io import BytesIO
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Response, UploadFile, File, Form, Request
 from fastapi.responses import JSONResponse
@@ -31,6 +32,7 @@ from store import ValidationStore
 from cloudevents.http import from_http
 from agent import PosterValidationAgent
 from entities import PosterValidationRequest, PosterValidationResponse, MovieUpdateEvent
+from health import dapr_sidecar_probe, health_checker_from_env
 load_dotenv()
 
 # Configure logging
@@ -43,10 +45,19 @@ if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
     configure_azure_monitor()
     logger.info("Azure Monitor telemetry configured")
 
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Check the dependencies in the background."""
+    health.start()
+    yield
+    await health.stop()
+
+
 app = FastAPI(
     title="Movie Poster Validation Agent",
     description="AI Agent for validating movie poster images and descriptions",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Initialize DAPR
@@ -58,6 +69,14 @@ FastAPIInstrumentor.instrument_app(app)
 # Global agent instance
 poster_agent = PosterValidationAgent()
 
+# Readiness: the Dapr sidecar (state store, pub/sub) and the posters container checked in the background
+health = health_checker_from_env()
+health.add("dapr", dapr_sidecar_probe(health.timeout))
+if os.getenv("STORAGE_ACCOUNT_BLOB_URL"):
+    posters_container = poster_agent._image_loader._blob_service_client(os.getenv("STORAGE_ACCOUNT_BLOB_URL")).get_container_client(
+        os.getenv("POSTERS_CONTAINER", "movieposters"))
+    health.add("blob_storage", posters_container.get_container_properties)
+
 @app.get("/")
 async def root():
     """Health check endpoint."""
@@ -183,8 +202,10 @@ async def liveness():
 
 @app.get("/readiness")
 async def readiness():
-    """Readiness probe endpoint."""
-    return {"status": "ready"}
+    """Readiness probe endpoint: ready when the last background checks of the dependencies passed."""
+    if not health.ready():
+        return JSONResponse({"status": "unavailable", "checks": health.status()}, status_code=503)
+    return {"status": "ready", "checks": health.status()}
 
 
 @app.get("/dapr/subscribe")
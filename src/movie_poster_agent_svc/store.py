@@ -2,12 +2,19 @@
 import logging
 import json
 import traceback
+from typing import Optional
+import grpc
 from entities import PosterValidationResponse
 from dapr.clients import DaprClient
+from dapr.clients.grpc._state import Concurrency, StateOptions
 
 logging.basicConfig(level=logging.INFO)
 
 
+class ConcurrencyError(Exception):
+    """The validation changed in the store since it was read: its ETag no longer matches"""
+
+
 class ValidationStore:
   
     """Class to manage the movie store."""
@@ -15,19 +22,28 @@ class ValidationStore:
         self.dapr_client = dapr_client
         self.state_store_name = 'movie-poster-agent-svc-statetore'
         
-    def upsert(self, validation: PosterValidationResponse) -> PosterValidationResponse:
-        """Add a PosterValidationResponse to the store."""
+    def upsert(self, validation: PosterValidationResponse, etag: Optional[str] = None,
+               read_back: bool = False) -> PosterValidationResponse:
+        """Add or replace a PosterValidationResponse in the store and return it as written, or as read back with `read_back`.
+        With the `etag` of the stored validation the write fails with ConcurrencyError if it changed since it was read."""
         logging.info("Adding PosterValidationResponse: %s", validation)
-        logging.info("JSON %s", validation.to_json())
         movie_id = validation.id
-        logging.info("Saving movie to store %s using this key %s", self.state_store_name, movie_id)
-        self.dapr_client.save_state(
-            store_name=self.state_store_name,
-            key=movie_id,
-            value=validation.to_json()
-        )
+        logging.info("Saving movie to store %s using this key %s, etag %s", self.state_store_name, movie_id, etag)
+        try:
+            self.dapr_client.save_state(
+                store_name=self.state_store_name,
+                key=movie_id,
+                value=validation.to_json(),
+                etag=etag,
+                # with an ETag only the first write of that version succeeds, without one the last write wins
+                options=StateOptions(concurrency=Concurrency.first_write if etag else Concurrency.last_write)
+            )
+        except grpc.RpcError as e:
+            if etag and e.code() in (grpc.StatusCode.ABORTED, grpc.StatusCode.FAILED_PRECONDITION):
+                raise ConcurrencyError(f"validation {movie_id} changed since version {etag}") from e
+            raise
         logging.info("Validation %s added to store", movie_id)
-        return self.try_find_by_id(movie_id)
+        return self.try_find_by_id(movie_id) if read_back else validation
        
     def try_find_by_id(self, movie_id : str) -> PosterValidationResponse:
         """Find a movie by its ID."""
@@ -0,0 +1,209 @@
+"""Local caches of poster bytes: an in-memory tier and an on-disk tier, both LRU bounded by size in bytes."""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+@dataclass
+class CacheEntry:
+    """ A cached poster: its metadata and either its content (memory tier) or its path (disk tier) """
+    key: str
+    content_type: str
+    size: int
+    etag: str | None = None
+    last_modified: str | None = None
+    stored_at: float = field(default_factory=time.time)
+    content: bytes | None = None
+    path: str | None = None
+    digest: str | None = None
+
+    def __post_init__(self):
+        if self.digest is None and self.content is not None:
+            self.digest = hashlib.sha256(self.content).hexdigest()
+
+    def metadata(self) -> dict:
+        """Metadata persisted next to the content in the disk tier"""
+        return {
+            "key": self.key,
+            "content_type": self.content_type,
+            "size": self.size,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "stored_at": self.stored_at,
+            "digest": self.digest,
+        }
+
+
+class MemoryCache:
+    """ In-memory LRU cache bounded by the total size of the cached contents """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CacheEntry | None:
+        """Return the entry and mark it as the most recently used one"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, entry: CacheEntry) -> None:
+        """Add or replace an entry, evicting the least recently used ones when full"""
+        if entry.content is None or entry.size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(entry.key)
+            self._entries[entry.key] = entry
+            self.current_bytes += entry.size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.size
+                logger.info("memory cache evicted %s", evicted.key)
+
+    def remove(self, key: str) -> None:
+        """Drop an entry"""
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.size
+
+
+class DiskCache:
+    """ On-disk LRU cache bounded by the total size of the cached files.
+
+    Each entry is stored as two files named after the sha256 of its key:
+    `<digest>.bin` for the content and `<digest>.json` for the metadata.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.bin"), os.path.join(self.directory, f"{digest}.json")
+
+    def _load(self) -> None:
+        """Index the entries left by a previous process, oldest access first"""
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as file:
+                    metadata = json.load(file)
+                content_path, _ = self._paths(metadata["key"])
+                found.append((os.path.getatime(content_path), CacheEntry(path=content_path, **metadata)))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning("disk cache ignores %s: %s", name, e)
+        for _, entry in sorted(found, key=lambda item: item[0]):
+            self._entries[entry.key] = entry
+            self.current_bytes += entry.size
+        logger.info("disk cache %s loaded %d entries, %d bytes", self.directory, len(self._entries), self.current_bytes)
+        with self._lock:
+            self._evict()
+
+    def get(self, key: str) -> CacheEntry | None:
+        """Return the entry (with its path, without its content) and mark it as the most recently used one"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not os.path.exists(entry.path):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def read(self, entry: CacheEntry) -> bytes:
+        """Read the content of an entry"""
+        with open(entry.path, "rb") as file:
+            return file.read()
+
+    def temporary_path(self, key: str) -> str:
+        """Path of a temporary file, in the cache directory, to write the content of an entry to"""
+        content_path, _ = self._paths(key)
+        return f"{content_path}.{os.getpid()}.{threading.get_ident()}.{time.monotonic_ns()}.tmp"
+
+    def put(self, entry: CacheEntry) -> CacheEntry:
+        """Write an entry, evicting the least recently used ones when full"""
+        if entry.size > self.max_bytes:
+            return replace(entry, content=None, path=self._paths(entry.key)[0])
+        # write to a temporary file first so readers never see a partial poster
+        temporary_path = self.temporary_path(entry.key)
+        with open(temporary_path, "wb") as file:
+            file.write(entry.content)
+        return self.put_file(entry, temporary_path)
+
+    def put_file(self, entry: CacheEntry, source_path: str) -> CacheEntry:
+        """Move a complete file (see `temporary_path`) into the cache as the content of an entry"""
+        content_path, metadata_path = self._paths(entry.key)
+        stored = replace(entry, content=None, path=content_path)
+        if entry.size > self.max_bytes:
+            os.remove(source_path)
+            return stored
+        temporary_metadata_path = f"{metadata_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_metadata_path, "w", encoding="utf-8") as file:
+            json.dump(stored.metadata(), file)
+        with self._lock:
+            self._remove(entry.key, delete_files=False)
+            os.replace(source_path, content_path)
+            os.replace(temporary_metadata_path, metadata_path)
+            self._entries[entry.key] = stored
+            self.current_bytes += stored.size
+            self._evict()
+        return stored
+
+    def touch(self, entry: CacheEntry) -> CacheEntry:
+        """Record that an entry has just been revalidated"""
+        content_path, metadata_path = self._paths(entry.key)
+        touched = replace(entry, stored_at=time.time(), content=None, path=content_path)
+        with self._lock:
+            if entry.key in self._entries:
+                with open(metadata_path, "w", encoding="utf-8") as file:
+                    json.dump(touched.metadata(), file)
+                self._entries[entry.key] = touched
+        return touched
+
+    def remove(self, key: str) -> None:
+        """Drop an entry and its files"""
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: str, delete_files: bool = True) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.current_bytes -= entry.size
+        if delete_files:
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _evict(self) -> None:
+        while self.current_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+            logger.info("disk cache evicted %s", key)
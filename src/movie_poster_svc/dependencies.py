@@ -0,0 +1,125 @@
+"""Lazy, concurrent initialization of the clients of a service.
+
+The clients are built at the same time in the background when the service starts (FastAPI lifespan),
+or on first use when a request needs one before, so a slow or dead dependency does not block the startup:
+/liveness answers at once and /readiness reports the state of each dependency.
+
+The same module is used by movie_poster_svc and movie_generator_svc.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+
+class Dependency:
+    """ A client built once by `factory`; a failed build is tried again on the next use """
+
+    def __init__(self, name: str, factory: Callable[[], Any], required: bool = True):
+        self.name = name
+        self.factory = factory
+        self.required = required
+        self.state = PENDING
+        self.error: str | None = None
+        self.duration: float | None = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        """The client, built now (blocking) if needed"""
+        if self.state == READY:
+            return self._value
+        with self._lock:
+            if self.state != READY:
+                start = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    self.state = FAILED
+                    self.error = str(e)
+                    logger.error("%s initialization failed: %s", self.name, e)
+                    raise
+                finally:
+                    self.duration = time.perf_counter() - start
+                self.state = READY
+                self.error = None
+                logger.info("%s initialized in %.3fs", self.name, self.duration)
+        return self._value
+
+    async def aget(self) -> Any:
+        """The client, built in a worker thread if needed so the event loop keeps running"""
+        if self.state == READY:
+            return self._value
+        return await asyncio.to_thread(self.get)
+
+    def peek(self) -> Any:
+        """The client if it is already built, else None, without waiting"""
+        return self._value if self.state == READY else None
+
+    def set(self, value: Any) -> None:
+        """Use a client built elsewhere (e.g. a stand-in)"""
+        with self._lock:
+            self._value = value
+            self.state = READY
+            self.error = None
+
+    def status(self) -> dict:
+        return {"state": self.state, "required": self.required, "error": self.error,
+                "duration": round(self.duration, 3) if self.duration is not None else None}
+
+
+class Dependencies:
+    """ The dependencies of a service, built concurrently in worker threads by `start` """
+
+    def __init__(self, retry_interval: float = 10.0):
+        self.retry_interval = retry_interval
+        self._dependencies: dict[str, Dependency] = {}
+        self._task: asyncio.Task | None = None
+        self._started_at = time.perf_counter()
+
+    def add(self, name: str, factory: Callable[[], Any], required: bool = True) -> Dependency:
+        dependency = Dependency(name, factory, required)
+        self._dependencies[name] = dependency
+        return dependency
+
+    def __getitem__(self, name: str) -> Dependency:
+        return self._dependencies[name]
+
+    async def warm_up(self) -> None:
+        """Build every dependency at the same time, trying the failed ones again every `retry_interval` seconds"""
+        while True:
+            pending = [dependency for dependency in self._dependencies.values() if dependency.state != READY]
+            await asyncio.gather(*[asyncio.to_thread(dependency.get) for dependency in pending], return_exceptions=True)
+            if all(dependency.state == READY for dependency in self._dependencies.values()):
+                logger.info("dependencies initialized %.3fs after startup", time.perf_counter() - self._started_at)
+                return
+            await asyncio.sleep(self.retry_interval)
+
+    def start(self) -> None:
+        """Warm up the dependencies in the background"""
+        self._started_at = time.perf_counter()
+        self._task = asyncio.create_task(self.warm_up())
+
+    async def stop(self) -> None:
+        """Stop the warm-up"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def ready(self) -> bool:
+        """True once every required dependency is built"""
+        return all(dependency.state == READY for dependency in self._dependencies.values() if dependency.required)
+
+    def status(self) -> dict[str, dict]:
+        return {name: dependency.status() for name, dependency in self._dependencies.items()}
@@ -0,0 +1,212 @@
+"""Multi-tier cache of the poster descriptions (in-process LRU, then Redis) with single-flight and stale-while-revalidate."""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Protocol
+
+from opentelemetry import metrics
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+@dataclass
+class CachedValue:
+    """ A cached value and the time it was computed """
+    value: str
+    stored_at: float = field(default_factory=time.time)
+
+    def age(self) -> float:
+        """Seconds since the value was computed"""
+        return time.time() - self.stored_at
+
+
+class CacheTier(Protocol):
+    """ A level of the cache. `name` tags the logs and the metrics. """
+    name: str
+
+    async def get(self, key: str) -> CachedValue | None:
+        """Return the cached value or None"""
+
+    async def set(self, key: str, value: CachedValue, expire: int) -> None:
+        """Store a value for `expire` seconds"""
+
+
+class LocalTier:
+    """ In-process LRU tier bounded by its number of entries """
+    name = "local"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[CachedValue, float]] = OrderedDict()
+
+    async def get(self, key: str) -> CachedValue | None:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if time.time() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: CachedValue, expire: int) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (value, time.time() + expire)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class RedisTier:
+    """ Redis tier shared by all the workers and replicas """
+    name = "redis"
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    async def get(self, key: str) -> CachedValue | None:
+        raw = await self.redis_client.get(key)
+        if raw is None:
+            return None
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+        try:
+            data = json.loads(raw)
+            return CachedValue(value=data["value"], stored_at=data["stored_at"])
+        except (ValueError, KeyError, TypeError):
+            # plain string written before the values were stored with their timestamp
+            return CachedValue(value=raw)
+
+    async def set(self, key: str, value: CachedValue, expire: int) -> None:
+        await self.redis_client.set(key, json.dumps({"value": value.value, "stored_at": value.stored_at}), ex=expire)
+
+
+class DescriptionCache:
+    """ Read-through cache over a list of tiers, fastest first.
+
+    * a value younger than `ttl` seconds is fresh and returned as is;
+    * a value older than `ttl` but younger than `ttl + stale_ttl` is returned at once
+      while a single background task computes it again (stale-while-revalidate);
+    * concurrent misses of the same key share one call to `compute` (single-flight).
+
+    An error of a tier (e.g. Redis unavailable) is logged and handled as a miss.
+
+    Hits, misses, errors and durations are exported as OpenTelemetry metrics tagged by tier,
+    the duration of `compute` is tagged by `model`.
+    """
+
+    def __init__(self, tiers: list[CacheTier], ttl: int, stale_ttl: int = 0,
+                 model: str | None = None, meter: metrics.Meter | None = None):
+        self.tiers = tiers
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.model = model
+        self._inflight: dict[str, asyncio.Task] = {}
+
+        meter = meter or metrics.get_meter(__name__)
+        self._hits = meter.create_counter(
+            "poster_description.cache.hits", unit="{hit}",
+            description="Poster descriptions found in a cache tier, fresh or stale")
+        self._misses = meter.create_counter(
+            "poster_description.cache.misses", unit="{miss}",
+            description="Poster descriptions not found in a cache tier")
+        self._errors = meter.create_counter(
+            "poster_description.cache.errors", unit="{error}",
+            description="Errors of a cache tier, handled as misses")
+        self._coalesced = meter.create_counter(
+            "poster_description.cache.coalesced", unit="{request}",
+            description="Requests that joined an in-flight computation instead of calling the model")
+        self._tier_duration = meter.create_histogram(
+            "poster_description.cache.duration", unit="s",
+            description="Round-trip time of the cache tiers (e.g. Redis) by operation")
+        self._compute_duration = meter.create_histogram(
+            "poster_description.model.duration", unit="s",
+            description="Latency of the model computing a poster description")
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """Return the cached value of `key`, calling `compute` to produce it when needed"""
+        for index, tier in enumerate(self.tiers):
+            cached = await self._tier_get(tier, key)
+            if cached is None:
+                continue
+            logger.info("%s cache hit for %s", tier.name, key)
+            # back-fill the faster tiers
+            for upper in self.tiers[:index]:
+                await self._tier_set(upper, key, cached)
+            stale = cached.age() >= self.ttl
+            self._hits.add(1, {"tier": tier.name, "state": "stale" if stale else "fresh"})
+            if stale:
+                logger.info("stale value for %s, revalidating", key)
+                self._revalidate(key, compute)
+            return cached.value
+        logger.info("cache miss for %s", key)
+        return await self._single_flight(key, compute)
+
+    async def _single_flight(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """Run `compute` once for all the concurrent callers of the same key"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._start(key, compute)
+        else:
+            logger.info("joining in-flight computation of %s", key)
+            self._coalesced.add(1)
+        # a caller going away does not cancel the computation shared with the others
+        return await asyncio.shield(task)
+
+    def _revalidate(self, key: str, compute: Callable[[], Awaitable[str]]) -> None:
+        """Compute the value again in the background, unless it is already being computed"""
+        if key not in self._inflight:
+            self._start(key, compute)
+
+    def _start(self, key: str, compute: Callable[[], Awaitable[str]]) -> asyncio.Task:
+        async def compute_and_store() -> str:
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                value = await compute()
+                outcome = "success"
+            finally:
+                self._compute_duration.record(time.perf_counter() - start, {"model": self.model or "unknown", "outcome": outcome})
+            cached = CachedValue(value=value)
+            for tier in self.tiers:
+                await self._tier_set(tier, key, cached)
+            return value
+
+        def done(task: asyncio.Task) -> None:
+            self._inflight.pop(key, None)
+            if not task.cancelled() and task.exception() is not None:
+                logger.error("computation of %s failed: %s", key, task.exception())
+
+        task = asyncio.create_task(compute_and_store())
+        self._inflight[key] = task
+        task.add_done_callback(done)
+        return task
+
+    async def _tier_get(self, tier: CacheTier, key: str) -> CachedValue | None:
+        start = time.perf_counter()
+        try:
+            value = await tier.get(key)
+        except Exception as e:
+            logger.error("%s cache get error for %s: %s", tier.name, key, e)
+            self._errors.add(1, {"tier": tier.name, "operation": "get"})
+            value = None
+        self._tier_duration.record(time.perf_counter() - start, {"tier": tier.name, "operation": "get"})
+        if value is None:
+            self._misses.add(1, {"tier": tier.name})
+        return value
+
+    async def _tier_set(self, tier: CacheTier, key: str, value: CachedValue) -> None:
+        start = time.perf_counter()
+        try:
+            # expire the value at the same time in every tier, back-filled or not
+            await tier.set(key, value, max(1, int(self.ttl + self.stale_ttl - value.age())))
+        except Exception as e:
+            logger.error("%s cache set error for %s: %s", tier.name, key, e)
+            self._errors.add(1, {"tier": tier.name, "operation": "set"})
+        self._tier_duration.record(time.perf_counter() - start, {"tier": tier.name, "operation": "set"})
@@ -0,0 +1,158 @@
+"""Poster generation jobs run by a bounded pool of background workers."""
+import asyncio
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class PosterJob(BaseModel):
+    """ A poster generation job """
+    id: str
+    movie_id: str
+    status: str = QUEUED
+    url: str | None = None
+    error: str | None = None
+    created_at: float
+    updated_at: float
+
+    def done(self) -> bool:
+        """True once the job succeeded or failed"""
+        return self.status in (SUCCEEDED, FAILED)
+
+
+class JobQueueFull(Exception):
+    """ Raised when no more job can be queued """
+
+
+class MemoryJobStore:
+    """ Job store local to the process: a poll reaching another worker or replica does not find the job """
+    shared = False
+
+    def __init__(self):
+        self._jobs: dict[str, PosterJob] = {}
+
+    async def get(self, job_id: str) -> PosterJob | None:
+        return self._jobs.get(job_id)
+
+    async def put(self, job: PosterJob) -> None:
+        self._jobs[job.id] = job
+
+
+class RedisJobStore:
+    """ Job store shared by all the workers and replicas, so any of them can answer a poll """
+    shared = True
+
+    def __init__(self, redis_client, expire: int):
+        self.redis_client = redis_client
+        self.expire = expire
+
+    async def get(self, job_id: str) -> PosterJob | None:
+        raw = await self.redis_client.get(f"poster_job:{job_id}")
+        return PosterJob.model_validate_json(raw) if raw else None
+
+    async def put(self, job: PosterJob) -> None:
+        await self.redis_client.set(f"poster_job:{job.id}", job.model_dump_json(), ex=self.expire)
+
+
+class PosterJobRunner:
+    """ Queue of poster generation jobs consumed by a fixed number of workers.
+
+    `generate(movie_id)` returns the poster URL, `explain(exception)` the error message of a failed job
+    and `placeholder(exception)` the URL of the poster shown instead of the one of a failed job.
+    The queue is bounded: `submit` raises JobQueueFull instead of letting a burst pile up.
+    """
+
+    def __init__(self, store, generate: Callable[[str], Awaitable[str]], explain: Callable[[Exception], Awaitable[str]],
+                 workers: int, queue_size: int, placeholder: Callable[[Exception], str | None] = lambda exception: None):
+        self.store = store
+        self._generate = generate
+        self._explain = explain
+        self._placeholder = placeholder
+        self._worker_count = workers
+        self._queue: asyncio.Queue[PosterJob] = asyncio.Queue(maxsize=queue_size)
+        # places taken in the queue by the jobs being stored by `submit`
+        self._reserved = 0
+        self._workers: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Start the workers"""
+        logger.info("Starting %d poster job workers, queue size %d", self._worker_count, self._queue.maxsize)
+        self._workers = [asyncio.create_task(self._work(index)) for index in range(self._worker_count)]
+
+    async def stop(self) -> None:
+        """Stop the workers, the jobs still queued are lost"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    async def submit(self, movie_id: str) -> PosterJob:
+        """Queue the generation of the poster of a movie"""
+        # the place in the queue is reserved before the job is stored: concurrent submits cannot overfill it
+        if self._queue.qsize() + self._reserved >= self._queue.maxsize:
+            raise JobQueueFull(f"{self._queue.qsize() + self._reserved} poster generations are already queued")
+        now = time.time()
+        job = PosterJob(id=uuid.uuid4().hex, movie_id=movie_id, created_at=now, updated_at=now)
+        self._reserved += 1
+        try:
+            await self.store.put(job)
+        finally:
+            self._reserved -= 1
+        self._queue.put_nowait(job)
+        logger.info("poster job %s queued for movie %s", job.id, movie_id)
+        return job
+
+    async def wait(self, job_id: str, timeout: float, interval: float = 0.5) -> PosterJob | None:
+        """Return the job once it is done or after `timeout` seconds (long polling)"""
+        deadline = time.monotonic() + timeout
+        job = await self.store.get(job_id)
+        while job is not None and not job.done() and time.monotonic() < deadline:
+            await asyncio.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+            job = await self.store.get(job_id)
+        return job
+
+    async def _work(self, index: int) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.error("poster job worker %d: %s", index, e)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: PosterJob) -> None:
+        logger.info("poster job %s running", job.id)
+        job = job.model_copy(update={"status": RUNNING, "updated_at": time.time()})
+        await self._save(job)
+        try:
+            url = await self._generate(job.movie_id)
+            job = job.model_copy(update={"status": SUCCEEDED, "url": url, "updated_at": time.time()})
+        except Exception as e:
+            logger.error("poster job %s failed: %s", job.id, e)
+            job = job.model_copy(update={"status": FAILED, "url": self._placeholder(e), "error": await self._explain(e),
+                                         "updated_at": time.time()})
+        await self._save(job)
+        logger.info("poster job %s %s", job.id, job.status)
+
+    async def _save(self, job: PosterJob) -> None:
+        """Store the new status of a job, best effort: a store error must not stop the generation nor the worker"""
+        try:
+            await self.store.put(job)
+        except Exception as e:
+            logger.error("poster job %s: status %s not stored: %s", job.id, job.status, e)
@@ -0,0 +1,236 @@
+"""Admission control of the image model calls: a concurrency limit per model with a bounded wait queue."""
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from opentelemetry import metrics
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class CapacityExceeded(Exception):
+    """ Raised when a call cannot get a slot: the wait queue is full or the wait timed out """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LocalSemaphore:
+    """ Slots shared by the coroutines of this process """
+
+    def __init__(self, limit: int):
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def try_acquire(self) -> tuple[bool, str | None]:
+        if self._semaphore.locked():
+            return False, None
+        await self._semaphore.acquire()
+        return True, None
+
+    async def acquire(self) -> str | None:
+        await self._semaphore.acquire()
+        return None
+
+    async def release(self, token: str | None) -> None:
+        self._semaphore.release()
+
+
+class RedisSemaphore:
+    """ Slots shared by all the workers and replicas, held in a Redis sorted set.
+
+    Each holder is a member scored by the expiry of its lease, so the slot of a crashed worker
+    comes back after `lease` seconds. The check and the take run in one Lua script.
+    The lease of a held slot is renewed every `lease / 3` seconds, so a model call may outlast it.
+    While Redis is unavailable (errors, open circuit) the slots fall back to `fallback`, a limit per process,
+    instead of rejecting every call.
+    """
+
+    ACQUIRE = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], tonumber(ARGV[1]) + tonumber(ARGV[2]), ARGV[4])
+    redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2])))
+    return 1
+end
+return 0
+"""
+
+    def __init__(self, redis_client, key: str, limit: int, lease: int, interval: float = 0.25,
+                 fallback: LocalSemaphore | None = None):
+        self.redis_client = redis_client
+        self.key = key
+        self.limit = limit
+        self.lease = lease
+        self.interval = interval
+        self.fallback = fallback or LocalSemaphore(limit)
+        self._renewals: dict[str, asyncio.Task] = {}
+
+    async def try_acquire(self) -> tuple[bool, str | None]:
+        try:
+            return await self._try_acquire()
+        except Exception as e:
+            logger.warning("%s unavailable, slot limited to this process: %s", self.key, e)
+            return await self.fallback.try_acquire()
+
+    async def acquire(self) -> str | None:
+        try:
+            acquired, token = await self._try_acquire()
+            while not acquired:
+                await asyncio.sleep(self.interval)
+                acquired, token = await self._try_acquire()
+        except Exception as e:
+            logger.warning("%s unavailable, slot limited to this process: %s", self.key, e)
+            return await self.fallback.acquire()
+        return token
+
+    async def release(self, token: str | None) -> None:
+        if token is None:
+            await self.fallback.release(token)
+            return
+        renewal = self._renewals.pop(token, None)
+        if renewal is not None:
+            renewal.cancel()
+        await self.redis_client.zrem(self.key, token)
+
+    async def _try_acquire(self) -> tuple[bool, str]:
+        token = uuid.uuid4().hex
+        acquired = bool(await self.redis_client.eval(self.ACQUIRE, 1, self.key, time.time(), self.lease, self.limit, token))
+        if acquired:
+            self._renewals[token] = asyncio.create_task(self._renew(token))
+        return acquired, token
+
+    async def _renew(self, token: str) -> None:
+        """Push back the expiry of the lease of a held slot until it is released"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                # xx: a lease that already expired is not taken again
+                await self.redis_client.zadd(self.key, {token: time.time() + self.lease}, xx=True)
+                await self.redis_client.expire(self.key, self.lease)
+            except Exception as e:
+                logger.error("%s lease renewal error: %s", self.key, e)
+
+
+class ModelLimiter:
+    """ At most `limit` concurrent calls to a model, at most `queue_size` calls waiting for a slot in this process.
+
+    A call beyond the queue, or waiting more than `timeout` seconds, is rejected at once with CapacityExceeded
+    instead of adding to the throttling of the deployment.
+    Queue depth, in-flight calls, waits and rejections are exported as OpenTelemetry metrics tagged by model.
+    """
+
+    def __init__(self, model: str, semaphore, queue_size: int, timeout: float, retry_after: int,
+                 meter: metrics.Meter | None = None):
+        self.model = model
+        self.semaphore = semaphore
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.waiting = 0
+        self._releases: set[asyncio.Task] = set()
+
+        meter = meter or metrics.get_meter(__name__)
+        self._queue_depth = meter.create_up_down_counter(
+            "image_model.limiter.queue_depth", unit="{call}",
+            description="Image model calls waiting for a slot")
+        self._in_flight = meter.create_up_down_counter(
+            "image_model.limiter.in_flight", unit="{call}",
+            description="Image model calls holding a slot")
+        self._rejections = meter.create_counter(
+            "image_model.limiter.rejections", unit="{call}",
+            description="Image model calls rejected because the queue was full or the wait timed out")
+        self._wait = meter.create_histogram(
+            "image_model.limiter.wait", unit="s",
+            description="Time spent waiting for a slot")
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold a slot of the model for the duration of the block"""
+        acquired, token = False, None
+        try:
+            acquired, token = await self.semaphore.try_acquire()
+            if not acquired:
+                token = await self._wait_for_slot()
+                acquired = True
+            self._in_flight.add(1, {"model": self.model})
+            yield
+        finally:
+            if acquired:
+                self._in_flight.add(-1, {"model": self.model})
+                await self._release(token)
+
+    async def _release(self, token: str | None) -> None:
+        try:
+            await self.semaphore.release(token)
+        except Exception as e:
+            # the lease expires on its own
+            logger.error("%s slot release error: %s", self.model, e)
+
+    async def _wait_for_slot(self) -> str | None:
+        if self.waiting >= self.queue_size:
+            self._rejections.add(1, {"model": self.model, "reason": "queue_full"})
+            raise CapacityExceeded(f"{self.model}: {self.waiting} calls already waiting", self.retry_after)
+        self.waiting += 1
+        self._queue_depth.add(1, {"model": self.model})
+        start = time.perf_counter()
+        acquisition = asyncio.ensure_future(self.semaphore.acquire())
+        try:
+            await asyncio.wait({acquisition}, timeout=self.timeout)
+        except asyncio.CancelledError:
+            self._abandon(acquisition)
+            raise
+        finally:
+            self.waiting -= 1
+            self._queue_depth.add(-1, {"model": self.model})
+            self._wait.record(time.perf_counter() - start, {"model": self.model})
+        if not acquisition.done():
+            self._abandon(acquisition)
+            self._rejections.add(1, {"model": self.model, "reason": "timeout"})
+            raise CapacityExceeded(f"{self.model}: no slot after {self.timeout}s", self.retry_after)
+        token = acquisition.result()
+        logger.info("%s slot acquired after %.3fs", self.model, time.perf_counter() - start)
+        return token
+
+    def _abandon(self, acquisition: asyncio.Future) -> None:
+        """Stop waiting for a slot, giving it back if it is taken anyway"""
+        acquisition.cancel()
+        acquisition.add_done_callback(self._release_abandoned)
+
+    def _release_abandoned(self, acquisition: asyncio.Future) -> None:
+        if acquisition.cancelled() or acquisition.exception() is not None:
+            return
+        release = asyncio.ensure_future(self._release(acquisition.result()))
+        self._releases.add(release)
+        release.add_done_callback(self._releases.discard)
+
+
+class ImageModelLimiters:
+    """ One ModelLimiter per model, created on first use, shared through Redis when a client is given.
+    `lease` only bounds how long the slot of a crashed worker stays taken: held slots renew their lease. """
+
+    def __init__(self, limit: int, queue_size: int, timeout: float, retry_after: int,
+                 redis_client=None, lease: int = 300):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.redis_client = redis_client
+        self.lease = lease
+        self._limiters: dict[str, ModelLimiter] = {}
+
+    def slot(self, model: str):
+        """Hold a slot of `model` for the duration of the block"""
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            if self.redis_client is not None:
+                semaphore = RedisSemaphore(self.redis_client, f"image_model_slots:{model}", self.limit, self.lease)
+            else:
+                semaphore = LocalSemaphore(self.limit)
+            limiter = ModelLimiter(model, semaphore, self.queue_size, self.timeout, self.retry_after)
+            self._limiters[model] = limiter
+        return limiter.slot()
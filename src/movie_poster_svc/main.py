@@ -3,43 +3,54 @@ import os
 import sys
 import logging
 import json
+import time
+import asyncio
+import hashlib
+import tempfile
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterator
 from urllib.parse import urlparse
-import redis
 import base64
-import requests
 import io
 from collections import OrderedDict
+from dataclasses import dataclass, replace
+from email.utils import format_datetime, parsedate_to_datetime
 
+import httpx
 import openai
 import uvicorn
 
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.openapi.utils import get_openapi
 from fastapi.templating import Jinja2Templates
 from fastapi_logger.logger import log_request
 
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.instrumentation.openai import OpenAIInstrumentor
-from azure.ai.inference.tracing import AIInferenceInstrumentor 
-from azure.monitor.opentelemetry import configure_azure_monitor
 from PIL import Image
-from azure.identity import ManagedIdentityCredential
 from dotenv import load_dotenv
 from pydantic import BaseModel
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
 
-from azure.identity import DefaultAzureCredential, ManagedIdentityCredential, AzureCliCredential
+from azure.identity.aio import ManagedIdentityCredential as AsyncManagedIdentityCredential
+from azure.identity.aio import AzureCliCredential as AsyncAzureCliCredential
 
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.storage.blob import BlobProperties, ContentSettings
+from azure.storage.blob.aio import BlobServiceClient, ContainerClient, StorageStreamDownloader
 
-
-from azure.storage.blob import BlobServiceClient
-from azure.storage.queue import QueueClient
-from azure.storage.queue import QueueServiceClient
+from cache import CacheEntry, DiskCache, MemoryCache
+from description_cache import DescriptionCache, LocalTier, RedisTier
+from limiter import CapacityExceeded, ImageModelLimiters
+from retry_policy import retry_policy_from_env
+from renditions import FORMATS, negotiate_format, render, snap_width
+from redis_factory import create_async_redis_client
+from dependencies import Dependencies
+from health import health_checker_from_env
+from jobs import JobQueueFull, MemoryJobStore, PosterJob, PosterJobRunner, RedisJobStore
 
 
 openai.log = "debug"
-OpenAIInstrumentor().instrument()
-AIInferenceInstrumentor().instrument() 
 
 load_dotenv()
 
@@ -67,15 +78,49 @@ logger_uvicorn = logging.getLogger('uvicorn.error')
 
 logging.getLogger('azure.identity').setLevel(logging.DEBUG)
 
-if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
-    logger_uvicorn.info("configure_azure_monitor")
-    configure_azure_monitor()
 
+def configure_telemetry() -> None:
+    """Instrument the OpenAI and AI Inference clients and export to Azure Monitor.
+    Slow to import and to run, so it runs in the background at startup with the other dependencies."""
+    from opentelemetry.instrumentation.openai import OpenAIInstrumentor
+    from azure.ai.inference.tracing import AIInferenceInstrumentor
+    from azure.monitor.opentelemetry import configure_azure_monitor
+
+    OpenAIInstrumentor().instrument()
+    AIInferenceInstrumentor().instrument()
+    if os.getenv("APPLICATIONINSIGHTS_CONNECTION_STRING"):
+        logger_uvicorn.info("configure_azure_monitor")
+        configure_azure_monitor()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Build the clients in the background and start the poster job workers,
+    stop them and release the async clients held by the service on shutdown."""
+    service.dependencies.start()
+    if service._use_cache:
+        service.redis_client.start()
+    service.jobs.start()
+    service.health.start()
+    yield
+    await service.health.stop()
+    await service.dependencies.stop()
+    await service.jobs.stop()
+    await service.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 FastAPIInstrumentor.instrument_app(app, excluded_urls="liveness,readiness")
 templates = Jinja2Templates(directory="templates")
 
+@dataclass
+class BlobClients:
+    """ The Blob Storage clients of the movieposters container """
+    credential: AsyncManagedIdentityCredential | AsyncAzureCliCredential
+    service_client: BlobServiceClient
+    container_client: ContainerClient
+    streaming_service_client: BlobServiceClient
+    streaming_container_client: ContainerClient
+
 class MoviePoster(BaseModel):
     """ Class to manage the movie poster """
     id: str | None = None
@@ -108,15 +153,25 @@ class GeneratedMovie(BaseModel):
     payload: MovieGalleryPayload | None = None
     error: str | None = None
 
+def b64_decoded_length(b64: str) -> int:
+    """Size of the bytes encoded by a base64 string"""
+    return len(b64) * 3 // 4 - b64[-2:].count("=")
+
+def b64_chunks(b64: str, chunk_size: int) -> Iterator[bytes]:
+    """Decode a base64 string chunk by chunk, never holding more than one decoded chunk"""
+    # 4 base64 characters encode 3 bytes
+    step = max(4, chunk_size // 3 * 4)
+    for start in range(0, len(b64), step):
+        yield base64.b64decode(b64[start:start + step])
+
 class GenAiMovieService:
     
-    def get_generated_movie(self, movie_id: str) -> GeneratedMovie:
+    async def get_generated_movie(self, movie_id: str) -> GeneratedMovie:
         """Fetch generated movie information from the movie gallery microservice."""
-        import requests
         url = f"http://movie-gallery-svc/movies/{movie_id}"
         logger.info(f"Fetching generated movie info from {url}")
         try:
-            response = requests.get(url, timeout=10)
+            response = await self.http_client.get(url, timeout=10)
             response.raise_for_status()
             data = response.json()
             # Parse payload if present
@@ -141,36 +196,123 @@ class GenAiMovieService:
     """ Class to manage the access to OpenAI API to generate a new movie """
     def __init__(self):
         logger.info("Initializing GenAiMovieService")
-        logger.info("Initializing AzureOpenAI with api_key: %s, api_version: %s, azure_endpoint: %s",
-                    os.getenv("AZURE_OPENAI_API_KEY","-1"), os.getenv("OPENAI_API_VERSION","2024-08-01-preview"), os.getenv("AZURE_OPENAI_ENDPOINT"))
+        # the telemetry, OpenAI and Blob Storage clients are built in the background at startup (lifespan)
+        # or on first use, so /liveness answers at once and /readiness reports their state
+        self.dependencies = Dependencies(retry_interval=float(os.getenv("DEPENDENCY_RETRY_INTERVAL", "10")))
+        self.dependencies.add("telemetry", configure_telemetry, required=False)
+        self.dependencies.add("openai", self._create_openai_client)
+        self.dependencies.add("blob_storage", self._create_blob_clients)
 
-        self.client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY","-1"),
-            api_version=os.getenv("OPENAI_API_VERSION","2024-08-01-preview"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+        self.retry_policy = retry_policy_from_env()
+        # EXPLAIN_ERRORS=false returns the error message instead of asking gpt-4o to explain it
+        self.explain_errors = os.getenv("EXPLAIN_ERRORS", "true").lower() == "true"
+        # one pooled, keep-alive HTTP client shared by every outgoing (non OpenAI) request
+        self.http_client = httpx.AsyncClient(
+            timeout=100,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
         )
 
+        # TMDB source posters never change: keep them locally and only revalidate them from time to time
+        cache_dir = os.getenv("POSTER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "movie_poster_cache"))
+        self._source_poster_revalidate = int(os.getenv("SOURCE_POSTER_REVALIDATE_SECONDS", "86400"))
+        self.source_poster_memory = MemoryCache(int(os.getenv("SOURCE_POSTER_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024))))
+        self.source_poster_disk = DiskCache(os.path.join(cache_dir, "sources"), int(os.getenv("SOURCE_POSTER_CACHE_DISK_BYTES", str(512 * 1024 * 1024))))
+        logger.info("Source poster cache: %s", self.source_poster_disk.directory)
+
+        # generated posters served by /poster/{movie_id}.png, revalidated against the blob ETag after the TTL
+        self._poster_cache_ttl = int(os.getenv("POSTER_CACHE_TTL_SECONDS", "60"))
+        self.poster_memory = MemoryCache(int(os.getenv("POSTER_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024))))
+        self.poster_disk = DiskCache(os.path.join(cache_dir, "posters"), int(os.getenv("POSTER_CACHE_DISK_BYTES", str(1024 * 1024 * 1024))))
+        logger.info("Poster cache: %s", self.poster_disk.directory)
+
         self._use_cache = os.getenv("USE_CACHE", None) is not None
         logger.info("USE_CACHE: %s", self._use_cache)
         if self._use_cache:
             logger.info("Initializing Redis client")
-            #use managed identity to connect to redis (azure-rambi-storage-contributor)
-            managed_id_credential = ManagedIdentityCredential(client_id=os.getenv("AZURE_CLIENT_ID_BLOB"))
-            logger.info("managedIdCredential: %s", managed_id_credential)
-            redis_scope = "https://redis.azure.com/.default"
-            logger.info("Redis Scope: %s", redis_scope)
-            token = managed_id_credential.get_token(redis_scope)
-            logger.info("Token: %s", token)
-            if token is None:
-                logger.error("Redis client using password")
-                self.redis_client = redis.Redis(host=os.getenv("REDIS_HOST"), port=os.getenv("REDIS_PORT"), password=os.getenv("REDIS_PASSWORD"),ssl=True )
-            else:
-                logger.info("Redis Client using token")
-                user_name = self.extract_username_from_token(token.token)
-                logger.info("User name: %s", user_name)
-                self.redis_client = redis.Redis(host=os.getenv("REDIS_HOST"), port=os.getenv("REDIS_PORT"), username=user_name, password=token.token,ssl=True,decode_responses=True)
-            logger.info("Redis ping: %s", self.redis_client.ping())
+            #use managed identity to connect to redis (azure-rambi-storage-contributor),
+            #the token is renewed in the background once the event loop runs (lifespan)
+            self.redis_client = create_async_redis_client(client_id=os.getenv("AZURE_CLIENT_ID_BLOB"), name="movie-poster-svc")
 
+        # poster descriptions: in-process LRU tier, then Redis when USE_CACHE is set.
+        # Posters of existing movies never change, so descriptions live long and are refreshed in the background.
+        description_tiers = [LocalTier(int(os.getenv("DESCRIPTION_CACHE_LOCAL_ENTRIES", "1024")))]
+        if self._use_cache:
+            description_tiers.append(RedisTier(self.redis_client))
+        self.description_cache = DescriptionCache(
+            description_tiers,
+            ttl=int(os.getenv("DESCRIPTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+            stale_ttl=int(os.getenv("DESCRIPTION_CACHE_STALE_SECONDS", str(365 * 24 * 3600))),
+            model="gpt-4o"
+        )
+        logger.info("Description cache tiers: %s, ttl: %s", [tier.name for tier in description_tiers], self.description_cache.ttl)
+
+        # image model calls: a concurrency limit per model with a bounded wait queue,
+        # counted in Redis across the gunicorn workers and the replicas when USE_CACHE is set
+        self.image_limiters = ImageModelLimiters(
+            limit=int(os.getenv("IMAGE_MODEL_CONCURRENCY", "4")),
+            queue_size=int(os.getenv("IMAGE_MODEL_QUEUE_SIZE", "8")),
+            timeout=float(os.getenv("IMAGE_MODEL_QUEUE_TIMEOUT", "120")),
+            retry_after=int(os.getenv("IMAGE_MODEL_RETRY_AFTER", "30")),
+            redis_client=self.redis_client if self._use_cache else None,
+            lease=int(os.getenv("IMAGE_MODEL_LEASE_SECONDS", "300"))
+        )
+
+        # poster generation jobs (POST /generate?background=true): a bounded queue consumed by a few workers per process.
+        # With USE_CACHE the jobs are stored in Redis so any worker or replica can answer GET /jobs/{job_id},
+        # without it background=true falls back to a synchronous generation.
+        job_expire = int(os.getenv("POSTER_JOB_EXPIRE_SECONDS", "3600"))
+        self.jobs = PosterJobRunner(
+            RedisJobStore(self.redis_client, job_expire) if self._use_cache else MemoryJobStore(),
+            generate=self.generate_poster,
+            explain=self.explain_exception,
+            workers=int(os.getenv("POSTER_JOB_WORKERS", "2")),
+            queue_size=int(os.getenv("POSTER_JOB_QUEUE_SIZE", "20")),
+            placeholder=self.placeholder_url
+        )
+        self.job_retry_after = os.getenv("POSTER_JOB_RETRY_AFTER", "10")
+
+        # generated posters are uploaded as blocks of POSTER_UPLOAD_BLOCK_SIZE, POSTER_UPLOAD_CONCURRENCY at a time
+        self._upload_block_size = int(os.getenv("POSTER_UPLOAD_BLOCK_SIZE", str(1024 * 1024)))
+        self._upload_concurrency = int(os.getenv("POSTER_UPLOAD_CONCURRENCY", "4"))
+
+        # streaming mode: posters missing from the local cache are piped chunk by chunk from Blob Storage,
+        # through a client whose download requests are limited to one chunk
+        self.poster_streaming = os.getenv("POSTER_STREAMING", "false").lower() == "true"
+        self._poster_chunk_size = int(os.getenv("POSTER_CHUNK_SIZE", str(256 * 1024)))
+        logger.info("Poster streaming: %s, chunk size: %d", self.poster_streaming, self._poster_chunk_size)
+
+        # renditions: resized WebP/AVIF/JPEG copies of the posters stored under renditions/ in the container,
+        # rendered on first request, or right after the upload for the POSTER_RENDITIONS presets (e.g. "300:webp,300:jpeg")
+        self.rendition_widths = [int(width) for width in os.getenv("RENDITION_WIDTHS", "150,300,600").split(",") if width]
+        self._rendition_quality = int(os.getenv("RENDITION_QUALITY", "80"))
+        # POSTER_ACCEPT_NEGOTIATION: a resized rendition (w) without fmt is served in the best format of the Accept header
+        self.poster_negotiation = os.getenv("POSTER_ACCEPT_NEGOTIATION", "false").lower() == "true"
+        self._eager_renditions = [(int(width), fmt) for width, fmt in
+                                  (preset.split(":") for preset in os.getenv("POSTER_RENDITIONS", "").split(",") if preset)]
+        self._background_tasks = set()
+        logger.info("Rendition widths: %s, formats: %s, on upload: %s", self.rendition_widths, list(FORMATS), self._eager_renditions)
+
+        # readiness: the Blob Storage container, and Redis when it holds the caches and the poster jobs,
+        # checked in the background every HEALTH_CHECK_INTERVAL seconds
+        self.health = health_checker_from_env()
+        self.health.add("blob_storage", self.check_blob_storage)
+        if self._use_cache:
+            self.health.add("redis", self.check_redis)
+        logger.info("GenAiMovieService initialized")
+
+    def _create_openai_client(self) -> AsyncAzureOpenAI:
+        logger.info("Initializing AzureOpenAI with api_key: %s, api_version: %s, azure_endpoint: %s",
+                    os.getenv("AZURE_OPENAI_API_KEY","-1"), os.getenv("OPENAI_API_VERSION","2024-08-01-preview"), os.getenv("AZURE_OPENAI_ENDPOINT"))
+        return AsyncAzureOpenAI(
+            api_key=os.getenv("AZURE_OPENAI_API_KEY","-1"),
+            api_version=os.getenv("OPENAI_API_VERSION","2024-08-01-preview"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            # retried by self.retry_policy
+            max_retries=0
+        )
+
+    def _create_blob_clients(self) -> BlobClients:
         sa_url = os.getenv("STORAGE_ACCOUNT_BLOB_URL")
         logger.info("Initializing Azure Blob Storage client with account_url: %s", sa_url)
         #use managed identity to connect to redis (azure-rambi-storage-contributor)
@@ -181,139 +323,192 @@ class GenAiMovieService:
         #    logger.info("Using DefaultAzureCredential to connect to Blob Storage")
         if os.getenv("LOCAL_DEVELOPMENT", "false").lower() == "true":
             logger.info("Using AzureCliCredential to connect to Blob Storage")
-            managed_id_credential = AzureCliCredential()
+            credential = AsyncAzureCliCredential()
         else:
             #managed_id_credential = DefaultAzureCredential()
             logger.info("Using ManagedIdentityCredential to connect to Blob Storage")
-            managed_id_credential = ManagedIdentityCredential(client_id=os.getenv("AZURE_CLIENT_ID_BLOB"))
-        logger.info("** AZURE_CLIENT_ID_BLOB managedIdCredential: %s", managed_id_credential)
-        
-        self.blob_service_client = BlobServiceClient(account_url=sa_url, credential=managed_id_credential)
-        logger.info("Blob Service Client: %s", self.blob_service_client)
+            credential = AsyncManagedIdentityCredential(client_id=os.getenv("AZURE_CLIENT_ID_BLOB"))
+        logger.info("** AZURE_CLIENT_ID_BLOB managedIdCredential: %s", credential)
+
+        blob_service_client = BlobServiceClient(
+            account_url=sa_url,
+            credential=credential,
+            max_block_size=self._upload_block_size,
+            max_single_put_size=self._upload_block_size
+        )
+        logger.info("Blob Service Client: %s", blob_service_client)
         #for container in self.blob_service_client.list_containers():
         #    logger.info("==> Container name: %s", container['name'])
-        self.container_client = self.blob_service_client.get_container_client("movieposters")
-        logger.info("Container Client: %s", self.container_client)
-        logger.info("GenAiMovieService initialized")
+        streaming_blob_service_client = BlobServiceClient(
+            account_url=sa_url,
+            credential=credential,
+            max_single_get_size=self._poster_chunk_size,
+            max_chunk_get_size=self._poster_chunk_size
+        )
+        return BlobClients(
+            credential=credential,
+            service_client=blob_service_client,
+            container_client=blob_service_client.get_container_client("movieposters"),
+            streaming_service_client=streaming_blob_service_client,
+            streaming_container_client=streaming_blob_service_client.get_container_client("movieposters")
+        )
+
+    async def openai_client(self) -> AsyncAzureOpenAI:
+        """The OpenAI client, built in a worker thread on first use if the startup did not build it yet"""
+        return await self.dependencies["openai"].aget()
+
+    async def blob_clients(self) -> BlobClients:
+        """The Blob Storage clients (movieposters container, and the one of the streaming mode),
+        built in a worker thread on first use if the startup did not build them yet"""
+        return await self.dependencies["blob_storage"].aget()
+
+    async def check_blob_storage(self) -> None:
+        """Readiness check: read the properties of the movieposters container"""
+        blob_clients = self.dependencies["blob_storage"].peek()
+        if blob_clients is None:
+            raise RuntimeError("Blob Storage client not initialized")
+        await blob_clients.container_client.get_container_properties()
+
+    async def check_redis(self) -> None:
+        """Readiness check: PING Redis"""
+        await self.redis_client.ping()
+
+    async def close(self):
+        """Close the async clients (HTTP, OpenAI, Blob Storage, Redis)"""
+        logger.info("Closing GenAiMovieService clients")
+        await self.http_client.aclose()
+        client = self.dependencies["openai"].peek()
+        if client is not None:
+            await client.close()
+        blob_clients = self.dependencies["blob_storage"].peek()
+        if blob_clients is not None:
+            await blob_clients.service_client.close()
+            await blob_clients.streaming_service_client.close()
+            await blob_clients.credential.close()
+        if self._use_cache:
+            await self.redis_client.aclose()
 
-    def extract_username_from_token(self,token):
-        """Extract the username from the token"""
-        parts = token.split('.')
-        base64_str = parts[1]
-
-        if len(base64_str) % 4 == 2:
-            base64_str += "=="
-        elif len(base64_str) % 4 == 3:
-            base64_str += "="
-
-        json_bytes = base64.b64decode(base64_str)
-        json_str = json_bytes.decode('utf-8')
-        jwt = json.loads(json_str)
-        logger.info("extract_username_from_token: %s", jwt)
-        logger.info("extract_username_from_token oid: %s", jwt['oid'])
-        return jwt['oid']
-
-    def describe_poster(self, movie_title: str, poster_url: str) -> str:
-        """describe the movie poster using gp4o model"""
+    async def describe_poster(self, movie_title: str, poster_url: str) -> str:
+        """describe the movie poster using gp4o model, through the description cache"""
         logger.info("describe_poster %s called with %s", movie_title, poster_url)
         cache_key = f"poster_description:{movie_title}:{poster_url}"
         logger.info("cache_key %s", cache_key)
-        if self._use_cache:
-            logger.info("cache key %s", cache_key)
-            cached_description = self.redis_client.get(cache_key)
-            if cached_description:
-                logger.info("Cache hit for %s", cache_key)
-                if isinstance(cached_description, str):
-                    return cached_description
-                else:
-                    return cached_description.decode("utf-8")
         try:
-            logger.info("ask gpt4o")
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": [
-                        {
-                            "type": "text",
-                            "text": f"This is the '{movie_title}' movie poster. Describe it:"
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                    "url": poster_url
-                            }
-                        }
-                    ]}
-                ],
-                max_tokens=2000
-            )
-            # Return the generated description
-            description = response.choices[0].message.content
-            if self._use_cache:
-                logger.info("set cache for %s", cache_key)
-                self.redis_client.set(cache_key, description, ex=3600)
-            
+            description = await self.description_cache.get_or_compute(
+                cache_key, lambda: self._describe_poster(movie_title, poster_url))
             logger.info("describe_poster: %s", description)
         except Exception as e:
             logger.error("describe_poster error: %s", e)
             description = f"Unable to describe the movie poster for {movie_title}: {e}"
         return description
 
-    def store_poster(self, movie_id: str,  content) -> str:
-        """ Store the generated poster in Azure Blob Storage and return a sas url"""
+    async def _describe_poster(self, movie_title: str, poster_url: str) -> str:
+        """ask gpt4o to describe the movie poster"""
+        logger.info("ask gpt4o")
+        client = await self.openai_client()
+        response = await self.retry_policy.call_async(
+            "gpt-4o",
+            client.chat.completions.create,
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": [
+                    {
+                        "type": "text",
+                        "text": f"This is the '{movie_title}' movie poster. Describe it:"
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                                "url": poster_url
+                        }
+                    }
+                ]}
+            ],
+            max_tokens=2000
+        )
+        # Return the generated description
+        return response.choices[0].message.content
+
+    async def store_poster(self, movie_id: str,  content, digest: str | None = None, length: int | None = None) -> str:
+        """ Store the generated poster in Azure Blob Storage and return a sas url.
+        `content` is the bytes of the poster or an iterable of chunks of `length` bytes whose sha256 is `digest`"""
         # Upload the generated poster to Azure Blob Storage
         logger.info("store_poster %s", movie_id)
         blob_name = f"{movie_id}.png"
         logger.info("Blob name: %s", blob_name)
-        blob_client = self.container_client.get_blob_client(blob_name)
+        blob_clients = await self.blob_clients()
+        blob_client = blob_clients.container_client.get_blob_client(blob_name)
         logger.info("uploading.....")
-        blob_client.upload_blob(content, overwrite=True,blob_type="BlockBlob" )
+        # the content digest is the ETag served by /poster/{movie_id}.png, keep it with the blob
+        if digest is None and isinstance(content, bytes):
+            digest = hashlib.sha256(content).hexdigest()
+        metadata = {"sha256": digest} if digest is not None else None
+        await blob_client.upload_blob(content, length=length, overwrite=True, blob_type="BlockBlob", metadata=metadata,
+                                      max_concurrency=self._upload_concurrency)
+        self.poster_memory.remove(blob_name)
+        await asyncio.to_thread(self.poster_disk.remove, blob_name)
         logger.info("Uploaded poster to Azure Blob Storage: %s", blob_client.url)
+        for width, fmt in self._eager_renditions:
+            task = asyncio.create_task(self.rendition(movie_id, width, fmt))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
         return f"/poster/{movie_id}.png"
 
-    def generate_poster(self, movie_id: str) -> str:
+    async def store_poster_b64(self, movie_id: str, b64_json: str) -> str:
+        """ Store a base64 encoded poster, decoded block by block while it is uploaded """
+        digest = hashlib.sha256()
+        for chunk in b64_chunks(b64_json, self._upload_block_size):
+            digest.update(chunk)
+        return await self.store_poster(movie_id, b64_chunks(b64_json, self._upload_block_size),
+                                       digest=digest.hexdigest(), length=b64_decoded_length(b64_json))
+
+    async def generate_poster(self, movie_id: str) -> str:
         logger.info(f"generate_poster {movie_id} called")
-        return self.generate_poster_gpt_image_edit(movie_id)
+        return await self.generate_poster_gpt_image_edit(movie_id)
 
-    def generate_poster_dall_e(self, movie_id: str, poster_description: str) -> str:
+    async def generate_poster_dall_e(self, movie_id: str, poster_description: str) -> str:
         """ Generate a new movie poster based on the description """
         logger.info(f"generate_poster_dall_e {movie_id}")
         
-        response = self.client.images.generate( 
-            model="dall-e-3",
-            prompt="Generate a movie poster based on this description: " + poster_description,
-            n=1,
-            size='1024x1792'
-        )
-        json_response = json.loads(response.model_dump_json())
-        url = json_response["data"][0]["url"]
+        client = await self.openai_client()
+        async with self.image_limiters.slot("dall-e-3"):
+            response = await self.retry_policy.call_async(
+                "dall-e-3",
+                client.images.generate,
+                model="dall-e-3",
+                prompt="Generate a movie poster based on this description: " + poster_description,
+                n=1,
+                size='1024x1792'
+            )
+        url = response.data[0].url
         
-        blob_url = self.store_poster(movie_id, requests.get(url,timeout=100).content)
+        image_response = await self.http_client.get(url, timeout=100)
+        blob_url = await self.store_poster(movie_id, image_response.content)
         logger.info("generate_poster: %s", blob_url)
         return blob_url
     
-    def generate_poster_gpt_image(self, movie_id: str) -> str:
+    async def generate_poster_gpt_image(self, movie_id: str) -> str:
         """ Generate a new movie poster based on the description using gpt-image-1 model """
         logger.info("generate_poster_gpt_image")
-        generated_movie = self.get_generated_movie(movie_id)
+        generated_movie = await self.get_generated_movie(movie_id)
         if generated_movie.error is not None:
             raise Exception(f"Error fetching generated movie: {generated_movie.error}")
         
         logger.info("Generated movie poster_description")
-        response = self.client.images.generate( 
-            model="gpt-image-1",
-            prompt=self._generate_poster_prompt_image(generated_movie, add_poster_desc=True),
-            n=1,
-            size='1024x1536',
-            quality='medium'
-        )
-        json_response = json.loads(response.model_dump_json())
-        b64_json = json_response["data"][0]["b64_json"]
-        #decode the base64 string and save it as an image
-        image_data = base64.b64decode(b64_json)
+        client = await self.openai_client()
+        async with self.image_limiters.slot("gpt-image-1"):
+            response = await self.retry_policy.call_async(
+                "gpt-image-1",
+                client.images.generate,
+                model="gpt-image-1",
+                prompt=self._generate_poster_prompt_image(generated_movie, add_poster_desc=True),
+                n=1,
+                size='1024x1536',
+                quality='medium'
+            )
         logger.info("upload the image to blob storage")
-        blob_url = self.store_poster(movie_id, image_data)
+        blob_url = await self.store_poster_b64(movie_id, response.data[0].b64_json)
         logger.info("generate_poster gpt: %s", blob_url)
         return blob_url
     
@@ -335,36 +530,36 @@ class GenAiMovieService:
     
 
 
-    def generate_poster_gpt_image_edit(self, movie_id: str) -> str:
+    async def generate_poster_gpt_image_edit(self, movie_id: str) -> str:
         """ Generate a new movie poster based on the description using gpt-image-1 model with editing """
         logger.info("generate_poster_gpt_image_edit")
-        generated_movie = self.get_generated_movie(movie_id)
-        images = [
+        generated_movie = await self.get_generated_movie(movie_id)
+        # download both source posters at the same time
+        images = list(await asyncio.gather(
             self._image_to_io(generated_movie.payload.movie1.poster_url),
             self._image_to_io(generated_movie.payload.movie2.poster_url)
-        ]
-        response = self.client.images.edit(
-            model="gpt-image-1",
-            image=images,
-            prompt=self._generate_poster_prompt_image(generated_movie),
-            n=1,
-            size='1024x1536',
-            quality='medium'
-        )
-        json_response = json.loads(response.model_dump_json())
-        b64_json = json_response["data"][0]["b64_json"]
-        image_data = base64.b64decode(b64_json)
+        ))
+        client = await self.openai_client()
+        async with self.image_limiters.slot("gpt-image-1"):
+            response = await self.retry_policy.call_async(
+                "gpt-image-1",
+                client.images.edit,
+                model="gpt-image-1",
+                image=images,
+                prompt=self._generate_poster_prompt_image(generated_movie),
+                n=1,
+                size='1024x1536',
+                quality='medium'
+            )
         logger.info("upload the image to blob storage")
-        blob_url = self.store_poster(movie_id, image_data)
+        blob_url = await self.store_poster_b64(movie_id, response.data[0].b64_json)
         logger.info("generate_poster gpt edit: %s", blob_url)
         return blob_url
 
-    def _image_to_io(self, url: str) -> tuple[io.BytesIO, str]:
-        """ Convert an image URL to a BytesIO stream and detect mimetype """
+    async def _image_to_io(self, url: str) -> tuple[str, bytes, str]:
+        """ Download an image URL (through the source poster cache) and detect mimetype """
         logger.info("image_to_io called with %s", url)
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        content_type = response.headers.get("Content-Type", "image/jpeg")
+        content, content_type = await self._source_poster(url)
         # Only allow supported types
         if content_type not in ["image/jpeg", "image/png", "image/webp"]:
             logger.warning(f"Unsupported image type {content_type}, defaulting to image/jpeg")
@@ -374,7 +569,58 @@ class GenAiMovieService:
         parsed_url = urlparse(url)
         last_part = parsed_url.path.split('/')[-1]
         logger.info("image_to_io last part of url: %s", last_part)
-        return (last_part,response.content, content_type)
+        return (last_part, content, content_type)
+
+    async def _source_poster(self, url: str) -> tuple[bytes, str]:
+        """ Return the content and the content type of a source poster, from the cache when possible """
+        entry = self.source_poster_memory.get(url)
+        if entry is None:
+            entry = await asyncio.to_thread(self.source_poster_disk.get, url)
+        content = await self._cached_source_poster(entry) if entry is not None else None
+        if content is not None and time.time() - entry.stored_at < self._source_poster_revalidate:
+            logger.info("source poster cache hit %s", url)
+            return content, entry.content_type
+
+        headers = {}
+        if content is not None:
+            # stale copy: ask TMDB whether it changed instead of downloading it again
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            elif entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        response = await self.http_client.get(url, headers=headers, timeout=10)
+        if content is not None and response.status_code == 304:
+            logger.info("source poster not modified %s", url)
+            entry = await asyncio.to_thread(self.source_poster_disk.touch, entry)
+            self.source_poster_memory.put(replace(entry, content=content))
+            return content, entry.content_type
+        response.raise_for_status()
+
+        logger.info("source poster cache miss %s", url)
+        entry = CacheEntry(
+            key=url,
+            content_type=response.headers.get("Content-Type", "image/jpeg"),
+            size=len(response.content),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            content=response.content
+        )
+        self.source_poster_memory.put(entry)
+        await asyncio.to_thread(self.source_poster_disk.put, entry)
+        return entry.content, entry.content_type
+
+    async def _cached_source_poster(self, entry: CacheEntry) -> bytes | None:
+        """ Return the content of a cached source poster, loading it from the disk tier if needed """
+        if entry.content is not None:
+            return entry.content
+        try:
+            content = await asyncio.to_thread(self.source_poster_disk.read, entry)
+        except OSError as e:
+            logger.warning("source poster cache read error %s: %s", entry.key, e)
+            self.source_poster_disk.remove(entry.key)
+            return None
+        self.source_poster_memory.put(replace(entry, content=content))
+        return content
 
     def extract_error_message(self, e: Exception) -> str:
         """Extract the error message from the exception"""
@@ -385,11 +631,21 @@ class GenAiMovieService:
             error_message = str(e)
         return error_message
     
-    def explain_exception(self, exception: Exception) -> str:
+    def placeholder_url(self, e: Exception) -> str:
+        """URL of the placeholder poster showing the error message, returned instead of a poster that failed"""
+        return f"https://placehold.co/1024x1792/red/white?text={self.extract_error_message(e)}"
+
+    async def explain_exception(self, exception: Exception) -> str:
         """Explain the exception using the GPT-4o model"""
         logger.info("explain_exception called with %s", exception)
+        if isinstance(exception, CapacityExceeded):
+            # no extra model call while the service is already overloaded
+            return f"The poster service is busy, please retry in {exception.retry_after} seconds ({exception})"
+        if not self.explain_errors:
+            return self.extract_error_message(exception)
         try:
-            response = self.client.chat.completions.create(
+            client = await self.openai_client()
+            response = await client.chat.completions.create(
                 model="gpt-4o",
                 messages=[
                     {"role": "user", "content": f"explain using one or two sentences this error : {str(exception)}"}
@@ -403,19 +659,127 @@ class GenAiMovieService:
             logger.error("explain_exception: %s", e)
             return f"Unable to explain the exception: {e}"
 
-    # ...existing code...
-    def poster(self, movie_id: str) -> bytes:
-        """Retrieve the movie poster from Azure Blob Storage"""
-        logger.info("poster called with %s", movie_id)
+    async def cached_poster(self, movie_id: str, download: bool = True) -> CacheEntry | None:
+        """Retrieve the movie poster through the local cache (memory then disk tier) in front of Azure Blob Storage.
+        Return None on a cache miss when `download` is False."""
+        logger.info("cached_poster called with %s", movie_id)
+        blob_name = f"{movie_id}.png"
+        entry = self.poster_memory.get(blob_name)
+        if entry is None:
+            entry = await asyncio.to_thread(self.poster_disk.get, blob_name)
+        if entry is not None and time.time() - entry.stored_at < self._poster_cache_ttl:
+            logger.info("poster cache hit %s", blob_name)
+            return entry
+
+        blob_clients = await self.blob_clients()
+        blob_client = blob_clients.container_client.get_blob_client(blob_name)
+        if entry is not None:
+            # cheap HEAD request: the poster is downloaded again only if the blob was overwritten
+            properties = await blob_client.get_blob_properties()
+            if properties.etag == entry.etag:
+                logger.info("poster cache revalidated %s", blob_name)
+                touched = await asyncio.to_thread(self.poster_disk.touch, entry)
+                if entry.content is not None:
+                    self.poster_memory.put(replace(entry, stored_at=touched.stored_at))
+                return replace(entry, stored_at=touched.stored_at)
+
+        logger.info("poster cache miss %s", blob_name)
+        if not download:
+            return None
+        downloader = await blob_client.download_blob()
+        content = await downloader.readall()
+        entry = CacheEntry(
+            key=blob_name,
+            content_type="image/png",
+            size=len(content),
+            etag=downloader.properties.etag,
+            last_modified=format_datetime(downloader.properties.last_modified, usegmt=True),
+            content=content
+        )
+        self.poster_memory.put(entry)
+        await asyncio.to_thread(self.poster_disk.put, entry)
+        return entry
+
+    async def rendition(self, movie_id: str, width: int | None, fmt: str) -> CacheEntry:
+        """Retrieve a rendition of the movie poster: local cache, then Blob Storage, else rendered from the original and uploaded.
+        Renditions are named after the digest of the original poster, so they never need to be revalidated."""
+        logger.info("rendition called with %s w=%s fmt=%s", movie_id, width, fmt)
+        original = await self.cached_poster(movie_id)
+        blob_name = f"renditions/{movie_id}/{original.digest}/w{width or 'full'}.{fmt}"
+        entry = self.poster_memory.get(blob_name)
+        if entry is None:
+            entry = await asyncio.to_thread(self.poster_disk.get, blob_name)
+        if entry is not None:
+            logger.info("rendition cache hit %s", blob_name)
+            return entry
+
+        media_type = FORMATS[fmt][0]
+        blob_clients = await self.blob_clients()
+        blob_client = blob_clients.container_client.get_blob_client(blob_name)
+        try:
+            downloader = await blob_client.download_blob()
+            content = await downloader.readall()
+            logger.info("rendition downloaded %s", blob_name)
+        except ResourceNotFoundError:
+            source = original.content if original.content is not None else await asyncio.to_thread(self.poster_disk.read, original)
+            content = await asyncio.to_thread(render, source, width, fmt, self._rendition_quality)
+            logger.info("rendition rendered %s: %d bytes (original %d bytes)", blob_name, len(content), original.size)
+            try:
+                await blob_client.upload_blob(content, overwrite=True, blob_type="BlockBlob",
+                                              content_settings=ContentSettings(content_type=media_type))
+            except Exception as e:
+                # rendered again by the next process missing it
+                logger.error("rendition upload error %s: %s", blob_name, e)
+        entry = CacheEntry(key=blob_name, content_type=media_type, size=len(content),
+                           last_modified=original.last_modified, content=content)
+        self.poster_memory.put(entry)
+        await asyncio.to_thread(self.poster_disk.put, entry)
+        return entry
+
+    async def stream_poster(self, movie_id: str, offset: int | None = None, length: int | None = None) -> StorageStreamDownloader:
+        """Start a chunked download of (a range of) the movie poster from Azure Blob Storage"""
+        logger.info("stream_poster called with %s offset=%s length=%s", movie_id, offset, length)
+        blob_clients = await self.blob_clients()
+        blob_client = blob_clients.streaming_container_client.get_blob_client(f"{movie_id}.png")
+        return await blob_client.download_blob(offset=offset, length=length)
+
+    async def poster_properties(self, movie_id: str) -> BlobProperties:
+        """Read the properties of the movie poster in Azure Blob Storage, without downloading it"""
+        blob_clients = await self.blob_clients()
+        blob_client = blob_clients.streaming_container_client.get_blob_client(f"{movie_id}.png")
+        return await blob_client.get_blob_properties()
+
+    async def poster_chunks(self, movie_id: str, downloader: StorageStreamDownloader, cache: bool = True) -> AsyncIterator[bytes]:
+        """Yield the chunks of a poster download, copying a complete download to the disk tier of the poster cache"""
+        if not cache:
+            async for chunk in downloader.chunks():
+                yield chunk
+            return
         blob_name = f"{movie_id}.png"
-        blob_client = self.container_client.get_blob_client(blob_name)
+        temporary_path = self.poster_disk.temporary_path(blob_name)
+        digest = hashlib.sha256()
+        size = 0
         try:
-            blob_data = blob_client.download_blob().readall()
-            logger.info("Retrieved poster from Azure Blob Storage: %s", blob_client.url)
-            return blob_data
-        except Exception as e:
-            logger.error("poster exception: %s", e)
-            raise
+            with open(temporary_path, "wb") as file:
+                async for chunk in downloader.chunks():
+                    yield chunk
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await asyncio.to_thread(file.write, chunk)
+            entry = CacheEntry(
+                key=blob_name,
+                content_type="image/png",
+                size=size,
+                etag=downloader.properties.etag,
+                last_modified=format_datetime(downloader.properties.last_modified, usegmt=True),
+                digest=digest.hexdigest()
+            )
+            await asyncio.to_thread(self.poster_disk.put_file, entry, temporary_path)
+            logger.info("streamed poster %s added to the cache", blob_name)
+        finally:
+            # the client went away before the end of the download
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
 
 
 def custom_openapi():
@@ -459,30 +823,57 @@ async def env(request: Request):
 async def movie_poster_describe(request: Request, movie_title: str, url: str):
     """Function to show the movie poster description."""
     logger_uvicorn.info("movie_poster_describe")
-    return service.describe_poster(movie_title, url)
+    return await service.describe_poster(movie_title, url)
 
 @app.get('/store/{movie_title}')
 @log_request
 async def movie_poster_store(request: Request, movie_title: str, url: str):
     """Function to show the movie poster description."""
     logger_uvicorn.info("movie_poster_describe")
-    return service.store_poster(10, url)
+    return await service.store_poster(10, url)
 
-@app.post('/generate')
+@app.post('/generate', responses={202: {"model": PosterJob}})
 @log_request
-async def movie_poster_generate(request: Request, poster: MoviePoster) -> MoviePoster:
-    """Function to show the movie poster description."""
+async def movie_poster_generate(request: Request, poster: MoviePoster, background: bool = False) -> MoviePoster:
+    """Function to generate the movie poster.
+    With background=true, the generation is queued and the job is returned at once (202), poll GET /jobs/{job_id}.
+    The jobs are only kept in the process without USE_CACHE, where a poll can reach another worker or replica:
+    the poster is then generated synchronously (200)."""
+    if background and not service.jobs.store.shared:
+        logger.info("movie_poster_generate: no shared job store, generating %s synchronously", poster.id)
+        background = False
+    if background:
+        try:
+            job = await service.jobs.submit(poster.id)
+            return JSONResponse(job.model_dump(), status_code=202, headers={"Location": f"/jobs/{job.id}"})
+        except JobQueueFull as e:
+            logger.warning("movie_poster_generate rejected: %s", e)
+            return JSONResponse({"detail": str(e)}, status_code=503, headers={"Retry-After": service.job_retry_after})
+        except Exception as e:
+            # Redis error or open circuit: the job cannot be stored, the poster is generated synchronously
+            logger.warning("movie_poster_generate: job not stored, generating %s synchronously: %s", poster.id, e)
     try:
         logger.info("movie_poster_generate called with %s", poster)
-        poster.url = service.generate_poster(poster.id)
+        poster.url = await service.generate_poster(poster.id)
+    except CapacityExceeded as e:
+        logger.warning("movie_poster_generate rejected: %s", e)
+        return JSONResponse({"detail": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
     except Exception as e:  
         logger.error("movie_poster_generate error: %s", e)
-        error_message = service.extract_error_message(e)
-        logger.error("generate_poster error_message: %s", error_message)
-        poster.error = service.explain_exception(e)
-        poster.url = f"https://placehold.co/1024x1792/red/white?text={error_message}"
+        logger.error("generate_poster error_message: %s", service.extract_error_message(e))
+        poster.error = await service.explain_exception(e)
+        poster.url = service.placeholder_url(e)
     return poster
 
+@app.get('/jobs/{job_id}')
+@log_request
+async def poster_job(request: Request, job_id: str, wait: float = 0) -> PosterJob:
+    """Function to get a poster generation job, waiting up to `wait` seconds for its completion."""
+    job = await service.jobs.wait(job_id, timeout=min(wait, 60))
+    if job is None:
+        return JSONResponse({"detail": f"job {job_id} not found"}, status_code=404)
+    return job
+
 @app.get(
     "/poster/{movie_id}.png",
     # Set what the media type will be in the autogenerated OpenAPI specification.
@@ -498,14 +889,136 @@ async def movie_poster_generate(request: Request, poster: MoviePoster) -> MovieP
     # https://stackoverflow.com/questions/55873174/how-do-i-return-an-image-in-fastapi (If you already have the bytes of the image in memory)
     response_class=Response
 )
-def get_image(request: Request, movie_id: str):
-    """Function to get the movie poster image."""
-    logger.info("get_image called with %s", movie_id)
-    image_bytes: bytes = service.poster(movie_id)
-    headers = {'Content-Disposition': 'inline; filename="'+movie_id+'.png"'}
+async def get_image(request: Request, movie_id: str, w: int | None = None, fmt: str | None = None):
+    """Function to get the movie poster image.
+    `w` (width) and `fmt` (webp, avif, jpeg) select a rendition; a width without `fmt` may be negotiated from the Accept header,
+    the full-size poster stays the PNG of its URL."""
+    logger.info("get_image called with %s w=%s fmt=%s", movie_id, w, fmt)
+    negotiated = fmt is None and w is not None and service.poster_negotiation
+    if negotiated:
+        fmt = negotiate_format(request.headers.get("accept"))
+    if fmt == "png":
+        fmt = None
+    if fmt is not None and fmt not in FORMATS:
+        return Response(f"Unsupported format {fmt}, use one of {', '.join(FORMATS)}", status_code=400)
+    if w is not None or fmt is not None:
+        response = await rendition_image(request, movie_id, w, fmt)
+        if negotiated:
+            # the same URL serves PNG, WebP or AVIF depending on the Accept header
+            response.headers['Vary'] = 'Accept'
+        return response
+    entry = await service.cached_poster(movie_id, download=not service.poster_streaming)
+    if entry is None:
+        return await stream_image(request, movie_id)
+    return entry_response(request, entry, movie_id)
+
+async def rendition_image(request: Request, movie_id: str, width: int | None, fmt: str | None):
+    """Serve a resized and/or compressed rendition of the movie poster."""
+    entry = await service.rendition(movie_id, snap_width(width, service.rendition_widths), fmt or "png")
+    return entry_response(request, entry, movie_id, fmt or "png")
+
+def entry_response(request: Request, entry: CacheEntry, movie_id: str, extension: str = "png") -> Response:
+    """Answer a poster request from a cache entry: 304, Range (206/416) or the full content."""
+    headers = poster_headers(movie_id, poster_etag(entry.digest), entry.last_modified, extension)
     logger.info("get_image headers: %s", headers)
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
     # media_type here sets the media type of the actual response sent to the client.
-    return Response(image_bytes, headers=headers, media_type='image/png')
+    if entry.content is None:
+        # FileResponse answers Range requests by itself
+        return FileResponse(entry.path, headers=headers, media_type=entry.content_type)
+    byte_range = parse_byte_range(request.headers.get("range"), entry.size)
+    if byte_range is None:
+        return Response(entry.content, headers=headers, media_type=entry.content_type)
+    offset, length = byte_range
+    if offset >= entry.size:
+        return Response(status_code=416, headers={'Content-Range': f'bytes */{entry.size}'})
+    headers['Content-Range'] = f'bytes {offset}-{offset + length - 1}/{entry.size}'
+    return Response(entry.content[offset:offset + length], status_code=206, headers=headers, media_type=entry.content_type)
+
+async def stream_image(request: Request, movie_id: str):
+    """Pipe the movie poster from Azure Blob Storage to the client, one chunk at a time."""
+    if "if-none-match" in request.headers or "if-modified-since" in request.headers:
+        # answer a conditional request from the blob properties, before starting a download
+        properties = await service.poster_properties(movie_id)
+        digest = (properties.metadata or {}).get("sha256")
+        if digest:
+            headers = poster_headers(movie_id, poster_etag(digest), format_datetime(properties.last_modified, usegmt=True))
+            if is_not_modified(request, headers):
+                return Response(status_code=304, headers=headers)
+    byte_range = parse_byte_range(request.headers.get("range"), None)
+    offset, length = byte_range if byte_range is not None else (None, None)
+    try:
+        downloader = await service.stream_poster(movie_id, offset, length)
+    except HttpResponseError as e:
+        if e.status_code == 416:
+            return Response(status_code=416)
+        raise
+    properties = downloader.properties
+    digest = (properties.metadata or {}).get("sha256")
+    if not digest:
+        # a poster uploaded without its digest: downloaded whole once, the cache computes the digest
+        return entry_response(request, await service.cached_poster(movie_id), movie_id)
+    headers = poster_headers(movie_id, poster_etag(digest), format_datetime(properties.last_modified, usegmt=True))
+    logger.info("stream_image headers: %s", headers)
+    headers['Content-Length'] = str(downloader.size)
+    if byte_range is None:
+        return StreamingResponse(service.poster_chunks(movie_id, downloader), headers=headers, media_type='image/png')
+    headers['Content-Range'] = properties.content_range
+    return StreamingResponse(service.poster_chunks(movie_id, downloader, cache=False), status_code=206, headers=headers, media_type='image/png')
+
+def poster_etag(digest: str) -> str:
+    """Strong ETag of a poster or rendition: the sha256 of its content, whichever path serves it."""
+    return f'"{digest}"'
+
+def poster_headers(movie_id: str, etag: str, last_modified: str, extension: str = "png") -> dict:
+    """Headers of a movie poster response."""
+    headers = {
+        'Content-Disposition': 'inline; filename="'+movie_id+'.'+extension+'"',
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Accept-Ranges': 'bytes',
+        # posters can be regenerated: let browsers and proxies keep them but revalidate them
+        'Cache-Control': 'public, no-cache'
+    }
+    return headers
+
+def parse_byte_range(range_header: str | None, size: int | None) -> tuple[int, int | None] | None:
+    """Parse a single range `Range: bytes=...` header into (offset, length).
+    Return None when there is no range or when it is not supported (multiple ranges, suffix without known size)."""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start, _, end = range_header.removeprefix("bytes=").strip().partition("-")
+    try:
+        if start == "":
+            # suffix range: the last `end` bytes
+            if size is None or int(end) <= 0:
+                return None
+            offset = max(size - int(end), 0)
+            return offset, size - offset
+        offset = int(start)
+        length = int(end) - offset + 1 if end else None
+    except ValueError:
+        return None
+    if offset < 0 or (length is not None and length <= 0):
+        return None
+    if size is not None and offset < size and (length is None or offset + length > size):
+        length = size - offset
+    return offset, length
+
+def is_not_modified(request: Request, headers: dict) -> bool:
+    """Evaluate the If-None-Match / If-Modified-Since conditional request headers."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or headers["ETag"] in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and headers.get("Last-Modified"):
+        try:
+            return parsedate_to_datetime(headers["Last-Modified"]) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
 
 @app.get('/liveness')
 @log_request
@@ -516,8 +1029,14 @@ async def liveness(request: Request):
 @app.get('/readiness')
 @log_request
 async def readiness(request: Request):
-    """Function to check the readiness of the service."""
-    return  "readiness"
+    """Function to check the readiness of the service: ready once its clients are initialized
+    and the last background checks of Blob Storage and Redis passed."""
+    content = {"dependencies": service.dependencies.status(), "checks": service.health.status()}
+    if not service.dependencies.ready():
+        return JSONResponse({"status": "initializing", **content}, status_code=503)
+    if not service.health.ready():
+        return JSONResponse({"status": "unavailable", **content}, status_code=503)
+    return {"status": "ready", **content}
 
 if __name__ == '__main__':
     uvicorn.run('main:app', host='0.0.0.0', port=8002)
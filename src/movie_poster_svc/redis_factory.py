@@ -0,0 +1,359 @@
+"""Redis clients of the services: connection pool, Entra ID token renewed in the background, health checks, circuit breaker.
+
+The same module is used by movie_poster_svc (redis.asyncio) and movie_generator_svc (redis).
+Settings: REDIS_HOST, REDIS_PORT, REDIS_SSL, REDIS_AUTH (entra, password or none), REDIS_PASSWORD,
+REDIS_POOL_SIZE, REDIS_SOCKET_TIMEOUT, REDIS_HEALTH_CHECK_INTERVAL and the REDIS_CIRCUIT_* thresholds.
+"""
+import asyncio
+import base64
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable
+
+import redis
+import redis.asyncio
+from azure.identity import ManagedIdentityCredential
+from opentelemetry import metrics
+from redis.auth.token import SimpleToken
+from redis.credentials import StreamingCredentialProvider
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+REDIS_SCOPE = "https://redis.azure.com/.default"
+
+# client methods that do not send a command, passed through without the circuit breaker
+PASS_THROUGH = {"close", "aclose", "pipeline", "pubsub", "lock", "get_connection_kwargs", "get_encoder"}
+
+# errors of an unavailable or slow Redis; a command error (e.g. WRONGTYPE) does not open the circuit
+UNAVAILABLE_ERRORS = (redis.ConnectionError, redis.TimeoutError, OSError)
+
+
+def token_claims(token: str) -> dict:
+    """Decode the claims of a JWT, without checking its signature (Redis does)"""
+    payload = token.split(".")[1]
+    payload += "=" * (-len(payload) % 4)
+    return json.loads(base64.urlsafe_b64decode(payload))
+
+
+class EntraCredentialProvider(StreamingCredentialProvider):
+    """ Entra ID tokens of a managed identity as Redis credentials: the `oid` claim as user name, the token as password.
+
+    `start` runs a thread that gets a new token when `refresh_ratio` of the lifetime of the current one
+    has elapsed and hands it to redis-py, which re-AUTHs the idle pooled connections at once and the busy ones
+    when they are released. A failed renewal is retried every `retry_interval` seconds, the current token
+    stays in use meanwhile.
+    """
+
+    def __init__(self, credential, scope: str = REDIS_SCOPE, refresh_ratio: float = 0.75, retry_interval: float = 30.0):
+        self.credential = credential
+        self.scope = scope
+        self.refresh_ratio = refresh_ratio
+        self.retry_interval = retry_interval
+        self._token: SimpleToken | None = None
+        self._lock = threading.Lock()
+        self._callback: Callable[[Any], Any] | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _fetch(self) -> SimpleToken:
+        access_token = self.credential.get_token(self.scope)
+        token = SimpleToken(access_token.token, access_token.expires_on * 1000, time.time() * 1000, token_claims(access_token.token))
+        logger.info("Redis token of %s valid until %s", token.try_get("oid"), time.ctime(access_token.expires_on))
+        return token
+
+    def token(self) -> SimpleToken:
+        """The current token, fetched when missing or expired"""
+        with self._lock:
+            if self._token is None or self._token.is_expired():
+                self._token = self._fetch()
+            return self._token
+
+    def get_credentials(self) -> tuple[str, str]:
+        token = self.token()
+        return token.try_get("oid"), token.get_value()
+
+    async def get_credentials_async(self) -> tuple[str, str]:
+        token = self._token
+        if token is not None and not token.is_expired():
+            return token.try_get("oid"), token.get_value()
+        # the credential blocks on an HTTP call
+        return await asyncio.to_thread(self.get_credentials)
+
+    def on_next(self, callback: Callable[[Any], Any]) -> None:
+        self._callback = callback
+
+    def on_error(self, callback: Callable[[Exception], Any]) -> None:
+        # a failed renewal is logged and retried by the renewal thread
+        pass
+
+    def is_streaming(self) -> bool:
+        return True
+
+    def renewal_delay(self) -> float:
+        """Seconds until the current token must be renewed"""
+        token = self.token()
+        lifetime = token.get_expires_at_ms() - token.get_received_at_ms()
+        return max(0.0, (token.get_received_at_ms() + lifetime * self.refresh_ratio) / 1000 - time.time())
+
+    def renew(self) -> SimpleToken:
+        """Get a new token and re-AUTH the pooled connections with it"""
+        token = self._fetch()
+        with self._lock:
+            self._token = token
+        callback = self._callback
+        if callback is not None:
+            if inspect.iscoroutinefunction(callback):
+                if self._loop is None:
+                    raise RuntimeError("no event loop to re-AUTH the connections of an asyncio client")
+                asyncio.run_coroutine_threadsafe(callback(token), self._loop).result(self.retry_interval)
+            else:
+                callback(token)
+        logger.info("Redis connections re-authenticated")
+        return token
+
+    def start(self, loop: asyncio.AbstractEventLoop | None = None) -> None:
+        """Renew the token in a background thread; `loop` runs the re-AUTH of an asyncio client"""
+        self._loop = loop
+        if self._thread is not None:
+            return
+
+        def run():
+            delay = self.retry_interval
+            try:
+                delay = self.renewal_delay()
+            except Exception as e:
+                logger.error("Redis token error: %s", e)
+            while not self._stop.wait(delay):
+                try:
+                    self.renew()
+                    delay = self.renewal_delay()
+                except Exception as e:
+                    logger.error("Redis token renewal error, retry in %ss: %s", self.retry_interval, e)
+                    delay = self.retry_interval
+        self._thread = threading.Thread(target=run, name="redis-token-renewal", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background renewal"""
+        self._stop.set()
+
+
+class CircuitOpen(Exception):
+    """ Raised instead of calling Redis while the circuit is open """
+
+
+class CircuitBreaker:
+    """ Stops calling Redis for `reset_timeout` seconds after `failure_threshold` consecutive failed or slow calls
+    (slower than `slow_call_duration` seconds), so an unavailable Redis costs a fast CircuitOpen, handled by the
+    caches as a miss, instead of a socket timeout on every request.
+    Once `reset_timeout` has elapsed one call is let through (half open): it closes the circuit on success,
+    opens it again on failure.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 slow_call_duration: float = 0.5, meter: metrics.Meter | None = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_duration = slow_call_duration
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+        meter = meter or metrics.get_meter(__name__)
+        self._transitions = meter.create_counter(
+            "redis.circuit.transitions", unit="{transition}",
+            description="Changes of state of the Redis circuit breaker")
+        self._rejections = meter.create_counter(
+            "redis.circuit.rejections", unit="{call}",
+            description="Redis calls not sent because the circuit is open")
+        self._duration = meter.create_histogram(
+            "redis.command.duration", unit="s",
+            description="Duration of the Redis commands by outcome")
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning("Redis circuit %s: %s -> %s", self.name, self.state, state)
+            self.state = state
+            self._transitions.add(1, {"name": self.name, "state": state})
+
+    def allow(self) -> None:
+        """Raise CircuitOpen unless a call can be sent"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+                return
+        self._rejections.add(1, {"name": self.name})
+        raise CircuitOpen(f"Redis circuit {self.name} is {self.state}")
+
+    def record(self, command: str, duration: float, failed: bool) -> None:
+        """Record the outcome of a call; a command error answered by Redis is not a failure"""
+        slow = duration >= self.slow_call_duration
+        self._duration.record(duration, {"name": self.name, "command": command, "outcome": "error" if failed else "slow" if slow else "ok"})
+        with self._lock:
+            if failed or slow:
+                self._failures += 1
+                if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                    self._opened_at = time.monotonic()
+                    self._set_state(self.OPEN)
+            else:
+                self._failures = 0
+                self._set_state(self.CLOSED)
+
+
+class BreakerRedis:
+    """ A redis.Redis whose commands go through the circuit breaker """
+
+    def __init__(self, client: redis.Redis, breaker: CircuitBreaker, credential_provider: EntraCredentialProvider | None = None):
+        self.client = client
+        self.breaker = breaker
+        self.credential_provider = credential_provider
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.client, name)
+        if name.startswith("_") or name in PASS_THROUGH or not callable(attribute):
+            return attribute
+
+        def command(*args, **kwargs):
+            self.breaker.allow()
+            start = time.perf_counter()
+            failed = False
+            try:
+                return attribute(*args, **kwargs)
+            except UNAVAILABLE_ERRORS:
+                failed = True
+                raise
+            finally:
+                self.breaker.record(name, time.perf_counter() - start, failed)
+        return command
+
+    def start(self) -> None:
+        """Start the background token renewal"""
+        if self.credential_provider is not None:
+            self.credential_provider.start()
+
+    def close(self) -> None:
+        """Stop the token renewal and close the connections"""
+        if self.credential_provider is not None:
+            self.credential_provider.stop()
+        self.client.close()
+        self.client.connection_pool.disconnect()
+
+
+class AsyncBreakerRedis:
+    """ A redis.asyncio.Redis whose commands go through the circuit breaker """
+
+    def __init__(self, client: redis.asyncio.Redis, breaker: CircuitBreaker, credential_provider: EntraCredentialProvider | None = None):
+        self.client = client
+        self.breaker = breaker
+        self.credential_provider = credential_provider
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.client, name)
+        if name.startswith("_") or name in PASS_THROUGH or not callable(attribute):
+            return attribute
+
+        async def command(*args, **kwargs):
+            self.breaker.allow()
+            start = time.perf_counter()
+            failed = False
+            try:
+                return await attribute(*args, **kwargs)
+            except UNAVAILABLE_ERRORS:
+                failed = True
+                raise
+            finally:
+                self.breaker.record(name, time.perf_counter() - start, failed)
+        return command
+
+    def start(self) -> None:
+        """Start the background token renewal, from the event loop of the client"""
+        if self.credential_provider is not None:
+            self.credential_provider.start(asyncio.get_running_loop())
+
+    async def aclose(self) -> None:
+        """Stop the token renewal and close the connections"""
+        if self.credential_provider is not None:
+            self.credential_provider.stop()
+        await self.client.aclose()
+        await self.client.connection_pool.disconnect()
+
+
+def _pool_settings(client_id: str | None, credential) -> tuple[dict, EntraCredentialProvider | None]:
+    """Connection settings from the REDIS_* environment variables"""
+    settings = dict(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", "6380")),
+        # a command waits up to `timeout` seconds for a free connection of the pool
+        max_connections=int(os.getenv("REDIS_POOL_SIZE", "50")),
+        timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "2")),
+        socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "2")),
+        socket_connect_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "2")),
+        socket_keepalive=True,
+        # PING a connection idle for more than this many seconds before using it
+        health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30")),
+        decode_responses=True,
+    )
+    provider = None
+    auth = os.getenv("REDIS_AUTH", "entra").lower()
+    if auth == "entra":
+        provider = EntraCredentialProvider(
+            credential or ManagedIdentityCredential(client_id=client_id),
+            refresh_ratio=float(os.getenv("REDIS_TOKEN_REFRESH_RATIO", "0.75")))
+        settings["credential_provider"] = provider
+    elif auth == "password":
+        settings["password"] = os.getenv("REDIS_PASSWORD")
+    logger.info("Redis %s:%s, auth: %s, pool size: %s", settings["host"], settings["port"], auth, settings["max_connections"])
+    return settings, provider
+
+
+def _circuit_breaker(name: str, meter: metrics.Meter | None) -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        failure_threshold=int(os.getenv("REDIS_CIRCUIT_FAILURES", "5")),
+        reset_timeout=float(os.getenv("REDIS_CIRCUIT_RESET_SECONDS", "30")),
+        slow_call_duration=float(os.getenv("REDIS_CIRCUIT_SLOW_CALL_SECONDS", "0.5")),
+        meter=meter)
+
+
+def create_redis_client(client_id: str | None = None, credential=None, name: str = "redis",
+                        meter: metrics.Meter | None = None, ping: bool = False) -> BreakerRedis:
+    """A redis.Redis on a connection pool, with token renewal and circuit breaker.
+    With `ping` the server is pinged before the token renewal starts: on failure the client is closed, so a caller
+    retrying an unreachable Redis leaves neither a pool nor a renewal thread behind, and the error is raised."""
+    settings, provider = _pool_settings(client_id, credential)
+    if os.getenv("REDIS_SSL", "true").lower() == "true":
+        settings["connection_class"] = redis.SSLConnection
+    pool = redis.BlockingConnectionPool(**settings)
+    client = BreakerRedis(redis.Redis(connection_pool=pool, credential_provider=provider), _circuit_breaker(name, meter), provider)
+    if ping:
+        try:
+            logger.info("Redis ping: %s", client.ping())
+        except Exception:
+            client.close()
+            raise
+    client.start()
+    return client
+
+
+def create_async_redis_client(client_id: str | None = None, credential=None, name: str = "redis",
+                              meter: metrics.Meter | None = None) -> AsyncBreakerRedis:
+    """A redis.asyncio.Redis on a connection pool, with circuit breaker; call `start()` from the event loop
+    to renew the token in the background"""
+    settings, provider = _pool_settings(client_id, credential)
+    if os.getenv("REDIS_SSL", "true").lower() == "true":
+        settings["connection_class"] = redis.asyncio.SSLConnection
+    pool = redis.asyncio.BlockingConnectionPool(**settings)
+    return AsyncBreakerRedis(redis.asyncio.Redis(connection_pool=pool, credential_provider=provider), _circuit_breaker(name, meter), provider)
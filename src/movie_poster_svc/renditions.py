@@ -0,0 +1,54 @@
+"""Resized and compressed renditions (WebP, AVIF, JPEG) of the posters."""
+import io
+import logging
+
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# format name -> (media type, Pillow format)
+FORMATS = {
+    "png": ("image/png", "PNG"),
+    "webp": ("image/webp", "WEBP"),
+    "jpeg": ("image/jpeg", "JPEG"),
+}
+if features.check("avif"):
+    FORMATS["avif"] = ("image/avif", "AVIF")
+
+# preferred first when the format is negotiated from the Accept header
+NEGOTIATED_FORMATS = ["avif", "webp"]
+
+
+def negotiate_format(accept: str | None) -> str | None:
+    """Return the best rendition format accepted by the client, None to serve the original PNG"""
+    if not accept:
+        return None
+    accepted = {part.split(";")[0].strip().lower() for part in accept.split(",")}
+    for fmt in NEGOTIATED_FORMATS:
+        if fmt in FORMATS and FORMATS[fmt][0] in accepted:
+            return fmt
+    return None
+
+
+def snap_width(width: int | None, widths: list[int]) -> int | None:
+    """Round a requested width up to the closest allowed width, so a few renditions serve every request"""
+    if width is None or not widths:
+        return None
+    for allowed in sorted(widths):
+        if allowed >= width:
+            return allowed
+    return max(widths)
+
+
+def render(content: bytes, width: int | None, fmt: str, quality: int) -> bytes:
+    """Resize the poster to `width` pixels (keeping its ratio, never enlarging it) and encode it as `fmt`"""
+    with Image.open(io.BytesIO(content)) as image:
+        if width is not None and width < image.width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+        if fmt == "jpeg" and image.mode != "RGB":
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format=FORMATS[fmt][1], quality=quality)
+        return output.getvalue()
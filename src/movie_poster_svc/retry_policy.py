@@ -0,0 +1,196 @@
+"""Retry policy of the Azure OpenAI calls: Retry-After and x-ratelimit-* headers, jittered exponential backoff, retry budget.
+
+The same module is used by movie_poster_svc and movie_generator_svc; the OpenAI clients are created
+with max_retries=0 so the calls are retried here only.
+"""
+import asyncio
+import logging
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, TypeVar
+
+import openai
+from opentelemetry import metrics
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def parse_duration(value: str) -> float | None:
+    """Parse the x-ratelimit-reset-* durations (e.g. `20ms`, `1s`, `6m0s`) into seconds"""
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts or "".join(number + unit for number, unit in parts) != value.strip():
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def server_delay(headers) -> float | None:
+    """Delay requested by the server: retry-after-ms, Retry-After (seconds or HTTP date),
+    then the reset of an exhausted x-ratelimit-* quota"""
+    if headers is None:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+    except ValueError:
+        pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    delays = []
+    for quota in ("requests", "tokens"):
+        if headers.get(f"x-ratelimit-remaining-{quota}") == "0" and headers.get(f"x-ratelimit-reset-{quota}"):
+            delay = parse_duration(headers[f"x-ratelimit-reset-{quota}"])
+            if delay is not None:
+                delays.append(delay)
+    return max(delays) if delays else None
+
+
+class RetryBudget:
+    """ Bounds the retries of the whole process to a ratio of the calls, plus a small reserve refilled over time,
+    so a throttled deployment does not receive several times its normal traffic """
+
+    def __init__(self, ratio: float, reserve: float, refill_per_second: float):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.refill_per_second = refill_per_second
+        self._tokens = reserve
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.reserve, self._tokens + (now - self._updated_at) * self.refill_per_second)
+        self._updated_at = now
+
+    def deposit(self) -> None:
+        """Record a first attempt"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.reserve, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Take the right to retry, False when the budget is exhausted"""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """ Retries the throttled (429), timed out and failed (5xx) calls.
+
+    The delay is the one requested by the server when it gives one, else a full-jitter exponential backoff.
+    A call is not retried when the attempts are exhausted, when the requested delay exceeds `max_delay`
+    or when the retry budget shared by all the calls is exhausted.
+    """
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float, budget: RetryBudget,
+                 meter: metrics.Meter | None = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+        meter = meter or metrics.get_meter(__name__)
+        self._retries = meter.create_counter(
+            "openai.retries", unit="{retry}",
+            description="Azure OpenAI calls retried, by model and status")
+        self._given_up = meter.create_counter(
+            "openai.retries.given_up", unit="{call}",
+            description="Azure OpenAI calls failed without retry, by model and reason")
+
+    def delay(self, exception: Exception, attempt: int) -> float | None:
+        """Seconds to wait before the next attempt, None when the exception must not be retried"""
+        if isinstance(exception, (openai.APIConnectionError, openai.APITimeoutError)):
+            requested = None
+        elif isinstance(exception, openai.APIStatusError) and exception.status_code in RETRYABLE_STATUS_CODES:
+            requested = server_delay(exception.response.headers)
+        else:
+            return None
+        if requested is not None:
+            return requested
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _next_delay(self, exception: Exception, attempt: int, model: str) -> float | None:
+        delay = self.delay(exception, attempt)
+        reason = None
+        if delay is None:
+            reason = "not_retryable"
+        elif attempt + 1 >= self.max_attempts:
+            reason = "attempts"
+        elif delay > self.max_delay:
+            reason = "delay"
+        elif not self.budget.withdraw():
+            reason = "budget"
+        if reason is not None:
+            if reason != "not_retryable":
+                logger.warning("%s: no retry (%s) after %s", model, reason, exception)
+                self._given_up.add(1, {"model": model, "reason": reason})
+            return None
+        status = getattr(exception, "status_code", None) or type(exception).__name__
+        logger.warning("%s: retry %d in %.2fs after %s", model, attempt + 1, delay, exception)
+        self._retries.add(1, {"model": model, "status": str(status)})
+        return delay
+
+    async def call_async(self, model: str, function: Callable[..., Awaitable[T]], /, *args, **kwargs) -> T:
+        """Await `function(*args, **kwargs)` with retries"""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await function(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(e, attempt, model)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def call(self, model: str, function: Callable[..., T], /, *args, **kwargs) -> T:
+        """Call `function(*args, **kwargs)` with retries"""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(e, attempt, model)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+
+def retry_policy_from_env() -> RetryPolicy:
+    """Build the policy from the OPENAI_RETRY_* settings"""
+    return RetryPolicy(
+        max_attempts=int(os.getenv("OPENAI_RETRY_MAX_ATTEMPTS", "4")),
+        base_delay=float(os.getenv("OPENAI_RETRY_BASE_DELAY", "1")),
+        max_delay=float(os.getenv("OPENAI_RETRY_MAX_DELAY", "60")),
+        budget=RetryBudget(
+            ratio=float(os.getenv("OPENAI_RETRY_BUDGET_RATIO", "0.2")),
+            reserve=float(os.getenv("OPENAI_RETRY_BUDGET_RESERVE", "10")),
+            refill_per_second=float(os.getenv("OPENAI_RETRY_BUDGET_REFILL_PER_SECOND", "0.1"))
+        )
+    )
@@ -0,0 +1,65 @@
+"""Tests of the local poster caches."""
+from cache import CacheEntry, DiskCache, MemoryCache
+
+
+def entry(key: str, size: int, **kwargs) -> CacheEntry:
+    """Build an entry of `size` bytes"""
+    return CacheEntry(key=key, content_type="image/png", size=size, content=b"x" * size, **kwargs)
+
+
+def test_memory_cache_evicts_least_recently_used():
+    """The memory tier keeps its total size under the limit, evicting the oldest entries first"""
+    cache = MemoryCache(max_bytes=100)
+    cache.put(entry("a", 40))
+    cache.put(entry("b", 40))
+    assert cache.get("a") is not None
+    cache.put(entry("c", 40))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.current_bytes == 80
+
+
+def test_memory_cache_ignores_entries_larger_than_the_cache():
+    """An entry that can never fit does not flush the cache"""
+    cache = MemoryCache(max_bytes=100)
+    cache.put(entry("a", 40))
+    cache.put(entry("big", 101))
+
+    assert cache.get("big") is None
+    assert cache.get("a") is not None
+
+
+def test_disk_cache_round_trip(tmp_path):
+    """The disk tier stores the content in a file and keeps the metadata"""
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    stored = cache.put(entry("https://image.tmdb.org/t/p/original/a.jpg", 10, etag='"abc"'))
+
+    found = cache.get("https://image.tmdb.org/t/p/original/a.jpg")
+    assert found.path == stored.path
+    assert found.content is None
+    assert found.etag == '"abc"'
+    assert cache.read(found) == b"x" * 10
+
+
+def test_disk_cache_evicts_and_deletes_files(tmp_path):
+    """The disk tier keeps its total size under the limit and removes the evicted files"""
+    cache = DiskCache(str(tmp_path), max_bytes=100)
+    first = cache.put(entry("a", 60))
+    cache.put(entry("b", 60))
+
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    assert cache.current_bytes == 60
+    assert not (tmp_path / first.path).exists()
+
+
+def test_disk_cache_survives_restart(tmp_path):
+    """Entries written by a previous process are found again"""
+    DiskCache(str(tmp_path), max_bytes=1000).put(entry("a", 10, last_modified="Wed, 21 Oct 2015 07:28:00 GMT"))
+
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    found = cache.get("a")
+    assert found.last_modified == "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert cache.current_bytes == 10
@@ -0,0 +1,128 @@
+"""Tests of the poster description cache."""
+import asyncio
+
+import pytest
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+
+from description_cache import CachedValue, DescriptionCache, LocalTier
+
+
+class Model:
+    """Stand-in for gpt-4o counting its calls"""
+    def __init__(self, latency: float = 0.05, fail: bool = False):
+        self.calls = 0
+        self.latency = latency
+        self.fail = fail
+
+    async def describe(self) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError("429 Too Many Requests")
+        return f"description #{self.calls}"
+
+
+class BrokenTier:
+    """A tier whose backend is down"""
+    name = "broken"
+
+    async def get(self, key):
+        raise ConnectionError("redis is down")
+
+    async def set(self, key, value, expire):
+        raise ConnectionError("redis is down")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_call():
+    """Concurrent identical requests trigger a single model call"""
+    model = Model()
+    cache = DescriptionCache([LocalTier(10)], ttl=60)
+
+    results = await asyncio.gather(*[cache.get_or_compute("k", model.describe) for _ in range(10)])
+
+    assert model.calls == 1
+    assert set(results) == {"description #1"}
+    assert await cache.get_or_compute("k", model.describe) == "description #1"
+    assert model.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_value_is_served_while_revalidated():
+    """A stale value is returned at once and refreshed by a single background call"""
+    model = Model()
+    local = LocalTier(10)
+    cache = DescriptionCache([local], ttl=60, stale_ttl=3600)
+    await local.set("k", CachedValue(value="old", stored_at=0), 3600)
+
+    assert await cache.get_or_compute("k", model.describe) == "old"
+    assert await cache.get_or_compute("k", model.describe) == "old"
+    await asyncio.sleep(model.latency * 2)
+
+    assert model.calls == 1
+    assert await cache.get_or_compute("k", model.describe) == "description #1"
+
+
+@pytest.mark.asyncio
+async def test_failures_are_not_cached():
+    """Every concurrent caller gets the error, and the next request tries again"""
+    model = Model(fail=True)
+    cache = DescriptionCache([LocalTier(10)], ttl=60)
+
+    results = await asyncio.gather(*[cache.get_or_compute("k", model.describe) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert model.calls == 1
+
+    model.fail = False
+    assert await cache.get_or_compute("k", model.describe) == "description #2"
+
+
+@pytest.mark.asyncio
+async def test_lower_tier_hit_backfills_upper_tier_and_broken_tier_is_a_miss():
+    """A hit in a slower tier fills the faster ones; a tier in error does not fail the request"""
+    model = Model()
+    local, shared = LocalTier(10), LocalTier(10)
+    await shared.set("k", CachedValue(value="shared"), 60)
+    cache = DescriptionCache([local, BrokenTier(), shared], ttl=60)
+
+    assert await cache.get_or_compute("k", model.describe) == "shared"
+    assert (await local.get("k")).value == "shared"
+    assert await cache.get_or_compute("other", model.describe) == "description #1"
+
+
+@pytest.mark.asyncio
+async def test_local_tier_evicts_least_recently_used():
+    """The in-process tier is bounded by its number of entries"""
+    local = LocalTier(2)
+    for key in ("a", "b", "c"):
+        await local.set(key, CachedValue(value=key), 60)
+
+    assert await local.get("a") is None
+    assert (await local.get("c")).value == "c"
+
+
+@pytest.mark.asyncio
+async def test_metrics_are_tagged_by_tier():
+    """Hits, misses, errors and durations are exported per tier"""
+    reader = InMemoryMetricReader()
+    meter = MeterProvider(metric_readers=[reader]).get_meter("test")
+    model = Model()
+    cache = DescriptionCache([LocalTier(10), BrokenTier()], ttl=60, model="gpt-4o", meter=meter)
+
+    await cache.get_or_compute("k", model.describe)
+    await cache.get_or_compute("k", model.describe)
+
+    points = {}
+    for resource_metrics in reader.get_metrics_data().resource_metrics:
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                for point in metric.data.data_points:
+                    points[(metric.name, tuple(sorted(point.attributes.items())))] = point
+    assert points[("poster_description.cache.hits", (("state", "fresh"), ("tier", "local")))].value == 1
+    assert points[("poster_description.cache.misses", (("tier", "local"),))].value == 1
+    assert points[("poster_description.cache.misses", (("tier", "broken"),))].value == 1
+    assert points[("poster_description.cache.errors", (("operation", "get"), ("tier", "broken")))].value == 1
+    assert points[("poster_description.cache.errors", (("operation", "set"), ("tier", "broken")))].value == 1
+    assert points[("poster_description.model.duration", (("model", "gpt-4o"), ("outcome", "success")))].count == 1
+    assert points[("poster_description.cache.duration", (("operation", "get"), ("tier", "local")))].count == 2
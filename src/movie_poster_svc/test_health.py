@@ -0,0 +1,78 @@
+"""Tests of the readiness checks run in the background (health.py)."""
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from dependencies import Dependencies
+from health import FAILING, OK, HealthChecker
+
+
+@pytest.mark.asyncio
+async def test_checks_run_concurrently_within_the_timeout():
+    """A hung dependency fails its check after the timeout without delaying the others"""
+    checker = HealthChecker(interval=60, timeout=0.1)
+    calls = []
+
+    async def redis():
+        calls.append("redis")
+
+    def blob_storage():
+        time.sleep(0.5)
+
+    async def dapr():
+        raise ConnectionError("connection refused")
+
+    checker.add("redis", redis)
+    checker.add("blob_storage", blob_storage)
+    checker.add("dapr", dapr, required=False)
+    assert not checker.ready()
+
+    start = time.perf_counter()
+    await checker.check_all()
+
+    assert time.perf_counter() - start < 0.4
+    status = checker.status()
+    assert status["redis"]["state"] == OK
+    assert status["blob_storage"]["state"] == FAILING
+    assert status["blob_storage"]["error"] == "no answer within 0.1s"
+    assert status["dapr"]["error"] == "connection refused"
+    assert not checker.ready()
+
+    checker["blob_storage"].probe = lambda: None
+    await checker.check_all()
+    assert checker.ready(), "a failing check that is not required does not make the service unready"
+
+
+@pytest.mark.asyncio
+async def test_stale_results_are_not_ready():
+    """When the checks stopped running, the cached results no longer count"""
+    checker = HealthChecker(interval=0.01, timeout=0.01)
+    checker.add("redis", lambda: None)
+    await checker.check_all()
+    assert checker.ready()
+    await asyncio.sleep(0.1)
+    assert not checker.ready()
+
+
+def test_readiness_reports_the_cached_checks(monkeypatch):
+    """/readiness answers from the last checks, without calling the dependencies"""
+    calls = []
+    checker = HealthChecker(interval=60)
+    checker.add("blob_storage", lambda: calls.append("blob_storage") or False)
+    monkeypatch.setattr(main.service, "health", checker)
+    dependencies = Dependencies()
+    for name in ("openai", "blob_storage"):
+        dependencies.add(name, lambda: None).set(object())
+    monkeypatch.setattr(main.service, "dependencies", dependencies)
+    asyncio.run(checker.check_all())
+
+    client = TestClient(main.app)
+    for _ in range(3):
+        response = client.get("/readiness")
+        assert response.status_code == 503
+        assert response.json()["status"] == "unavailable"
+        assert response.json()["checks"]["blob_storage"]["error"] == "check failed"
+    assert calls == ["blob_storage"]
@@ -0,0 +1,127 @@
+"""Tests of the poster generation jobs."""
+import asyncio
+
+import pytest
+
+from jobs import FAILED, QUEUED, SUCCEEDED, JobQueueFull, MemoryJobStore, PosterJobRunner
+
+
+class Generator:
+    """Stand-in for the poster generation"""
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.running = 0
+        self.max_running = 0
+
+    async def generate(self, movie_id: str) -> str:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.latency)
+            if movie_id == "broken":
+                raise RuntimeError("content_policy_violation")
+            return f"https://example.com/{movie_id}.png"
+        finally:
+            self.running -= 1
+
+    async def explain(self, exception: Exception) -> str:
+        return f"explained: {exception}"
+
+
+@pytest.mark.asyncio
+async def test_jobs_run_in_the_background_with_bounded_workers():
+    """submit returns at once, at most `workers` generations run together"""
+    generator = Generator()
+    runner = PosterJobRunner(MemoryJobStore(), generator.generate, generator.explain, workers=2, queue_size=10)
+    runner.start()
+    try:
+        jobs = [await runner.submit(f"movie_{i}") for i in range(5)]
+        assert all(job.status == QUEUED for job in jobs)
+
+        done = await asyncio.gather(*[runner.wait(job.id, timeout=5, interval=0.01) for job in jobs])
+
+        assert [job.status for job in done] == [SUCCEEDED] * 5
+        assert done[0].url == "https://example.com/movie_0.png"
+        assert generator.max_running == 2
+    finally:
+        await runner.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_job_is_explained():
+    """A failed generation ends the job with the explanation of the error and the placeholder poster"""
+    generator = Generator(latency=0)
+    runner = PosterJobRunner(MemoryJobStore(), generator.generate, generator.explain, workers=1, queue_size=1,
+                             placeholder=lambda exception: f"https://placehold.co/1024x1792?text={exception}")
+    runner.start()
+    try:
+        job = await runner.wait((await runner.submit("broken")).id, timeout=5, interval=0.01)
+        assert job.status == FAILED
+        assert job.url == "https://placehold.co/1024x1792?text=content_policy_violation"
+        assert job.error == "explained: content_policy_violation"
+    finally:
+        await runner.stop()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_and_unknown_job_is_none():
+    """Jobs beyond the queue size are rejected at once"""
+    generator = Generator()
+    runner = PosterJobRunner(MemoryJobStore(), generator.generate, generator.explain, workers=1, queue_size=1)
+    await runner.submit("movie_1")
+    with pytest.raises(JobQueueFull):
+        await runner.submit("movie_2")
+    assert await runner.wait("unknown", timeout=0) is None
+
+
+class SlowJobStore(MemoryJobStore):
+    """Stand-in for the Redis job store: storing a job takes a round trip"""
+    async def put(self, job):
+        await asyncio.sleep(0.01)
+        await super().put(job)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_submits_do_not_overfill_the_queue():
+    """Concurrent submits beyond the queue size are rejected with JobQueueFull, every accepted job is queued"""
+    generator = Generator()
+    runner = PosterJobRunner(SlowJobStore(), generator.generate, generator.explain, workers=1, queue_size=3)
+    results = await asyncio.gather(*[runner.submit(f"movie_{i}") for i in range(6)], return_exceptions=True)
+    assert sum(isinstance(result, JobQueueFull) for result in results) == 3
+    assert runner.queue_depth() == 3
+
+
+class FailingStore(MemoryJobStore):
+    """Job store losing its connection once the jobs are queued"""
+    down = False
+
+    async def put(self, job):
+        if self.down:
+            raise ConnectionError("redis down")
+        await super().put(job)
+
+
+@pytest.mark.asyncio
+async def test_store_errors_do_not_stop_the_workers():
+    """A job whose status cannot be stored is still generated, and the worker goes on with the next jobs"""
+    generator = Generator(latency=0)
+    store = FailingStore()
+    generated = []
+
+    async def generate(movie_id: str) -> str:
+        generated.append(movie_id)
+        return await generator.generate(movie_id)
+
+    runner = PosterJobRunner(store, generate, generator.explain, workers=1, queue_size=2)
+    for i in range(2):
+        await runner.submit(f"movie_{i}")
+    store.down = True
+    runner.start()
+    try:
+        await asyncio.wait_for(runner._queue.join(), timeout=5)
+        assert generated == ["movie_0", "movie_1"]
+        with pytest.raises(ConnectionError):
+            await runner.submit("movie_3")
+        assert runner.queue_depth() == 0
+    finally:
+        await runner.stop()
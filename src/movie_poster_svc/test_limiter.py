@@ -0,0 +1,135 @@
+"""Tests of the admission control of the image model calls."""
+import asyncio
+
+import pytest
+
+from limiter import CapacityExceeded, ImageModelLimiters, RedisSemaphore
+from redis_factory import CircuitOpen
+
+
+class Model:
+    """Stand-in for an image model counting the concurrent calls"""
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.running = 0
+        self.max_running = 0
+
+    async def call(self, limiters: ImageModelLimiters, model: str) -> str:
+        async with limiters.slot(model):
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            await asyncio.sleep(self.latency)
+            self.running -= 1
+        return "image"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_are_limited_per_model():
+    """At most `limit` calls of a model run together, the others wait their turn"""
+    model, other = Model(), Model()
+    limiters = ImageModelLimiters(limit=2, queue_size=10, timeout=5, retry_after=1)
+
+    await asyncio.gather(*[model.call(limiters, "gpt-image-1") for _ in range(6)],
+                         *[other.call(limiters, "dall-e-3") for _ in range(2)])
+
+    assert model.max_running == 2
+    assert other.max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_calls_beyond_the_queue_are_rejected_at_once():
+    """A full wait queue rejects with the Retry-After delay instead of waiting"""
+    model = Model(latency=0.2)
+    limiters = ImageModelLimiters(limit=1, queue_size=1, timeout=5, retry_after=7)
+
+    results = await asyncio.gather(*[model.call(limiters, "gpt-image-1") for _ in range(4)], return_exceptions=True)
+
+    rejected = [result for result in results if isinstance(result, CapacityExceeded)]
+    assert len(rejected) == 2
+    assert rejected[0].retry_after == 7
+    assert results.count("image") == 2
+
+
+@pytest.mark.asyncio
+async def test_wait_timeout_is_rejected():
+    """A call waiting longer than the timeout gives up"""
+    model = Model(latency=0.3)
+    limiters = ImageModelLimiters(limit=1, queue_size=5, timeout=0.05, retry_after=1)
+
+    results = await asyncio.gather(model.call(limiters, "gpt-image-1"), model.call(limiters, "gpt-image-1"),
+                                   return_exceptions=True)
+
+    assert results[0] == "image"
+    assert isinstance(results[1], CapacityExceeded)
+
+
+class UnavailableRedis:
+    """Stand-in for a Redis client whose circuit is open"""
+    async def eval(self, *args):
+        raise CircuitOpen("Redis circuit redis is open")
+
+
+class LeaseRedis:
+    """Stand-in for a Redis client holding one sorted set of leases"""
+    def __init__(self):
+        self.leases: dict[str, float] = {}
+
+    async def eval(self, script, numkeys, key, now, lease, limit, token):
+        self.leases = {member: expiry for member, expiry in self.leases.items() if expiry > now}
+        if len(self.leases) >= limit:
+            return 0
+        self.leases[token] = now + lease
+        return 1
+
+    async def zadd(self, key, mapping, xx=False):
+        self.leases.update({member: expiry for member, expiry in mapping.items() if not xx or member in self.leases})
+
+    async def expire(self, key, seconds):
+        pass
+
+    async def zrem(self, key, token):
+        self.leases.pop(token, None)
+
+
+@pytest.mark.asyncio
+async def test_unavailable_redis_falls_back_to_a_limit_per_process():
+    """Without Redis the calls are still limited, by the process, instead of failing"""
+    model = Model()
+    limiters = ImageModelLimiters(limit=2, queue_size=10, timeout=5, retry_after=1, redis_client=UnavailableRedis())
+
+    results = await asyncio.gather(*[model.call(limiters, "gpt-image-1") for _ in range(6)])
+
+    assert results == ["image"] * 6
+    assert model.max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_held_slot_renews_its_lease():
+    """A call longer than the lease keeps its slot"""
+    redis_client = LeaseRedis()
+    semaphore = RedisSemaphore(redis_client, "image_model_slots:gpt-image-1", limit=1, lease=0.06, interval=0.01)
+
+    acquired, token = await semaphore.try_acquire()
+    await asyncio.sleep(0.2)
+    assert acquired and token in redis_client.leases
+    assert not (await semaphore.try_acquire())[0]
+
+    await semaphore.release(token)
+    acquired, token = await semaphore.try_acquire()
+    assert acquired
+    await semaphore.release(token)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_wait_gives_the_slot_back():
+    """A call cancelled while waiting for a slot does not keep it"""
+    model = Model(latency=0.1)
+    limiters = ImageModelLimiters(limit=1, queue_size=5, timeout=5, retry_after=1)
+
+    first = asyncio.create_task(model.call(limiters, "gpt-image-1"))
+    waiting = asyncio.create_task(model.call(limiters, "gpt-image-1"))
+    await asyncio.sleep(0.02)
+    waiting.cancel()
+    await first
+
+    assert await asyncio.wait_for(model.call(limiters, "gpt-image-1"), 1) == "image"
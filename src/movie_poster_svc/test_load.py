@@ -0,0 +1,149 @@
+"""Load test of the movie poster service request path against local stand-ins.
+
+Azure OpenAI, the movie gallery, TMDB and Blob Storage are replaced by in-process
+stand-ins that only wait for the duration of the real calls, so the test runs
+without any Azure resource. The same burst of poster generations is sent twice:
+once with a stand-in that blocks like the former synchronous clients did, and
+once with an awaitable stand-in. Run with `pytest -s test_load.py` to print the
+measured numbers.
+"""
+import asyncio
+import base64
+import os
+import time
+
+import httpx
+import pytest
+from openai.types import Image, ImagesResponse
+
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "http://127.0.0.1:1")
+os.environ.setdefault("STORAGE_ACCOUNT_BLOB_URL", "https://127.0.0.1:10000/devstoreaccount1")
+
+import main
+from cache import CacheEntry
+from dependencies import Dependencies
+from limiter import ImageModelLimiters
+from main import GeneratedMovie, MovieGalleryPayload, MovieGalleryPayloadMovie
+
+# Latency of one gpt-image-1 edit call, scaled down from tens of seconds.
+IMAGE_EDIT_LATENCY = 0.3
+# Number of poster generations sent at the same time.
+BURST_SIZE = 8
+# 1x1 transparent PNG.
+PNG_B64 = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+
+
+class StandInImages:
+    """Stand-in for the `images` resource of the OpenAI client"""
+    def __init__(self, blocking: bool):
+        self._blocking = blocking
+        self.started = asyncio.Event()
+
+    async def edit(self, **kwargs) -> ImagesResponse:
+        """Wait like gpt-image-1 does, blocking the event loop or not"""
+        self.started.set()
+        if self._blocking:
+            time.sleep(IMAGE_EDIT_LATENCY)
+        else:
+            await asyncio.sleep(IMAGE_EDIT_LATENCY)
+        return ImagesResponse(created=0, data=[Image(b64_json=PNG_B64)])
+
+
+class StandInOpenAI:
+    """Stand-in for AsyncAzureOpenAI"""
+    def __init__(self, blocking: bool):
+        self.images = StandInImages(blocking)
+
+
+async def stand_in_generated_movie(movie_id: str) -> GeneratedMovie:
+    """Stand-in for the movie gallery service"""
+    await asyncio.sleep(0.01)
+    movie = MovieGalleryPayloadMovie(id="1", title="t", plot="p", poster_url="https://image.tmdb.org/t/p/original/1.jpg")
+    return GeneratedMovie(id=movie_id, title="t", plot="p", poster_description="d",
+                          payload=MovieGalleryPayload(movie1=movie, movie2=movie, genre="Comedy"))
+
+
+async def stand_in_image_to_io(url: str) -> tuple[str, bytes, str]:
+    """Stand-in for the TMDB poster download"""
+    await asyncio.sleep(0.01)
+    return ("1.png", base64.b64decode(PNG_B64), "image/png")
+
+
+async def stand_in_store_poster(movie_id: str, content, digest: str | None = None, length: int | None = None) -> str:
+    """Stand-in for the Blob Storage upload"""
+    await asyncio.sleep(0.01)
+    assert len(b"".join(content)) == length
+    return f"/poster/{movie_id}.png"
+
+
+async def stand_in_cached_poster(movie_id: str, download: bool = True) -> CacheEntry:
+    """Stand-in for the Blob Storage download"""
+    await asyncio.sleep(0.01)
+    content = base64.b64decode(PNG_B64)
+    return CacheEntry(key=f"{movie_id}.png", content_type="image/png", size=len(content),
+                      last_modified="Wed, 21 Oct 2015 07:28:00 GMT", content=content)
+
+
+@pytest.fixture
+def stand_ins(monkeypatch):
+    """Replace every remote dependency of the service by a local stand-in"""
+    monkeypatch.setattr(main.service, "get_generated_movie", stand_in_generated_movie)
+    monkeypatch.setattr(main.service, "_image_to_io", stand_in_image_to_io)
+    monkeypatch.setattr(main.service, "store_poster", stand_in_store_poster)
+    monkeypatch.setattr(main.service, "cached_poster", stand_in_cached_poster)
+    # the whole burst is admitted: this test measures the event loop, not the admission control
+    monkeypatch.setattr(main.service, "image_limiters", ImageModelLimiters(limit=BURST_SIZE, queue_size=BURST_SIZE, timeout=60, retry_after=1))
+
+    def use_client(blocking: bool):
+        dependencies = Dependencies()
+        dependencies.add("openai", lambda: None).set(StandInOpenAI(blocking))
+        monkeypatch.setattr(main.service, "dependencies", dependencies)
+    return use_client
+
+
+async def run_burst() -> dict:
+    """Send a burst of generations and measure /liveness and /poster while they run"""
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+        start = time.perf_counter()
+        generations = [
+            asyncio.create_task(client.post("/generate", json={"id": f"movie_{i}", "title": "t", "description": "d"}))
+            for i in range(BURST_SIZE)
+        ]
+        # probe the service once the generations reached the image model
+        await (await main.service.openai_client()).images.started.wait()
+        probe_start = time.perf_counter()
+        liveness = await client.get("/liveness")
+        liveness_latency = time.perf_counter() - probe_start
+        probe_start = time.perf_counter()
+        poster = await client.get("/poster/movie_0.png")
+        poster_latency = time.perf_counter() - probe_start
+        responses = await asyncio.gather(*generations)
+        total = time.perf_counter() - start
+
+    assert liveness.status_code == 200
+    assert poster.status_code == 200
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json()["error"] is None for response in responses)
+    return {"total": total, "liveness": liveness_latency, "poster": poster_latency}
+
+
+@pytest.mark.asyncio
+async def test_generation_burst_does_not_block_event_loop(stand_ins):
+    """The service keeps answering while several poster generations are running"""
+    stand_ins(blocking=True)
+    blocking = await run_burst()
+    stand_ins(blocking=False)
+    non_blocking = await run_burst()
+
+    print(f"\n{BURST_SIZE} generations of {IMAGE_EDIT_LATENCY}s each")
+    print(f"blocking client    : total={blocking['total']:.2f}s liveness={blocking['liveness']:.3f}s poster={blocking['poster']:.3f}s")
+    print(f"non-blocking client: total={non_blocking['total']:.2f}s liveness={non_blocking['liveness']:.3f}s poster={non_blocking['poster']:.3f}s")
+    print(f"concurrency gain   : x{blocking['total'] / non_blocking['total']:.1f}")
+
+    # blocking calls are serialized by the event loop...
+    assert blocking["total"] >= BURST_SIZE * IMAGE_EDIT_LATENCY
+    # ...awaited calls overlap, and probes are answered without waiting for them
+    assert non_blocking["total"] < 2 * IMAGE_EDIT_LATENCY
+    assert non_blocking["liveness"] < IMAGE_EDIT_LATENCY / 2
+    assert non_blocking["poster"] < IMAGE_EDIT_LATENCY / 2
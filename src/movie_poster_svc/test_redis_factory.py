@@ -0,0 +1,137 @@
+"""Tests of the Redis client factory, against a local Redis (REDIS_TEST_HOST, REDIS_TEST_PORT) when one is running."""
+import asyncio
+import base64
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+import redis
+from azure.core.credentials import AccessToken
+
+from redis_factory import CircuitBreaker, CircuitOpen, create_async_redis_client, create_redis_client
+
+REDIS_TEST_HOST = os.getenv("REDIS_TEST_HOST", "localhost")
+REDIS_TEST_PORT = int(os.getenv("REDIS_TEST_PORT", "6379"))
+
+
+def local_redis() -> bool:
+    try:
+        with socket.create_connection((REDIS_TEST_HOST, REDIS_TEST_PORT), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+requires_redis = pytest.mark.skipif(not local_redis(), reason=f"no Redis on {REDIS_TEST_HOST}:{REDIS_TEST_PORT}")
+
+
+def jwt(claims: dict) -> str:
+    def encode(data: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+    return f"{encode({'alg': 'none'})}.{encode(claims)}.signature"
+
+
+class Credential:
+    """Stand-in for the managed identity: each token belongs to the next user"""
+    def __init__(self, users: list[str]):
+        expires_on = int(time.time()) + 3600
+        self.tokens = {user: AccessToken(jwt({"oid": user, "exp": expires_on}), expires_on) for user in users}
+        self.calls = 0
+
+    def get_token(self, *scopes):
+        users = list(self.tokens)
+        user = users[min(self.calls, len(users) - 1)]
+        self.calls += 1
+        return self.tokens[user]
+
+
+@pytest.fixture
+def redis_env(monkeypatch):
+    monkeypatch.setenv("REDIS_HOST", REDIS_TEST_HOST)
+    monkeypatch.setenv("REDIS_PORT", str(REDIS_TEST_PORT))
+    monkeypatch.setenv("REDIS_SSL", "false")
+
+
+@requires_redis
+@pytest.mark.asyncio
+async def test_token_renewal_reauths_live_connections(redis_env):
+    """A renewed token re-AUTHs the pooled connections, which then run as the user of the new token"""
+    credential = Credential(["oid-1", "oid-2"])
+    admin = redis.Redis(host=REDIS_TEST_HOST, port=REDIS_TEST_PORT)
+    for user, token in credential.tokens.items():
+        admin.execute_command("ACL", "SETUSER", user, "on", "resetpass", f">{token.token}", "~*", "+@all")
+    client = create_async_redis_client(credential=credential, name="test")
+    try:
+        client.start()
+        assert await client.ping()
+        assert await client.execute_command("ACL", "WHOAMI") == "oid-1"
+
+        await asyncio.to_thread(client.credential_provider.renew)
+
+        assert await client.execute_command("ACL", "WHOAMI") == "oid-2"
+    finally:
+        await client.aclose()
+        for user in credential.tokens:
+            admin.execute_command("ACL", "DELUSER", user)
+        admin.close()
+
+
+@pytest.mark.asyncio
+async def test_unreachable_redis_opens_the_circuit(monkeypatch):
+    """After a few connection errors the calls fail at once with CircuitOpen, handled by the caches as misses"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    monkeypatch.setenv("REDIS_HOST", "127.0.0.1")
+    monkeypatch.setenv("REDIS_PORT", str(port))
+    monkeypatch.setenv("REDIS_SSL", "false")
+    monkeypatch.setenv("REDIS_AUTH", "none")
+    monkeypatch.setenv("REDIS_CIRCUIT_FAILURES", "2")
+    client = create_async_redis_client(name="test")
+    try:
+        for _ in range(2):
+            with pytest.raises(redis.ConnectionError):
+                await client.get("key")
+        start = time.perf_counter()
+        with pytest.raises(CircuitOpen):
+            await client.get("key")
+        assert time.perf_counter() - start < 0.1
+        assert client.breaker.state == CircuitBreaker.OPEN
+    finally:
+        await client.aclose()
+
+
+
+def test_failed_first_ping_leaves_no_renewal_thread(monkeypatch):
+    """A client whose first ping fails is closed before its token renewal starts, so retries leak nothing"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    monkeypatch.setenv("REDIS_HOST", "127.0.0.1")
+    monkeypatch.setenv("REDIS_PORT", str(port))
+    monkeypatch.setenv("REDIS_SSL", "false")
+    monkeypatch.setenv("REDIS_AUTH", "entra")
+    renewals = sum(thread.name == "redis-token-renewal" for thread in threading.enumerate())
+    for _ in range(3):
+        with pytest.raises(redis.ConnectionError):
+            create_redis_client(credential=Credential(["app"]), name="test", ping=True)
+    assert sum(thread.name == "redis-token-renewal" for thread in threading.enumerate()) == renewals
+
+def test_half_open_circuit_closes_after_a_successful_call():
+    """Once the reset timeout elapsed one call is let through, its success closes the circuit"""
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05, slow_call_duration=1)
+    breaker.record("get", 2.0, failed=False)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+
+    time.sleep(0.06)
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    breaker.record("get", 0.01, failed=False)
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,39 @@
+"""Tests of the poster renditions."""
+import io
+
+from PIL import Image
+
+from renditions import FORMATS, negotiate_format, render, snap_width
+
+
+def png(width: int, height: int) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGBA", (width, height), (200, 10, 10, 255)).save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_format_is_negotiated_from_accept():
+    """The best accepted compressed format wins, the original PNG otherwise"""
+    assert negotiate_format("image/webp,image/png,*/*;q=0.8") == "webp"
+    best = "avif" if "avif" in FORMATS else "webp"
+    assert negotiate_format("image/avif,image/webp,image/apng,*/*;q=0.8") == best
+    assert negotiate_format("*/*") is None
+    assert negotiate_format(None) is None
+
+
+def test_width_is_snapped_to_allowed_widths():
+    """A few renditions serve every requested width"""
+    assert snap_width(280, [150, 300, 600]) == 300
+    assert snap_width(1000, [150, 300, 600]) == 600
+    assert snap_width(None, [150, 300, 600]) is None
+
+
+def test_render_resizes_and_compresses():
+    """The rendition keeps the ratio, is never enlarged and is encoded in the requested format"""
+    original = png(1024, 1536)
+    for fmt, (media_type, pillow_format) in FORMATS.items():
+        with Image.open(io.BytesIO(render(original, 300, fmt, 80))) as image:
+            assert image.format == pillow_format
+            assert image.size == (300, 450)
+    with Image.open(io.BytesIO(render(png(100, 150), 300, "jpeg", 80))) as image:
+        assert image.size == (100, 150)
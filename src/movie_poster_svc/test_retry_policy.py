@@ -0,0 +1,82 @@
+"""Tests of the retry policy of the Azure OpenAI calls."""
+import httpx
+import openai
+import pytest
+
+from retry_policy import RetryBudget, RetryPolicy, parse_duration, server_delay
+
+
+def throttled(headers: dict | None = None, status_code: int = 429) -> openai.APIStatusError:
+    """A throttling error as raised by the OpenAI client"""
+    request = httpx.Request("POST", "https://example.openai.azure.com/openai/deployments/gpt-4o/chat/completions")
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+    error_class = openai.RateLimitError if status_code == 429 else openai.APIStatusError
+    return error_class("throttled", response=response, body=None)
+
+
+class Model:
+    """Stand-in for a model failing a number of times"""
+    def __init__(self, errors: list[Exception]):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def create(self, **kwargs) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def policy(max_attempts: int = 4, max_delay: float = 1, reserve: float = 10) -> RetryPolicy:
+    return RetryPolicy(max_attempts=max_attempts, base_delay=0.001, max_delay=max_delay,
+                       budget=RetryBudget(ratio=0, reserve=reserve, refill_per_second=0))
+
+
+def test_server_delay_headers():
+    """retry-after-ms, Retry-After and an exhausted x-ratelimit quota give the delay"""
+    assert server_delay(httpx.Headers({"retry-after-ms": "250", "retry-after": "3"})) == 0.25
+    assert server_delay(httpx.Headers({"retry-after": "3"})) == 3
+    assert server_delay(httpx.Headers({"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "1m30s",
+                                       "x-ratelimit-remaining-requests": "5", "x-ratelimit-reset-requests": "2s"})) == 90
+    assert server_delay(httpx.Headers({})) is None
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("7") == 7
+
+
+@pytest.mark.asyncio
+async def test_throttled_call_is_retried_after_the_requested_delay():
+    """A 429 then a 503 are retried, and the call succeeds"""
+    model = Model([throttled({"retry-after-ms": "10"}), throttled(status_code=503)])
+    assert await policy().call_async("gpt-4o", model.create, model="gpt-4o") == "ok"
+    assert model.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_no_retry_beyond_attempts_delay_or_budget():
+    """Attempts, too long a requested delay and the retry budget stop the retries"""
+    model = Model([throttled()] * 5)
+    with pytest.raises(openai.RateLimitError):
+        await policy(max_attempts=2).call_async("gpt-4o", model.create)
+    assert model.calls == 2
+
+    model = Model([throttled({"retry-after": "120"})])
+    with pytest.raises(openai.RateLimitError):
+        await policy(max_delay=60).call_async("gpt-4o", model.create)
+    assert model.calls == 1
+
+    model = Model([throttled()] * 5)
+    with pytest.raises(openai.RateLimitError):
+        await policy(reserve=1).call_async("gpt-4o", model.create)
+    assert model.calls == 2
+
+
+def test_client_errors_are_not_retried():
+    """A 400 (e.g. content policy) fails at once"""
+    model = Model([throttled(status_code=400)])
+
+    def create():
+        model.calls += 1
+        raise model.errors.pop(0)
+    with pytest.raises(openai.APIStatusError):
+        policy().call("gpt-4o", create)
+    assert model.calls == 1